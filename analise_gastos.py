@@ -0,0 +1,174 @@
+import bisect
+import datetime
+import logging
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict
+import config
+import metricas
+import arquivamento
+from database import get_db, ouvintes_alteracao_gastos
+from texto_utils import normalizar_texto
+
+logger = logging.getLogger(__name__)
+
+# --- Análise de gastos por período (resumo_gastos) ---
+# Os gastos do período e do período anterior de mesmo tamanho são carregados uma única vez em colunas
+# compactas (array de dias, valores e códigos de categoria/estabelecimento, com dicionário de nomes), ordenadas
+# por data. Cada período vira um intervalo contíguo das colunas (bisect), e as agregações percorrem só esse
+# intervalo. O resultado fica em cache por (wa_id, inicio, fim) e é invalidado a cada escrita em gastos do usuário.
+
+analise_cache_total = metricas.Contador("agente_analise_cache_total", "Consultas ao cache de análises de gastos por resultado (hit, miss).", ("resultado",))
+
+class ColunasGastos:
+    """Gastos de um usuário em colunas, ordenados por dia."""
+    __slots__ = ("dias", "valores", "categorias", "estabelecimentos", "nomes_categorias", "nomes_estabelecimentos")
+
+    def __init__(self, linhas):
+        """linhas: (data ISO, valor, categoria, descrição) em ordem de data; datas inválidas são ignoradas."""
+        self.dias = array('l'); self.valores = array('d'); self.categorias = array('l'); self.estabelecimentos = array('l')
+        self.nomes_categorias = []; self.nomes_estabelecimentos = []
+        codigos_cat = {}; codigos_est = {}
+        for data, valor, categoria, descricao in linhas:
+            try: dia = datetime.date.fromisoformat(data).toordinal()
+            except (TypeError, ValueError): logger.warning("Gasto com data inválida '%s' fora da análise.", data); continue
+            categoria = categoria or "Sem categoria"; estabelecimento = normalizar_texto(descricao)
+            if categoria not in codigos_cat: codigos_cat[categoria] = len(self.nomes_categorias); self.nomes_categorias.append(categoria)
+            if estabelecimento not in codigos_est: # Exibido como escrito na primeira ocorrência
+                codigos_est[estabelecimento] = len(self.nomes_estabelecimentos); self.nomes_estabelecimentos.append(descricao.strip())
+            self.dias.append(dia); self.valores.append(valor)
+            self.categorias.append(codigos_cat[categoria]); self.estabelecimentos.append(codigos_est[estabelecimento])
+
+    def intervalo(self, inicio, fim):
+        """Índices [i, j) dos gastos entre as datas inicio e fim (inclusivas)."""
+        return bisect.bisect_left(self.dias, inicio.toordinal()), bisect.bisect_right(self.dias, fim.toordinal())
+
+    def somar_por_codigo(self, codigos, nomes, i, j):
+        """[(nome, total, quantidade)] agregados no intervalo, do maior total para o menor."""
+        totais = [0.0] * len(nomes); quantidades = [0] * len(nomes)
+        for codigo, valor in zip(codigos[i:j], self.valores[i:j]):
+            totais[codigo] += valor; quantidades[codigo] += 1
+        return sorted(((nomes[c], totais[c], quantidades[c]) for c in range(len(nomes)) if quantidades[c]), key=lambda t: -t[1])
+
+    def somar_codigos(self, codigos, selecionados, i, j):
+        """(total, quantidade) dos gastos do intervalo cujo código está em selecionados."""
+        valores = [v for c, v in zip(codigos[i:j], self.valores[i:j]) if c in selecionados]
+        return math.fsum(valores), len(valores)
+
+def periodo_anterior(inicio, fim):
+    """Período de comparação: para períodos de um mês ("maio", "este mês"), o mês anterior inteiro ou o mesmo
+    trecho dele; para "este ano", o mesmo trecho do ano anterior; senão, os mesmos N dias imediatamente antes."""
+    if inicio.day == 1 and (inicio.year, inicio.month) == (fim.year, fim.month):
+        fim_mes_ant = inicio - datetime.timedelta(days=1); ini_ant = fim_mes_ant.replace(day=1)
+        if (fim + datetime.timedelta(days=1)).day == 1: return ini_ant, fim_mes_ant
+        return ini_ant, min(ini_ant + (fim - inicio), fim_mes_ant)
+    if (inicio.month, inicio.day) == (1, 1) and inicio.year == fim.year:
+        try: fim_ant = fim.replace(year=fim.year - 1)
+        except ValueError: fim_ant = fim.replace(year=fim.year - 1, day=28) # 29/02
+        return inicio.replace(year=inicio.year - 1), fim_ant
+    dias = (fim - inicio).days + 1
+    return inicio - datetime.timedelta(days=dias), inicio - datetime.timedelta(days=1)
+
+def carregar_colunas(wa_id, inicio, fim):
+    """Carrega os gastos de wa_id entre inicio e fim (datas ISO) do banco principal e dos arquivos anuais. Datas fora
+    do formato AAAA-MM-DD ("2026-10-2") ficariam na faixa pela comparação de texto e não são carregadas."""
+    db = get_db()
+    sql = ("SELECT data_efetiva, valor, categoria, descricao FROM {tabela} WHERE wa_id = ? AND data_efetiva BETWEEN ? AND ? "
+           "AND " + arquivamento.FILTRO_DATA_ISO + " ORDER BY data_efetiva")
+    params = (wa_id, inicio, fim)
+    linhas = db.execute(sql.format(tabela="gastos"), params).fetchall()
+    antigos = arquivamento.buscar_nos_arquivos(db, sql, params, inicio, fim, math.inf)
+    if antigos: linhas = sorted(antigos + linhas, key=lambda r: r[0])
+    return ColunasGastos(linhas)
+
+class _Analise:
+    """Colunas carregadas + resultado agregado de um (wa_id, inicio, fim)."""
+    __slots__ = ("colunas", "resultado", "faixas", "criado_em")
+
+def _analisar(wa_id, inicio, fim, hoje):
+    ini_ant, fim_ant = periodo_anterior(inicio, fim)
+    colunas = carregar_colunas(wa_id, ini_ant.isoformat(), fim.isoformat())
+    i, j = colunas.intervalo(inicio, fim); i_ant, j_ant = colunas.intervalo(ini_ant, fim_ant)
+    total = math.fsum(colunas.valores[i:j]); total_ant = math.fsum(colunas.valores[i_ant:j_ant])
+    dias = max(1, (min(fim, hoje) - inicio).days + 1) # Período que inclui o futuro: média só até hoje
+    anteriores = {nome: t for nome, t, _ in colunas.somar_por_codigo(colunas.categorias, colunas.nomes_categorias, i_ant, j_ant)}
+    analise = _Analise()
+    analise.colunas = colunas; analise.faixas = ((i, j), (i_ant, j_ant)); analise.criado_em = time.monotonic()
+    analise.resultado = {
+        "inicio": inicio.isoformat(), "fim": fim.isoformat(), "total": total, "quantidade": j - i,
+        "dias": dias, "media_diaria": total / dias,
+        "categorias": [{"categoria": nome, "total": t, "quantidade": q, "percentual": t / total * 100 if total else 0.0,
+                        "total_anterior": anteriores.get(nome, 0.0)}
+                       for nome, t, q in colunas.somar_por_codigo(colunas.categorias, colunas.nomes_categorias, i, j)],
+        "estabelecimentos": [{"descricao": nome, "total": t, "quantidade": q} for nome, t, q in
+                             colunas.somar_por_codigo(colunas.estabelecimentos, colunas.nomes_estabelecimentos, i, j)[:config.ANALISE_TOP_ESTABELECIMENTOS]],
+        "anterior": {"inicio": ini_ant.isoformat(), "fim": fim_ant.isoformat(), "total": total_ant, "quantidade": j_ant - i_ant},
+        "variacao_percentual": (total - total_ant) / total_ant * 100 if total_ant else None,
+    }
+    return analise
+
+class CacheAnalises:
+    def __init__(self, max_itens=None, ttl_segundos=None):
+        self.max_itens = max_itens or config.ANALISE_CACHE_MAX
+        self.ttl_segundos = ttl_segundos or config.ANALISE_CACHE_TTL_SEGUNDOS
+        self._itens = OrderedDict() # (wa_id, inicio, fim) -> _Analise
+        self._lock = threading.Lock()
+
+    def obter(self, chave):
+        with self._lock:
+            analise = self._itens.get(chave)
+            if analise is not None and time.monotonic() - analise.criado_em > self.ttl_segundos:
+                del self._itens[chave]; analise = None
+            if analise is not None: self._itens.move_to_end(chave)
+        analise_cache_total.inc(resultado="hit" if analise else "miss")
+        return analise
+
+    def guardar(self, chave, analise):
+        with self._lock:
+            self._itens[chave] = analise; self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens: self._itens.popitem(last=False)
+
+    def invalidar_usuario(self, wa_id):
+        with self._lock:
+            for chave in [c for c in self._itens if c[0] == wa_id]: del self._itens[chave]
+
+    def limpar(self):
+        with self._lock: self._itens.clear()
+
+cache_analises = CacheAnalises()
+ouvintes_alteracao_gastos.append(cache_analises.invalidar_usuario)
+
+def _resolver_filtro(colunas, termo):
+    """Códigos de categoria (nome igual ao termo) ou, se nenhuma bater, de estabelecimentos que contêm o termo."""
+    termo_normalizado = normalizar_texto(termo)
+    categorias = {c for c, nome in enumerate(colunas.nomes_categorias) if normalizar_texto(nome) == termo_normalizado}
+    if categorias:
+        return "categoria", colunas.nomes_categorias[next(iter(categorias))], colunas.categorias, categorias
+    estabelecimentos = {c for c, nome in enumerate(colunas.nomes_estabelecimentos) if termo_normalizado in normalizar_texto(nome)}
+    return "estabelecimento", termo.strip(), colunas.estabelecimentos, estabelecimentos
+
+def analisar_gastos(wa_id, inicio, fim, termo=None, hoje=None):
+    """Resumo dos gastos de wa_id entre inicio e fim (datas ISO, inclusivas) comparado ao período anterior.
+
+    Com termo (nome de categoria ou parte da descrição, ex.: 'alimentação', 'ifood'), o resultado inclui
+    "filtro" com o total, a quantidade e a média diária só desses gastos nos dois períodos."""
+    hoje = hoje or datetime.date.today()
+    chave = (wa_id, inicio, fim)
+    analise = cache_analises.obter(chave)
+    if analise is None:
+        comeco = time.perf_counter()
+        analise = _analisar(wa_id, datetime.date.fromisoformat(inicio), datetime.date.fromisoformat(fim), hoje)
+        cache_analises.guardar(chave, analise)
+        logger.debug("Análise de %s (%s a %s): %d gastos em %.1fms.", wa_id, inicio, fim, len(analise.colunas.valores), (time.perf_counter() - comeco) * 1000)
+    resultado = dict(analise.resultado)
+    if termo:
+        colunas = analise.colunas; (i, j), (i_ant, j_ant) = analise.faixas
+        tipo, rotulo, codigos, selecionados = _resolver_filtro(colunas, termo)
+        total, quantidade = colunas.somar_codigos(codigos, selecionados, i, j)
+        total_ant, quantidade_ant = colunas.somar_codigos(codigos, selecionados, i_ant, j_ant)
+        resultado["filtro"] = {"tipo": tipo, "rotulo": rotulo, "total": total, "quantidade": quantidade, "media_diaria": total / resultado["dias"],
+                               "total_anterior": total_ant, "quantidade_anterior": quantidade_ant,
+                               "variacao_percentual": (total - total_ant) / total_ant * 100 if total_ant else None}
+    return resultado
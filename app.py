@@ -1,13 +1,54 @@
-from flask import Flask, request, jsonify, g
-import json
+from flask import Flask, request, jsonify, g, Response
+import functools
+import hmac
+import io
+import logging
+import os
+import threading
+import time
 import config # Importa as configurações globais
-from database import init_db as initialize_database, close_db_connection, get_or_create_user # Importa funções do DB, incluindo as novas para usuários
-from gemini_handler import extrair_info_gemini, gemini_model # Importa do Gemini Handler
-from chatbot_logic import gerar_resposta_do_chatbot # Importa a lógica central do chatbot
-from whatsapp_utils import enviar_mensagem_whatsapp # Importa a função de envio do WhatsApp
+from log_config import configurar_logging, contexto_mensagem, log_payload
+configurar_logging() # Antes dos demais imports, para que os logs emitidos na inicialização dos módulos já saiam formatados
+from database import init_db as initialize_database, close_db_connection, get_or_create_user, get_user_profile, get_db # Importa funções do DB, incluindo as novas para usuários
+from gemini_handler import extrair_intencao, gemini_model # Importa do Gemini Handler
+from chatbot_logic import gerar_resposta_do_chatbot, pendencias, categorizar_gasto, contexto_gemini, PENDENCIA_GASTO # Importa a lógica central do chatbot
+from importacao_extratos import LEITORES, ErroImportacao, importar_extrato # Importação em lote de extratos
+from whatsapp_utils import enviar_mensagem_whatsapp, EnvioRecusado # Importa a função de envio do WhatsApp
+from fila_mensagens import FilaMensagens, FalhaPermanente # Fila durável das mensagens recebidas pelo webhook
+from deduplicacao import IndiceDeduplicacao # Evita reprocessar reentregas da Meta
+from executor_usuarios import ExecutorPorUsuario # Execução ordenada por usuário e paralela entre usuários
+import metricas # Histogramas/contadores expostos em /metrics
+import intencao_local
+from gemini_handler import cache_intencoes
+from database import cache_perfis
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-app.teardown_appcontext(close_db_connection) # Registra a função para fechar a conexão com o banco de dados no contexto da aplicação
+app.teardown_appcontext(close_db_connection) # Ao fim de cada contexto a conexão volta ao pool (transações esquecidas são desfeitas)
+
+def pode_coalescer(wa_id, mensagem):
+    """Se a mensagem pode ser unida a outras do mesmo usuário na fila. Respostas que dependem do estado da conversa
+    (onboarding, gasto aguardando confirmação) e confirmações/cancelamentos ficam sempre separadas."""
+    if intencao_local.interpretar_degradado(mensagem["texto"])[0] in ("confirmar_operacao", "cancelar_operacao"): return False
+    perfil = get_user_profile(wa_id)
+    if not perfil or not perfil["onboarding_complete"]: return False
+    return pendencias.obter(wa_id, PENDENCIA_GASTO) is None
+
+fila = FilaMensagens(config.FILA_DATABASE_FILENAME, pode_coalescer=pode_coalescer)
+dedup = IndiceDeduplicacao(config.FILA_DATABASE_FILENAME)
+executor = None # Criado em iniciar_processamento_em_segundo_plano
+_processamento_pid = None # Processo em que os workers foram iniciados (um por processo: gunicorn, flask run, reloader)
+_processamento_lock = threading.Lock()
+
+# --- MÉTRICAS CALCULADAS NA COLETA (só custam algo quando /metrics é consultado) ---
+metricas.Gauge("agente_fila_jobs", "Jobs na fila durável por status.", lambda: fila.contar_por_status(), ("status",))
+metricas.Gauge("agente_executor_profundidade_shard", "Tarefas aguardando ou em execução por shard do executor.",
+               lambda: {str(i): p for i, p in enumerate(executor.profundidade_filas())} if executor else {}, ("shard",))
+metricas.Gauge("agente_dedup_duplicatas_suprimidas", "Reentregas da Meta ignoradas desde o início do processo.", lambda: dedup.estatisticas()["duplicatas_suprimidas"])
+metricas.Gauge("agente_intencao_local_taxa_acerto", "Fração das mensagens resolvidas pelo extrator local.", lambda: intencao_local.estatisticas()["taxa_acerto"])
+metricas.Gauge("agente_cache_perfis_taxa_acerto", "Fração das leituras de perfil atendidas pelo cache.", lambda: cache_perfis.estatisticas()["taxa_acerto"])
+metricas.Gauge("agente_cache_intencoes_taxa_acerto", "Fração de consultas atendidas pelo cache de intenções.", lambda: cache_intencoes.estatisticas()["taxa_acerto"])
 
 # --- ROTAS DA API FLASK ---
 @app.route('/mensagem_ia_teste', methods=['POST'])
@@ -27,10 +68,10 @@ def mensagem_com_ia_teste():
     if not user_profile: # Checagem caso get_or_create_user retorne None
         return jsonify({"resposta_agente": "Erro ao obter ou criar perfil de usuário para teste."}), 500
 
-    intencao, entidades = extrair_info_gemini(texto_usuario)
+    intencao, entidades = extrair_intencao(texto_usuario)
     confianca_simulada = 1.0 if intencao else 0.0 # Gemini não fornece confiança de intenção da mesma forma
     
-    print(f"Teste - Texto: {texto_usuario}\nIntenção: {intencao}\nEntidades: {entidades}")
+    logger.info("Teste - Texto: %s | Intenção: %s | Entidades: %s", texto_usuario, intencao, entidades)
     
     # Passa o perfil do usuário simulado para a lógica do chatbot
     r_agente = gerar_resposta_do_chatbot(
@@ -56,95 +97,178 @@ def whatsapp_webhook():
         mode = request.args.get('hub.mode')
         challenge = request.args.get('hub.challenge')
         
-        print(f"GET Webhook: Mode={mode}, Token Recebido={vt_req}, Challenge={challenge}")
+        logger.info("GET Webhook: Mode=%s, Challenge=%s", mode, challenge)
         if mode and vt_req:
             if mode == 'subscribe' and vt_req == config.MEU_VERIFY_TOKEN:
-                print("Webhook verificado com sucesso!")
+                logger.info("Webhook verificado com sucesso!")
                 return challenge, 200
             else: 
-                print(f"Falha na verificação. Token esperado: '{config.MEU_VERIFY_TOKEN}', Token recebido: '{vt_req}'")
+                logger.warning("Falha na verificação do webhook: token ou modo inválido (mode=%s).", mode)
                 return 'Token de verificação não confere ou modo inválido', 403
         else: 
-            print("Requisição GET de verificação incompleta.")
+            logger.warning("Requisição GET de verificação incompleta.")
             return 'Parâmetros faltando na requisição de verificação', 400
 
     elif request.method == 'POST': # Recebimento de mensagens do WhatsApp
         data = request.get_json()
-        print("\n--- POST WHATSAPP WEBHOOK ---")
-        print(json.dumps(data, indent=2)) # Log do payload completo para depuração
-        print("---")
+        log_payload(logger, "POST WHATSAPP WEBHOOK", data) # Payload completo só em DEBUG e amostrado
         
         if data.get("object") == "whatsapp_business_account":
+            inicio = time.perf_counter()
             try:
-                for entry in data.get("entry", []):
-                    for change in entry.get("changes", []):
-                        value = change.get("value", {})
-                        if value.get("messaging_product") == "whatsapp" and "messages" in value:
-                            for message_obj in value.get("messages", []):
-                                if message_obj.get("type") == "text":
-                                    num_wa = message_obj.get("from")
-                                    msg_wa = message_obj.get("text", {}).get("body")
-                                    user_name_wa = value.get("contacts", [{}])[0].get("profile", {}).get("name", "Usuário")
-
-                                    if msg_wa and num_wa:
-                                        print(f"Msg de {user_name_wa} ({num_wa}): '{msg_wa}'")
-                                        
-                                        # Obter ou criar perfil do usuário e verificar onboarding
-                                        user_profile = get_or_create_user(num_wa, user_name_wa)
-                                        
-                                        if not user_profile: # Segurança adicional
-                                            print(f"ERRO APP.PY: Não foi possível obter/criar perfil para {num_wa}")
-                                            # Não envie erro para Meta, apenas logue e retorne 200.
-                                            break 
-                                        
-                                        print(f"DEBUG APP.PY: User Profile para {num_wa}: {dict(user_profile)}")
-
-                                        r_user_generated = ""
-                                        if not user_profile["onboarding_complete"]:
-                                            print(f"Usuário {num_wa} em onboarding. Step: {user_profile['onboarding_step']}")
-                                            # Para onboarding, a intenção inicial é nula; msg_wa é a resposta do usuário à pergunta de onboarding.
-                                            r_user_generated = gerar_resposta_do_chatbot(None, {}, msg_wa, num_wa, user_profile)
-                                        else:
-                                            # Onboarding completo, processa normalmente com Gemini
-                                            print(f"Usuário {num_wa} com onboarding completo. Processando com Gemini...")
-                                            if not gemini_model: 
-                                                print("ERRO APP.PY: Cliente Gemini não inicializado.")
-                                                # Poderia enviar uma mensagem padrão de erro ao usuário aqui, se desejado
-                                                break 
-                                            
-                                            intencao_wa, entidades_wa = extrair_info_gemini(msg_wa)
-                                            r_user_generated = gerar_resposta_do_chatbot(intencao_wa, entidades_wa, msg_wa, num_wa, user_profile)
-                                        
-                                        print(f"Resposta GERADA para {num_wa}: {r_user_generated}")
-                                        if r_user_generated: # Envia resposta se houver alguma
-                                            sucesso_envio = enviar_mensagem_whatsapp(num_wa, r_user_generated)
-                                            if sucesso_envio: print(f"Resposta enviada OK para {num_wa} no WhatsApp.")
-                                            else: print(f"Falha ao enviar resposta para {num_wa} no WhatsApp.")
-                                        else:
-                                            print(f"Nenhuma resposta gerada para {num_wa} (r_user_generated está vazia ou None).")
-                                            
-                                else: # Mensagem não é do tipo texto
-                                    print(f"Msg não textual de {message_obj.get('from')}, tipo: {message_obj.get('type')}")
-                            break # Processa apenas o primeiro objeto 'messages' relevante (geralmente há apenas um)
+                # Apenas persiste as mensagens na fila durável; o processamento (Gemini + envio) é feito pelos workers
+                for mensagem in extrair_mensagens_do_payload(data):
+                    # O message_id só fica marcado como visto se o job for gravado (mesma transação)
+                    job_id = fila.enfileirar(mensagem["num_wa"], mensagem, message_id=mensagem["message_id"], dedup=dedup)
+                    if job_id is None:
+                        logger.info("Msg %s de %s já recebida antes; ignorando reentrega (%d duplicatas suprimidas).", mensagem['message_id'], mensagem['num_wa'], dedup.duplicatas_suprimidas)
+                        metricas.webhook_mensagens_total.inc(resultado="duplicada")
+                        continue
+                    metricas.webhook_mensagens_total.inc(resultado="enfileirada")
+                    logger.info("Msg %s de %s enfileirada como job %s.", mensagem['message_id'], mensagem['num_wa'], job_id)
+                metricas.webhook_parse_segundos.observar(time.perf_counter() - inicio)
                 return "EVENT_RECEIVED", 200 # Responde 200 OK para a Meta rapidamente
             except Exception as e_main_p: 
-                print(f"Erro GRANDE ao processar o POST do webhook: {e_main_p}")
+                logger.exception("Erro GRANDE ao processar o POST do webhook: %s", e_main_p)
                 return "INTERNAL_SERVER_ERROR_IN_PROCESSING", 200 # Ainda retorna 200 para Meta
         else: 
-            print("POST recebido no webhook não é do tipo 'whatsapp_business_account'")
+            logger.warning("POST recebido no webhook não é do tipo 'whatsapp_business_account'")
             return "NOT_A_WHATSAPP_EVENT", 200
     else: 
         return "Method Not Allowed", 405
 
+@app.route('/importar_extrato', methods=['POST'])
+def importar_extrato_endpoint():
+    # Autenticação por token fixo (Authorization: Bearer <IMPORTACAO_TOKEN>); sem token configurado, desligado
+    if not config.IMPORTACAO_TOKEN: return jsonify({"erro": "Importação desabilitada (IMPORTACAO_TOKEN não configurado)."}), 503
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {config.IMPORTACAO_TOKEN}"):
+        return jsonify({"erro": "Não autorizado."}), 401
+
+    wa_id = request.args.get("wa_id"); formato = request.args.get("formato", "csv").lower()
+    if not wa_id or formato not in LEITORES: return jsonify({"erro": "Informe wa_id e formato (csv ou ofx)."}), 400
+
+    # Arquivo enviado como multipart ('arquivo') ou no corpo da requisição; lido em stream, sem carregar tudo
+    arquivo = request.files.get("arquivo")
+    bruto = arquivo.stream if arquivo else io.BufferedReader(request.stream)
+    texto = io.TextIOWrapper(bruto, encoding=request.args.get("encoding", "utf-8-sig"), errors="replace", newline="")
+    try:
+        stats = importar_extrato(get_db(), wa_id, LEITORES[formato](texto), functools.partial(categorizar_gasto, wa_id=wa_id),
+                                 debitos_negativos=request.args.get("todos_sao_gastos") != "1")
+    except ErroImportacao as e:
+        return jsonify({"erro": str(e)}), 400
+    return jsonify(stats)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(metricas.renderizar_prometheus(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+# --- PROCESSAMENTO DAS MENSAGENS (executado pelos workers da fila) ---
+def extrair_mensagens_do_payload(data):
+    """Percorre o payload do webhook e retorna as mensagens de texto como dicionários simples."""
+    mensagens = []
+    for entry in data.get("entry", []):
+        for change in entry.get("changes", []):
+            value = change.get("value", {})
+            if value.get("messaging_product") == "whatsapp" and "messages" in value:
+                user_name_wa = value.get("contacts", [{}])[0].get("profile", {}).get("name", "Usuário")
+                for message_obj in value.get("messages", []):
+                    if message_obj.get("type") == "text":
+                        num_wa = message_obj.get("from")
+                        msg_wa = message_obj.get("text", {}).get("body")
+                        if msg_wa and num_wa:
+                            mensagens.append({"num_wa": num_wa, "texto": msg_wa, "nome": user_name_wa, "message_id": message_obj.get("id")})
+                    else: # Mensagem não é do tipo texto
+                        logger.info("Msg não textual de %s, tipo: %s", message_obj.get('from'), message_obj.get('type'))
+    return mensagens
+
+def gerar_resposta_para_mensagem(num_wa, msg_wa, user_name_wa):
+    """Obtém o perfil, interpreta a mensagem (onboarding ou Gemini) e retorna o texto de resposta."""
+    # Obter ou criar perfil do usuário e verificar onboarding
+    user_profile = get_or_create_user(num_wa, user_name_wa)
+    
+    if not user_profile: # Segurança adicional
+        logger.error("Não foi possível obter/criar perfil para %s", num_wa)
+        return None
+    
+    logger.debug("User Profile para %s: %s", num_wa, user_profile)
+
+    if not user_profile["onboarding_complete"]:
+        logger.info("Usuário %s em onboarding. Step: %s", num_wa, user_profile['onboarding_step'])
+        # Para onboarding, a intenção inicial é nula; msg_wa é a resposta do usuário à pergunta de onboarding.
+        return gerar_resposta_do_chatbot(None, {}, msg_wa, num_wa, user_profile)
+
+    # Onboarding completo: mensagens triviais são resolvidas localmente, o restante vai para o Gemini
+    logger.debug("Usuário %s com onboarding completo. Processando mensagem...", num_wa)
+    if not gemini_model: 
+        logger.warning("Cliente Gemini não inicializado; apenas o extrator local está disponível.")
+    
+    # O estado (gasto pendente, listagem aberta) só é consultado se a mensagem for para o Gemini
+    intencao_wa, entidades_wa = extrair_intencao(msg_wa, lambda: contexto_gemini(num_wa))
+    return gerar_resposta_do_chatbot(intencao_wa, entidades_wa, msg_wa, num_wa, user_profile)
+
+def processar_job_da_fila(job):
+    """Processa um job da fila. Exceções fazem o job voltar para a fila com backoff."""
+    inicio = time.perf_counter(); mensagem = job["payload"]
+    try:
+        with contexto_mensagem(mensagem["num_wa"], mensagem.get("message_id")):
+            _processar_job_da_fila(job)
+    except Exception:
+        metricas.job_processamento_segundos.observar(time.perf_counter() - inicio, resultado="erro")
+        raise
+    metricas.job_processamento_segundos.observar(time.perf_counter() - inicio, resultado="ok")
+
+def _processar_job_da_fila(job):
+    mensagem = job["payload"]; num_wa = mensagem["num_wa"]
+    r_user_generated = job.get("resposta")
+    if r_user_generated is None:
+        r_user_generated = gerar_resposta_para_mensagem(num_wa, mensagem["texto"], mensagem["nome"])
+        # Guarda a resposta para que um retry de envio não repita Gemini nem a lógica do chatbot (ex: salvar o gasto 2x)
+        fila.registrar_resposta(job["id"], r_user_generated or "")
+    
+    logger.debug("Resposta GERADA para %s: %s", num_wa, r_user_generated)
+    if r_user_generated: # Envia resposta se houver alguma
+        try:
+            enviada = enviar_mensagem_whatsapp(num_wa, r_user_generated)
+        except EnvioRecusado as e: # 4xx da Meta: repetir não adianta, o job vai direto para dead-letter
+            raise FalhaPermanente(f"Meta recusou a resposta para {num_wa}: {e}") from e
+        if not enviada:
+            raise RuntimeError(f"Falha ao enviar resposta para {num_wa} no WhatsApp.")
+        logger.info("Resposta enviada OK para %s no WhatsApp.", num_wa)
+    else:
+        logger.warning("Nenhuma resposta gerada para %s (r_user_generated está vazia ou None).", num_wa)
+
+def iniciar_processamento_em_segundo_plano(num_workers=None):
+    """Inicia o executor por usuário e o despachante da fila, uma vez por processo servidor (chamadas repetidas
+    no mesmo processo não fazem nada)."""
+    global executor, _processamento_pid
+    with _processamento_lock:
+        if _processamento_pid == os.getpid(): return
+        executor = ExecutorPorUsuario(num_workers, contexto=app.app_context)
+        fila.iniciar_despachante(processar_job_da_fila, executor)
+        pendencias.iniciar_varredura()
+        _processamento_pid = os.getpid()
+    logger.info("Processamento da fila iniciado no processo %s.", _processamento_pid)
+
+@app.before_request
+def _garantir_processamento():
+    # Inicialização preguiçosa: vale para gunicorn (cada worker depois do fork), flask run e app.run sem reloader.
+    # O processo "pai" do reloader do Werkzeug não atende requisições, então nunca inicia workers.
+    if _processamento_pid != os.getpid(): iniciar_processamento_em_segundo_plano()
+
 # --- INICIALIZAÇÃO DO APP ---
 if __name__ == '__main__':
     # Cria o contexto da aplicação para init_db ser chamado corretamente
     with app.app_context():
         initialize_database(app.app_context()) # Passa o contexto da aplicação
 
-    # Prints de aviso sobre configurações ausentes
-    if not config.GOOGLE_API_KEY: print("AVISO IMPORTANTE: GOOGLE_API_KEY não está configurado no ambiente.")
-    if not config.WHATSAPP_ACCESS_TOKEN: print("AVISO IMPORTANTE: WHATSAPP_ACCESS_TOKEN (para envio) não está configurado.")
-    if not config.WHATSAPP_PHONE_NUMBER_ID: print("AVISO IMPORTANTE: WHATSAPP_PHONE_NUMBER_ID (para envio) não está configurado.")
+    # Avisos sobre configurações ausentes
+    if not config.GOOGLE_API_KEY: logger.warning("AVISO IMPORTANTE: GOOGLE_API_KEY não está configurado no ambiente.")
+    if not config.WHATSAPP_ACCESS_TOKEN: logger.warning("AVISO IMPORTANTE: WHATSAPP_ACCESS_TOKEN (para envio) não está configurado.")
+    if not config.WHATSAPP_PHONE_NUMBER_ID: logger.warning("AVISO IMPORTANTE: WHATSAPP_PHONE_NUMBER_ID (para envio) não está configurado.")
+    
+    # Com debug=True o reloader do Werkzeug executa este bloco também no processo "pai", que não atende requisições;
+    # no processo filho os workers começam já, para drenar jobs que ficaram na fila (nos demais casos, na 1ª requisição)
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        iniciar_processamento_em_segundo_plano()
     
     app.run(debug=True, port=5002)
\ No newline at end of file
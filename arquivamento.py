@@ -0,0 +1,131 @@
+import contextlib
+import datetime
+import logging
+import os
+import re
+import time
+import config
+
+logger = logging.getLogger(__name__)
+
+# --- Arquivamento de gastos antigos em bancos por ano ---
+# Gastos com data efetiva anterior ao horizonte (ARQUIVO_HORIZONTE_MESES) saem de meus_gastos.db e vão para
+# <ARQUIVO_DIRETORIO>/gastos_<ano>.db. O banco principal fica só com os dados recentes e o resumo mensal
+# (que continua cobrindo todos os meses), então VACUUM e backup ficam proporcionais ao período recente.
+# Consultas de períodos antigos anexam (ATTACH) um arquivo de cada vez, sob demanda, e o desanexam em seguida
+# (o SQLite limita o número de bancos anexados por conexão).
+
+RE_ARQUIVO = re.compile(r'^gastos_(\d{4})\.db$')
+# Datas no formato AAAA-MM-DD (as únicas comparáveis por faixa e convertíveis com date.fromisoformat)
+FILTRO_DATA_ISO = "data_efetiva GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'"
+
+def caminho_arquivo(ano, diretorio=None):
+    return os.path.join(diretorio or config.ARQUIVO_DIRETORIO, f"gastos_{ano}.db")
+
+def anos_arquivados(diretorio=None):
+    diretorio = diretorio or config.ARQUIVO_DIRETORIO
+    if not os.path.isdir(diretorio): return []
+    return sorted(int(m.group(1)) for m in map(RE_ARQUIVO.match, os.listdir(diretorio)) if m)
+
+def data_limite(horizonte_meses=None, hoje=None):
+    """Primeiro dia do mês mais antigo que fica no banco principal ('YYYY-MM-DD')."""
+    hoje = hoje or datetime.date.today()
+    meses = hoje.year * 12 + hoje.month - 1 - (config.ARQUIVO_HORIZONTE_MESES if horizonte_meses is None else horizonte_meses)
+    return datetime.date(meses // 12, meses % 12 + 1, 1).isoformat()
+
+def arquivado_ate(db):
+    """Data a partir da qual os gastos estão no banco principal (None se nada foi arquivado)."""
+    return db.execute("SELECT arquivado_ate FROM arquivamento_controle").fetchone()[0]
+
+@contextlib.contextmanager
+def anexado(db, ano, diretorio=None):
+    """Anexa o arquivo do ano à conexão (fora de transação: restrição do ATTACH) e fornece o alias (ex.: 'arq_2023')."""
+    alias = f"arq_{ano}"
+    if alias in {row[1] for row in db.execute("PRAGMA database_list")}:
+        yield alias; return
+    db.execute("ATTACH DATABASE ? AS " + alias, (caminho_arquivo(ano, diretorio),))
+    try: yield alias
+    finally: db.execute("DETACH DATABASE " + alias)
+
+def buscar_nos_arquivos(db, sql, params, inicio, fim, limite, diretorio=None):
+    """Executa sql (com {tabela} no lugar da tabela de gastos) nos arquivos que cobrem [inicio, fim].
+
+    Os anos são lidos do mais recente para o mais antigo e a busca para quando já há `limite` linhas,
+    então a listagem (ordenada por data decrescente) só abre os arquivos que de fato precisa."""
+    limite_arquivo = arquivado_ate(db)
+    if not limite_arquivo or (inicio or "0000-00-00") >= limite_arquivo: return []
+    ano_inicio, ano_fim = int((inicio or "0000")[:4]), int(min(fim or "9999-12-31", limite_arquivo)[:4])
+    linhas = []
+    for ano in reversed(anos_arquivados(diretorio)):
+        if not ano_inicio <= ano <= ano_fim: continue
+        with anexado(db, ano, diretorio) as alias:
+            linhas += db.execute(sql.format(tabela=alias + ".gastos"), params).fetchall()
+        if len(linhas) >= limite: break
+    return linhas
+
+def resumo_dos_arquivos(db, diretorio=None):
+    """{(wa_id, mes_ref, categoria): (total, quantidade)} somando todos os arquivos (verificação do resumo mensal)."""
+    resumo = {}
+    for ano in anos_arquivados(diretorio):
+        with anexado(db, ano, diretorio) as alias:
+            for wa_id, mes_ref, categoria, total, quantidade in db.execute(
+                    f"SELECT wa_id, mes_ref, COALESCE(categoria, ''), SUM(valor), COUNT(*) FROM {alias}.gastos GROUP BY 1, 2, 3"):
+                anterior = resumo.get((wa_id, mes_ref, categoria), (0.0, 0))
+                resumo[(wa_id, mes_ref, categoria)] = (anterior[0] + total, anterior[1] + quantidade)
+    return resumo
+
+def _criar_tabela_arquivo(db, alias):
+    # Mesmas colunas de gastos; data_efetiva e mes_ref são gravadas (não há gerador no arquivo)
+    db.execute(f'''
+        CREATE TABLE IF NOT EXISTS {alias}.gastos (
+            id INTEGER PRIMARY KEY,
+            wa_id TEXT NOT NULL,
+            descricao TEXT NOT NULL,
+            valor REAL NOT NULL,
+            data_despesa TEXT,
+            categoria TEXT,
+            data_registro_sistema TIMESTAMP,
+            data_efetiva TEXT,
+            mes_ref TEXT
+        )
+    ''')
+    db.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_gastos_wa_id_data_efetiva_id ON gastos (wa_id, data_efetiva, id)")
+
+def arquivar_gastos(db, horizonte_meses=None, diretorio=None, vacuum=False):
+    """Move os gastos anteriores ao horizonte para os arquivos anuais. Retorna {ano: linhas movidas}.
+
+    Cada ano é copiado com INSERT OR IGNORE e só então apagado do banco principal: se o processo cair no
+    meio, rodar de novo completa o trabalho sem duplicar linhas. O resumo mensal não é alterado."""
+    diretorio = diretorio or config.ARQUIVO_DIRETORIO
+    os.makedirs(diretorio, exist_ok=True)
+    limite = data_limite(horizonte_meses)
+    inicio = time.perf_counter()
+    # Só datas ISO: datas gravadas em outro formato (ex.: "15/03/2024" ou "2024-3-5" vindos do Gemini) ficam no banco principal
+    anos = [int(r[0]) for r in db.execute(f"SELECT DISTINCT substr(data_efetiva, 1, 4) FROM gastos WHERE data_efetiva < ? AND {FILTRO_DATA_ISO} ORDER BY 1", (limite,))]
+    fora_do_padrao = db.execute(f"SELECT COUNT(*) FROM gastos WHERE data_efetiva < ? AND NOT {FILTRO_DATA_ISO}", (limite,)).fetchone()[0]
+    if fora_do_padrao: logger.warning("%d gasto(s) com data fora do formato AAAA-MM-DD não serão arquivados.", fora_do_padrao)
+    movidos = {}
+    for ano in anos:
+        de, ate = f"{ano}-01-01", min(f"{ano + 1}-01-01", limite)
+        with anexado(db, ano, diretorio) as alias:
+            _criar_tabela_arquivo(db, alias)
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                db.execute(f"""INSERT OR IGNORE INTO {alias}.gastos
+                               SELECT id, wa_id, descricao, valor, data_despesa, categoria, data_registro_sistema, data_efetiva, mes_ref
+                               FROM main.gastos WHERE data_efetiva >= ? AND data_efetiva < ? AND {FILTRO_DATA_ISO}""", (de, ate))
+                # Com ativo = 1 o trigger de DELETE não desconta os gastos arquivados do resumo mensal
+                db.execute("UPDATE arquivamento_controle SET ativo = 1")
+                movidos[ano] = db.execute(f"DELETE FROM main.gastos WHERE data_efetiva >= ? AND data_efetiva < ? AND {FILTRO_DATA_ISO}", (de, ate)).rowcount
+                db.execute("UPDATE arquivamento_controle SET ativo = 0")
+                db.commit()
+            except Exception:
+                db.rollback(); raise
+    # O limite só avança (arquivar com um horizonte maior depois não "desarquiva" nada)
+    db.execute("UPDATE arquivamento_controle SET arquivado_ate = ? WHERE arquivado_ate IS NULL OR arquivado_ate < ?", (limite, limite))
+    db.commit()
+    logger.info("Arquivamento até %s: %s linhas movidas em %.2fs.", limite, movidos, time.perf_counter() - inicio)
+    if vacuum:
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        db.execute("VACUUM")
+    return movidos
@@ -0,0 +1,273 @@
+"""Benchmark de carga e latência ponta a ponta do /whatsapp_webhook.
+
+Sobe o app Flask num servidor local, substitui o Gemini e a Graph API por stubs com latência injetável e
+simula usuários conversando (onboarding, registrar_gasto + confirmação, listar_gastos). Cada usuário só
+envia a próxima mensagem depois de receber a resposta, como no WhatsApp; no roteiro "rajada" o gasto é
+digitado em pedaços ("gastei 50", "no almoço", "ontem") com poucas centenas de ms entre eles.
+
+Exemplo:
+    python benchmarks/carga_webhook.py --usuarios 50 --taxa-chegada 10 --latencia-gemini 400 --latencia-graph 150
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# --- Roteiros de conversa ---
+ROTEIROS = {
+    "onboarding": lambda: ["oi", str(random.choice([2500, 4000, 7300])), "quero guardar dinheiro para uma viagem"],
+    "gasto": lambda: [f"gastei {random.randint(5, 120)} no {random.choice(['almoço', 'uber', 'mercado', 'cinema'])}", "sim"],
+    "gasto_gemini": lambda: [f"hoje {random.choice(['almocei fora', 'fui ao cinema', 'abasteci o carro'])} e deu {random.randint(10, 200)} reais", "sim"],
+    "listar": lambda: ["listar gastos"],
+    # Tupla = mensagens enviadas em sequência sem esperar resposta
+    "rajada": lambda: [(f"gastei {random.randint(5, 120)}", f"no {random.choice(['almoço', 'uber', 'mercado'])}", "ontem"), "sim"],
+}
+
+def parse_mix(texto):
+    mix = {}
+    for parte in texto.split(","):
+        nome, _, peso = parte.partition("=")
+        if nome.strip() not in ROTEIROS: raise argparse.ArgumentTypeError(f"Roteiro desconhecido: {nome}")
+        mix[nome.strip()] = float(peso or 1)
+    return mix
+
+def percentil(valores, p):
+    if not valores: return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+# --- Stub da Graph API ---
+class StubGraphAPI:
+    def __init__(self, latencia_ms, jitter_ms):
+        self.latencia_ms = latencia_ms; self.jitter_ms = jitter_ms
+        self._respostas = {} # wa_id -> lista de textos recebidos
+        self._cond = threading.Condition()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def log_message(self, *args): pass
+            def do_POST(self):
+                corpo = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                time.sleep(max(0.0, random.gauss(stub.latencia_ms, stub.jitter_ms)) / 1000)
+                with stub._cond:
+                    stub._respostas.setdefault(corpo["to"], []).append(corpo["text"]["body"])
+                    stub._cond.notify_all()
+                dados = json.dumps({"messages": [{"id": f"wamid.{uuid.uuid4().hex}"}]}).encode()
+                self.send_response(200); self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(dados))); self.end_headers(); self.wfile.write(dados)
+
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.servidor.daemon_threads = True
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.servidor.server_port}"
+
+    def aguardar_resposta(self, wa_id, quantidade_anterior, timeout):
+        limite = time.monotonic() + timeout
+        with self._cond:
+            while len(self._respostas.get(wa_id, [])) <= quantidade_anterior:
+                restante = limite - time.monotonic()
+                if restante <= 0: return False
+                self._cond.wait(restante)
+        return True
+
+    def quantidade(self, wa_id):
+        with self._cond: return len(self._respostas.get(wa_id, []))
+
+    def total(self):
+        with self._cond: return sum(map(len, self._respostas.values()))
+
+# --- Stub do Gemini (imita a estrutura de resposta do google-generativeai) ---
+class _Obj:
+    def __init__(self, **kw): self.__dict__.update(kw)
+
+class StubGemini:
+    RE_PEDIDO = re.compile(r"Pedido do usuário: '(.*)'\s*$", re.S)
+
+    def __init__(self, latencia_ms, jitter_ms):
+        self.latencia_ms = latencia_ms; self.jitter_ms = jitter_ms
+        self.chamadas = 0; self._lock = threading.Lock()
+
+    def _interpretar(self, texto):
+        numeros = re.findall(r"\d+(?:[.,]\d+)?", texto)
+        if "guardar" in texto or "objetivo" in texto:
+            return "avaliar_objetivo_financeiro", {"eh_valido": True, "objetivo_reformulado": "Guardar dinheiro para uma viagem"}
+        if numeros:
+            return "registrar_gasto", {"descricao": texto.split(" e deu")[0].replace("hoje ", ""), "valor": float(numeros[-1].replace(",", ".")), "categoria": "Outros"}
+        return "listar_gastos", {}
+
+    def generate_content(self, prompt, **kwargs):
+        with self._lock: self.chamadas += 1
+        time.sleep(max(0.0, random.gauss(self.latencia_ms, self.jitter_ms)) / 1000)
+        m = self.RE_PEDIDO.search(prompt if isinstance(prompt, str) else str(prompt))
+        nome, args = self._interpretar(m.group(1) if m else "")
+        part = _Obj(function_call=_Obj(name=nome, args=args))
+        return _Obj(candidates=[_Obj(content=_Obj(parts=[part]))])
+
+# --- Simulação ---
+def configurar_ambiente(args, dir_tmp, url_graph):
+    """Aponta config para arquivos temporários e para o stub da Graph API antes de importar o app."""
+    os.environ.setdefault("LOG_NIVEL", "WARNING")
+    import config
+    config.LOG_NIVEL = os.environ["LOG_NIVEL"]
+    config.DATABASE_FILENAME = os.path.join(dir_tmp, "meus_gastos.db")
+    config.FILA_DATABASE_FILENAME = os.path.join(dir_tmp, "fila_mensagens.db")
+    config.CACHE_DATABASE_FILENAME = os.path.join(dir_tmp, "cache_gemini.db")
+    config.PENDENCIAS_DATABASE_FILENAME = os.path.join(dir_tmp, "pendencias.db")
+    config.WHATSAPP_GRAPH_API_BASE_URL = url_graph
+    config.WHATSAPP_ACCESS_TOKEN = "token-benchmark"
+    config.WHATSAPP_PHONE_NUMBER_ID = "000000000"
+    config.WHATSAPP_MENSAGENS_POR_SEGUNDO = args.limite_graph
+    config.EXECUTOR_NUM_WORKERS = args.workers
+    if args.janela_coalescencia is not None: config.FILA_JANELA_COALESCENCIA_SEGUNDOS = args.janela_coalescencia
+
+def preparar_usuarios(app_module, usuarios_onboarding):
+    """Cria no banco os usuários que já concluíram o onboarding."""
+    from database import get_db
+    with app_module.app.app_context():
+        app_module.initialize_database(app_module.app.app_context())
+        db = get_db()
+        db.executemany(
+            "INSERT OR IGNORE INTO usuarios (wa_id, nome_perfil, renda_mensal, onboarding_step, onboarding_complete) VALUES (?, ?, 5000, 'complete', TRUE)",
+            [(u, f"Bench {u}") for u in usuarios_onboarding]
+        )
+        db.commit()
+
+def payload_webhook(wa_id, texto):
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "bench", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"display_phone_number": "5500000000000", "phone_number_id": "000000000"},
+            "contacts": [{"profile": {"name": f"Bench {wa_id}"}, "wa_id": wa_id}],
+            "messages": [{"from": wa_id, "id": f"wamid.{uuid.uuid4().hex}", "timestamp": str(int(time.time())), "type": "text", "text": {"body": texto}}],
+        }}]}],
+    }
+
+def simular_usuario(wa_id, roteiros, url_app, stub_graph, resultados, timeout):
+    import requests
+    sessao = requests.Session()
+    for roteiro in roteiros:
+        for passo in roteiro:
+            antes = stub_graph.quantidade(wa_id); inicio = time.perf_counter()
+            for i, texto in enumerate(passo if isinstance(passo, tuple) else (passo,)):
+                if i: time.sleep(random.uniform(0.2, 0.6)) # Intervalo de digitação dentro da rajada
+                envio = time.perf_counter()
+                r = sessao.post(f"{url_app}/whatsapp_webhook", json=payload_webhook(wa_id, texto), timeout=30)
+                with resultados["lock"]:
+                    resultados["ack"].append(time.perf_counter() - envio)
+                    if r.status_code != 200: resultados["erros_http"] += 1
+            # Latência medida da última mensagem do passo até a primeira resposta
+            inicio = envio
+            respondeu = stub_graph.aguardar_resposta(wa_id, antes, timeout)
+            total = time.perf_counter() - inicio
+            with resultados["lock"]:
+                if respondeu: resultados["ponta_a_ponta"].append(total)
+                else: resultados["sem_resposta"] += 1
+
+def resumo_metricas():
+    import metricas
+    linhas = []
+    for hist, rotulo in ((metricas.webhook_parse_segundos, None), (metricas.job_processamento_segundos, "resultado"),
+                         (metricas.gemini_segundos, "intencao"), (metricas.whatsapp_envio_segundos, "resultado"),
+                         (metricas.db_operacao_segundos, "funcao")):
+        for chave, (_, soma, n) in sorted(hist.agregado().items()):
+            if not n: continue
+            nome = hist.nome + (f"[{','.join(chave)}]" if chave else "")
+            linhas.append({"etapa": nome, "chamadas": n, "media_ms": soma / n * 1000, "total_s": soma})
+    return linhas
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--usuarios", type=int, default=20, help="Número de usuários simulados.")
+    parser.add_argument("--sessoes-por-usuario", type=int, default=3, help="Roteiros executados por usuário.")
+    parser.add_argument("--taxa-chegada", type=float, default=5.0, help="Usuários iniciando por segundo (chegadas de Poisson).")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("onboarding=1,gasto=4,gasto_gemini=2,listar=2"),
+                        help="Pesos dos roteiros, ex: onboarding=1,gasto=4,gasto_gemini=2,listar=2")
+    parser.add_argument("--latencia-gemini", type=float, default=500, help="Latência média do stub do Gemini (ms).")
+    parser.add_argument("--latencia-graph", type=float, default=150, help="Latência média do stub da Graph API (ms).")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Desvio padrão das latências, como fração da média.")
+    parser.add_argument("--workers", type=int, default=4, help="Shards do executor por usuário.")
+    parser.add_argument("--limite-graph", type=float, default=80, help="Mensagens/s permitidas pelo token bucket do envio.")
+    parser.add_argument("--janela-coalescencia", type=float, default=None,
+                        help="Sobrescreve FILA_JANELA_COALESCENCIA_SEGUNDOS (0 desliga a coalescência).")
+    parser.add_argument("--timeout-resposta", type=float, default=60, help="Tempo máximo esperando cada resposta (s).")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="Imprime o relatório em JSON.")
+    args = parser.parse_args()
+    random.seed(args.semente)
+
+    dir_tmp = tempfile.mkdtemp(prefix="bench_agente_")
+    stub_graph = StubGraphAPI(args.latencia_graph, args.latencia_graph * args.jitter)
+    configurar_ambiente(args, dir_tmp, stub_graph.url)
+
+    import app as app_module
+    import gemini_handler
+    import logging
+    logging.getLogger("werkzeug").setLevel(logging.WARNING) # Sem uma linha de log por requisição
+    from werkzeug.serving import make_server
+    stub_gemini = StubGemini(args.latencia_gemini, args.latencia_gemini * args.jitter)
+    gemini_handler.gemini_model = stub_gemini; app_module.gemini_model = stub_gemini
+
+    nomes = list(args.mix); pesos = [args.mix[n] for n in nomes]
+    planos = {}
+    for i in range(args.usuarios):
+        wa_id = f"5511{i:08d}"
+        roteiros = random.choices(nomes, pesos, k=args.sessoes_por_usuario)
+        if "onboarding" in roteiros: roteiros = ["onboarding"] + [r for r in roteiros if r != "onboarding"]
+        planos[wa_id] = [ROTEIROS[r]() for r in roteiros]
+    preparar_usuarios(app_module, [u for u, rs in planos.items() if rs[0][0] != "oi"])
+
+    servidor = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    app_module.iniciar_processamento_em_segundo_plano(args.workers)
+    url_app = f"http://127.0.0.1:{servidor.server_port}"
+
+    resultados = {"ack": [], "ponta_a_ponta": [], "erros_http": 0, "sem_resposta": 0, "lock": threading.Lock()}
+    threads = []; inicio = time.perf_counter()
+    for wa_id, roteiros in planos.items():
+        t = threading.Thread(target=simular_usuario, args=(wa_id, roteiros, url_app, stub_graph, resultados, args.timeout_resposta), daemon=True)
+        t.start(); threads.append(t)
+        time.sleep(random.expovariate(args.taxa_chegada))
+    for t in threads: t.join()
+    duracao = time.perf_counter() - inicio
+    servidor.shutdown()
+
+    mensagens = len(resultados["ack"])
+    relatorio = {
+        "usuarios": args.usuarios, "mensagens": mensagens, "duracao_s": duracao,
+        "vazao_msgs_por_s": mensagens / duracao if duracao else 0.0,
+        "erros_http": resultados["erros_http"], "sem_resposta": resultados["sem_resposta"],
+        "chamadas_gemini": stub_gemini.chamadas, "respostas_enviadas": stub_graph.total(),
+        "ack_webhook_ms": {f"p{p}": percentil(resultados["ack"], p) * 1000 for p in (50, 95, 99)},
+        "ponta_a_ponta_ms": {f"p{p}": percentil(resultados["ponta_a_ponta"], p) * 1000 for p in (50, 95, 99)},
+        "etapas": resumo_metricas(),
+    }
+    if args.json:
+        print(json.dumps(relatorio, indent=2, ensure_ascii=False)); return
+
+    print(f"\n=== Benchmark /whatsapp_webhook ({args.usuarios} usuários, {args.workers} workers) ===")
+    print(f"Mensagens: {mensagens} em {duracao:.1f}s -> {relatorio['vazao_msgs_por_s']:.1f} msgs/s")
+    print(f"Erros HTTP: {relatorio['erros_http']} | Sem resposta: {relatorio['sem_resposta']} | Chamadas ao Gemini: {stub_gemini.chamadas} | Respostas enviadas: {relatorio['respostas_enviadas']}")
+    for nome in ("ack_webhook_ms", "ponta_a_ponta_ms"):
+        p = relatorio[nome]
+        print(f"{nome:<18} p50={p['p50']:8.1f}  p95={p['p95']:8.1f}  p99={p['p99']:8.1f}")
+    print("\nTempo por etapa:")
+    for etapa in relatorio["etapas"]:
+        print(f"  {etapa['etapa']:<70} n={etapa['chamadas']:<6} média={etapa['media_ms']:8.2f}ms  total={etapa['total_s']:7.2f}s")
+
+if __name__ == "__main__":
+    main()
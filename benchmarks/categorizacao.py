@@ -0,0 +1,74 @@
+"""Micro-benchmark de categorizar_gasto: regex única compilada (categorias.py) x versão antiga com laços de substring.
+
+Mede o tempo por chamada sobre descrições típicas (com e sem acento): versão antiga, regex sem o cache de
+descrições (primeira vez que a descrição aparece), com o cache e com correções do usuário. Lista as descrições
+em que as categorias diferem (acentos, "99" dentro de valores, "bar" dentro de "barbearia").
+
+Exemplo:
+    python benchmarks/categorizacao.py --repeticoes 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+DESCRICOES = [
+    "almoço no restaurante", "almoco", "uber pro trabalho", "99 pop", "gasolina posto shell", "onibus", "ônibus",
+    "farmacia", "farmácia drogasil", "barbearia", "bar do zé", "conta de luz", "mensalidade academia",
+    "presente de aniversário 199", "ifood sexta", "lanches da tarde", "supermercado extra", "cinema com a família",
+    "plano de saude unimed", "cafe da manha", "consulta dentista", "aluguel outubro", "internet vivo fibra",
+    "passagem aérea para a viagem de férias em dezembro com a família toda", "compra diversa sem categoria",
+]
+
+def categorizar_antigo(descricao):
+    # Versão anterior de chatbot_logic.categorizar_gasto (referência)
+    descricao_lower = descricao.lower()
+    mapa_categorias = {
+        "Alimentação": ["almoço", "jantar", "café", "lanche", "restaurante", "mercado", "comida", "padaria", "ifood", "rappi", "supermercado"],
+        "Transporte": ["uber", "99", "gasolina", "estacionamento", "metrô", "ônibus", "passagem", "combustível", "taxi"],
+        "Moradia": ["aluguel", "condomínio", "água", "luz", "internet", "gás", "iptu", "telefone fixo"],
+        "Lazer": ["cinema", "show", "bar", "festa", "jogo", "livro", "streaming", "netflix", "spotify", "teatro", "viagem"],
+        "Saúde": ["farmácia", "remédio", "consulta", "médico", "hospital", "plano de saúde", "dentista"],
+        "Outros": []
+    }
+    for categoria, palavras_chave in mapa_categorias.items():
+        for palavra in palavras_chave:
+            if palavra in descricao_lower:
+                return categoria
+    return "Outros"
+
+def medir(funcao, repeticoes):
+    total = timeit.timeit(lambda: [funcao(d) for d in DESCRICOES], number=repeticoes)
+    return total / (repeticoes * len(DESCRICOES)) * 1e6 # µs por chamada
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeticoes", type=int, default=5000, help="Passadas sobre a lista de descrições.")
+    args = parser.parse_args()
+
+    import config
+    config.DATABASE_FILENAME = os.path.join(tempfile.mkdtemp(prefix="bench_categorias_"), "gastos.db")
+    from database import criar_esquema, get_db
+    criar_esquema(get_db())
+    from categorias import categorizar, categoria_por_palavras_chave, registrar_correcao
+
+    antigo = medir(categorizar_antigo, args.repeticoes)
+    sem_cache = medir(categoria_por_palavras_chave.__wrapped__, args.repeticoes)
+    novo = medir(categorizar, args.repeticoes)
+    registrar_correcao("bench", "mensalidade academia", "Saúde")
+    com_correcoes = medir(lambda d: categorizar(d, "bench"), args.repeticoes)
+    print(f"Versão antiga:                        {antigo:7.2f} µs/chamada")
+    print(f"Regex compilada (descrição nova):     {sem_cache:7.2f} µs/chamada ({antigo / sem_cache:.1f}x)")
+    print(f"Regex + cache de descrições:          {novo:7.2f} µs/chamada ({antigo / novo:.1f}x)")
+    print(f"Com correções do usuário:             {com_correcoes:7.2f} µs/chamada ({antigo / com_correcoes:.1f}x)")
+    print("\nDescrições com categoria diferente (antiga -> nova):")
+    for d in DESCRICOES:
+        a, n = categorizar_antigo(d), categorizar(d, "bench")
+        if a != n: print(f"  {d!r}: {a} -> {n}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Tokens de prompt por requisição ao Gemini: formato completo (preâmbulo + todas as ferramentas) x otimizado.
+
+Para cada estado do usuário (onboarding, sem pendência, gasto aguardando confirmação, listagem aberta) monta as
+duas requisições de gemini_handler para mensagens típicas e compara o tamanho do prompt (instruções, texto e
+declarações das ferramentas enviadas). Com GOOGLE_API_KEY conta os tokens com model.count_tokens; sem a chave
+(ou se a contagem falhar) estima ~4 caracteres por token. Respostas geradas não entram na conta.
+
+Exemplo:
+    python benchmarks/tokens_gemini.py
+    python benchmarks/tokens_gemini.py --json
+"""
+import argparse
+import json
+import os
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+CARACTERES_POR_TOKEN = 4
+
+ESTADOS = {
+    "onboarding": ({"onboarding": True}, ["quero guardar dinheiro para uma viagem", "ficar rico"]),
+    "sem_pendencia": ({}, ["gastei 45 no mercado ontem e 12 de café", "quanto gastei com alimentação em maio?", "minha renda mudou"]),
+    "gasto_pendente": ({"gasto_pendente": True}, ["na verdade foi 50", "pode salvar esse"]),
+    "listagem": ({"listagem": True}, ["me mostra os próximos", "e o resto?"]),
+}
+
+def requisicao(gemini_handler, modo, texto, contexto):
+    """(instruções de sistema, prompt, nomes das ferramentas) que seriam enviados no modo dado."""
+    anterior = gemini_handler.MODO_OTIMIZADO
+    gemini_handler.MODO_OTIMIZADO = modo == "otimizado"
+    try:
+        sistema = gemini_handler.INSTRUCOES_SISTEMA if gemini_handler.MODO_OTIMIZADO else ""
+        return sistema, gemini_handler._montar_prompt(texto), gemini_handler.nomes_ferramentas(contexto)
+    finally:
+        gemini_handler.MODO_OTIMIZADO = anterior
+
+def estimar(gemini_handler, sistema, prompt, nomes):
+    esquemas = json.dumps([gemini_handler.ESQUEMAS[nome] for nome in nomes], ensure_ascii=False)
+    return round((len(sistema) + len(prompt) + len(esquemas)) / CARACTERES_POR_TOKEN)
+
+def contador_api(gemini_handler):
+    """Função (sistema, prompt, nomes) -> tokens usando a API, ou None sem GOOGLE_API_KEY."""
+    if not gemini_handler.gemini_model: return None
+    import google.generativeai as genai
+    modelos = {}
+    def contar(sistema, prompt, nomes):
+        if sistema not in modelos:
+            modelos[sistema] = genai.GenerativeModel('gemini-1.5-flash-latest', **({"system_instruction": sistema} if sistema else {}))
+        return modelos[sistema].count_tokens(prompt, tools=[gemini_handler.ferramentas_para(None) if len(nomes) == len(gemini_handler.DECLARACOES)
+                                                            else gemini_handler._ferramentas(nomes)]).total_tokens
+    return contar
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--json", action="store_true", help="Imprime o relatório em JSON.")
+    args = parser.parse_args()
+
+    import gemini_handler
+    contar = contador_api(gemini_handler)
+    fonte = "count_tokens" if contar else f"estimativa (~{CARACTERES_POR_TOKEN} caracteres/token)"
+    linhas = []; total = {"completo": 0, "otimizado": 0}
+    for estado, (contexto, textos) in ESTADOS.items():
+        for texto in textos:
+            tokens = {}
+            for modo in total:
+                sistema, prompt, nomes = requisicao(gemini_handler, modo, texto, contexto)
+                tokens[modo] = None
+                if contar:
+                    try: tokens[modo] = contar(sistema, prompt, nomes)
+                    except Exception as e: print(f"count_tokens falhou ({e}); usando estimativa.", file=sys.stderr); contar = None
+                if tokens[modo] is None: tokens[modo] = estimar(gemini_handler, sistema, prompt, nomes)
+                total[modo] += tokens[modo]
+            linhas.append({"estado": estado, "texto": texto, "ferramentas_otimizado": len(nomes), **tokens,
+                           "economia_percentual": (1 - tokens["otimizado"] / tokens["completo"]) * 100})
+    relatorio = {"fonte": fonte, "ferramentas_completo": len(gemini_handler.DECLARACOES), "requisicoes": linhas,
+                 "total": {**total, "economia_percentual": (1 - total["otimizado"] / total["completo"]) * 100}}
+    if args.json:
+        print(json.dumps(relatorio, indent=2, ensure_ascii=False)); return
+
+    print(f"\n=== Tokens de prompt por requisição ao Gemini ({fonte}) ===")
+    print(f"{'estado':<16} {'ferram.':>7} {'completo':>9} {'otimizado':>9} {'economia':>9}  texto")
+    for l in linhas:
+        print(f"{l['estado']:<16} {l['ferramentas_otimizado']:>7} {l['completo']:>9} {l['otimizado']:>9} {l['economia_percentual']:>8.1f}%  {l['texto']}")
+    t = relatorio["total"]
+    print(f"{'total':<16} {'':>7} {t['completo']:>9} {t['otimizado']:>9} {t['economia_percentual']:>8.1f}%")
+
+if __name__ == "__main__":
+    main()
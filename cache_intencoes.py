@@ -0,0 +1,201 @@
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import config
+from conexoes_sqlite import GerenciadorConexoes
+from texto_utils import normalizar_texto, parsear_valor
+
+logger = logging.getLogger(__name__)
+
+# --- Cache de resultados do Gemini (LRU em memória + SQLite persistente) ---
+# A chave é o texto normalizado (minúsculas, sem acentos, espaços colapsados). Quando é seguro, os números
+# viram marcadores (<n0>, <n1>...) e o resultado é guardado como modelo: "gastei 50 no almoço" e
+# "gastei 70 no almoço" compartilham a mesma entrada, com o valor preenchido a partir do novo texto.
+# Quem chama pode separar as entradas por uma variante (ex.: o conjunto de ferramentas enviado ao Gemini, que
+# muda com o estado do usuário), para que um resultado de um estado não seja repetido em outro.
+
+RE_NUMERO = re.compile(r'\d+(?:[.,]\d+)*')
+RE_MARCADOR = re.compile(r'<n(\d+)>')
+
+def _numeros_do_texto(texto_normalizado):
+    return [m.group(0) for m in RE_NUMERO.finditer(texto_normalizado)]
+
+def _chave_com_marcadores(texto_normalizado):
+    contador = iter(range(1000))
+    return RE_NUMERO.sub(lambda m: f"<n{next(contador)}>", texto_normalizado)
+
+def _normalizar(texto):
+    return normalizar_texto(texto).strip(' .!?')
+
+def _montar_modelo(entidades, tokens):
+    """Troca nas entidades os números vindos do texto por marcadores. Retorna None se não for seguro."""
+    valores = [parsear_valor(t) for t in tokens]
+    if len(set(valores)) != len(valores) or None in valores: return None # Números repetidos ou ilegíveis: ambíguo
+    usados = set()
+
+    def converter(valor):
+        if isinstance(valor, bool): return valor
+        if isinstance(valor, (int, float)):
+            if valor in valores:
+                i = valores.index(valor); usados.add(i)
+                return {"__num__": i, "int": isinstance(valor, int)}
+            return valor
+        if isinstance(valor, str):
+            def trocar(m):
+                if m.group(0) in tokens:
+                    i = tokens.index(m.group(0)); usados.add(i); return f"<n{i}>"
+                return m.group(0)
+            return RE_NUMERO.sub(trocar, valor)
+        if isinstance(valor, dict): return {k: converter(v) for k, v in valor.items()}
+        if isinstance(valor, list): return [converter(v) for v in valor]
+        return valor
+
+    modelo = converter(entidades)
+    # Todo número do texto precisa aparecer nas entidades; senão ele pode ter influenciado o resultado
+    # de um jeito que o modelo não reproduz (ex: "2 mil" virando 2000) e a chave exata é usada.
+    if len(usados) != len(tokens): return None
+    return modelo
+
+def _preencher_modelo(modelo, tokens):
+    valores = [parsear_valor(t) for t in tokens]
+
+    def preencher(valor):
+        if isinstance(valor, dict):
+            if "__num__" in valor:
+                numero = valores[valor["__num__"]]
+                return int(numero) if valor.get("int") and numero == int(numero) else numero
+            return {k: preencher(v) for k, v in valor.items()}
+        if isinstance(valor, list): return [preencher(v) for v in valor]
+        if isinstance(valor, str): return RE_MARCADOR.sub(lambda m: tokens[int(m.group(1))], valor)
+        return valor
+
+    return preencher(modelo)
+
+def _tem_data(entidades):
+    # Também nos itens de um lote (registrar_gastos: {"gastos": [{..., "data": ...}]})
+    return "data" in entidades or any(isinstance(g, dict) and "data" in g for g in entidades.get("gastos") or ())
+
+def _com_variante(chave, variante):
+    return f"{variante}|{chave}" if variante else chave
+
+class CacheIntencoes:
+    def __init__(self, caminho_db, max_memoria=None, max_db=None, ttl_segundos=None, intencoes_ignoradas=None):
+        self.caminho_db = caminho_db
+        self.max_memoria = max_memoria or config.CACHE_INTENCOES_MAX_MEMORIA
+        self.max_db = max_db or config.CACHE_INTENCOES_MAX_DB
+        self.ttl_segundos = ttl_segundos or config.CACHE_INTENCOES_TTL_SEGUNDOS
+        self.intencoes_ignoradas = set(config.CACHE_INTENCOES_IGNORADAS if intencoes_ignoradas is None else intencoes_ignoradas)
+        self._memoria = OrderedDict() # chave -> (intencao, modelo_entidades, criado_em)
+        self._lock = threading.Lock()
+        self._conexoes = GerenciadorConexoes(caminho_db, inicializar=self._criar_tabelas)
+        self._escritas_desde_poda = 0
+        self.contadores = {"hits_memoria": 0, "hits_db": 0, "misses": 0, "armazenados": 0, "ignorados": 0}
+
+    def _conexao(self):
+        return self._conexoes.conexao()
+
+    @staticmethod
+    def _criar_tabelas(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_intencoes (
+                chave TEXT PRIMARY KEY,
+                intencao TEXT NOT NULL,
+                entidades TEXT NOT NULL,
+                criado_em REAL NOT NULL,
+                ultimo_acesso REAL NOT NULL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_intencoes_ultimo_acesso ON cache_intencoes (ultimo_acesso)")
+
+    def _contar(self, nome):
+        with self._lock: self.contadores[nome] += 1
+
+    # --- Camada em memória ---
+    def _obter_memoria(self, chave, agora):
+        with self._lock:
+            item = self._memoria.get(chave)
+            if item is None: return None
+            if item[2] + self.ttl_segundos < agora:
+                del self._memoria[chave]; return None
+            self._memoria.move_to_end(chave)
+            return item
+
+    def _guardar_memoria(self, chave, item):
+        with self._lock:
+            self._memoria[chave] = item; self._memoria.move_to_end(chave)
+            while len(self._memoria) > self.max_memoria: self._memoria.popitem(last=False)
+
+    # --- Camada SQLite ---
+    def _obter_db(self, chave, agora):
+        conn = self._conexao()
+        row = conn.execute("SELECT intencao, entidades, criado_em FROM cache_intencoes WHERE chave = ?", (chave,)).fetchone()
+        if row is None: return None
+        if row[2] + self.ttl_segundos < agora:
+            conn.execute("DELETE FROM cache_intencoes WHERE chave = ?", (chave,)); return None
+        conn.execute("UPDATE cache_intencoes SET ultimo_acesso = ? WHERE chave = ?", (agora, chave))
+        return (row[0], json.loads(row[1]), row[2])
+
+    def _guardar_db(self, chave, item, agora):
+        conn = self._conexao()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_intencoes (chave, intencao, entidades, criado_em, ultimo_acesso) VALUES (?, ?, ?, ?, ?)",
+            (chave, item[0], json.dumps(item[1], ensure_ascii=False), item[2], agora)
+        )
+        self._escritas_desde_poda += 1
+        if self._escritas_desde_poda >= 100: # Poda por TTL e tamanho a cada 100 escritas
+            self._escritas_desde_poda = 0
+            conn.execute("DELETE FROM cache_intencoes WHERE criado_em < ?", (agora - self.ttl_segundos,))
+            conn.execute('''
+                DELETE FROM cache_intencoes WHERE chave IN (
+                    SELECT chave FROM cache_intencoes ORDER BY ultimo_acesso DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_db,))
+
+    # --- API pública ---
+    def obter(self, texto_usuario, variante=""):
+        """Retorna (intencao, entidades) do cache ou None em caso de miss."""
+        normalizado = _normalizar(texto_usuario); tokens = _numeros_do_texto(normalizado)
+        # Primeiro o modelo com marcadores; depois a chave exata, usada quando o modelo não era seguro
+        chaves = [(_com_variante(_chave_com_marcadores(normalizado), variante), True)] + ([(_com_variante(normalizado, variante), False)] if tokens else [])
+        agora = time.time()
+        for chave, eh_modelo in chaves:
+            item = self._obter_memoria(chave, agora)
+            if item is not None:
+                self._contar("hits_memoria")
+            else:
+                try: item = self._obter_db(chave, agora)
+                except sqlite3.Error as e: logger.warning("Erro ao ler cache persistente: %s", e); item = None
+                if item is None: continue
+                self._contar("hits_db"); self._guardar_memoria(chave, item)
+            entidades = _preencher_modelo(item[1], tokens) if eh_modelo else item[1]
+            logger.info("Hit para '%s': %s com args: %s", texto_usuario, item[0], entidades)
+            return item[0], entidades
+        self._contar("misses")
+        return None
+
+    def armazenar(self, texto_usuario, intencao, entidades, variante=""):
+        """Guarda o resultado do Gemini, exceto intenções ignoradas ou dependentes da data atual."""
+        if not intencao or intencao in self.intencoes_ignoradas or _tem_data(entidades or {}):
+            # Datas relativas ("ontem") viram datas absolutas no resultado, que ficariam erradas amanhã
+            self._contar("ignorados"); return
+        normalizado = _normalizar(texto_usuario); tokens = _numeros_do_texto(normalizado)
+        modelo = _montar_modelo(entidades or {}, tokens) if tokens else (entidades or {})
+        if modelo is None: chave, modelo = normalizado, (entidades or {})
+        else: chave = _chave_com_marcadores(normalizado)
+        chave = _com_variante(chave, variante)
+        agora = time.time(); item = (intencao, modelo, agora)
+        self._guardar_memoria(chave, item)
+        try: self._guardar_db(chave, item, agora)
+        except (sqlite3.Error, TypeError, ValueError) as e: logger.warning("Erro ao gravar cache persistente: %s", e)
+        self._contar("armazenados")
+
+    def estatisticas(self):
+        with self._lock:
+            stats = dict(self.contadores); stats["itens_memoria"] = len(self._memoria)
+        consultas = stats["hits_memoria"] + stats["hits_db"] + stats["misses"]
+        stats["taxa_acerto"] = ((stats["hits_memoria"] + stats["hits_db"]) / consultas) if consultas else 0.0
+        return stats
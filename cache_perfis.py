@@ -0,0 +1,76 @@
+import threading
+import weakref
+from collections import OrderedDict
+import config
+import metricas
+
+# --- Cache em memória dos perfis de usuário (linha de `usuarios`) ---
+# Toda mensagem lê o perfil (get_or_create_user) e a lógica do chatbot o relê; com o cache essas leituras
+# não vão ao banco. As funções de escrita de database.py invalidam a entrada depois do commit.
+# Com vários processos servindo o mesmo banco, validar_versao=True confere a coluna `versao` (incrementada
+# por trigger a cada UPDATE) sempre que PRAGMA data_version indica que outra conexão gravou no banco.
+# data_version só é comparável na mesma conexão, e as conexões do pool (conexoes_sqlite.py) passam de uma
+# thread para outra: o estado da validação fica por conexão, não por thread.
+
+cache_perfis_total = metricas.Contador("agente_cache_perfis_total", "Consultas ao cache de perfis por resultado (hit, miss, obsoleto).", ("resultado",))
+
+class CachePerfis:
+    def __init__(self, max_itens=None, validar_versao=None):
+        self.max_itens = max_itens or config.CACHE_PERFIS_MAX
+        self.validar_versao = config.CACHE_PERFIS_VALIDAR_VERSAO if validar_versao is None else validar_versao
+        self._itens = OrderedDict() # wa_id -> perfil (dict)
+        self._lock = threading.Lock()
+        self._por_conexao = weakref.WeakKeyDictionary() # conexão -> [data_version visto, wa_ids já validados desde então]
+        self.contadores = {"hit": 0, "miss": 0, "obsoleto": 0}
+
+    def _contar(self, resultado):
+        with self._lock: self.contadores[resultado] += 1
+        cache_perfis_total.inc(resultado=resultado)
+
+    def _ainda_valido(self, wa_id, perfil, conn):
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        with self._lock:
+            estado = self._por_conexao.get(conn)
+            if estado is None or estado[0] != data_version: estado = self._por_conexao[conn] = [data_version, set()]
+            if wa_id in estado[1]: return True
+        row = conn.execute("SELECT versao FROM usuarios WHERE wa_id = ?", (wa_id,)).fetchone()
+        if row is None or row[0] != perfil.get("versao"): return False
+        with self._lock: estado[1].add(wa_id)
+        return True
+
+    def obter(self, wa_id, conn=None):
+        """Cópia do perfil em cache ou None. conn (conexão de conexoes_sqlite em uso pela thread) é necessária se
+        validar_versao estiver ativo."""
+        with self._lock:
+            perfil = self._itens.get(wa_id)
+            if perfil is not None: self._itens.move_to_end(wa_id)
+        if perfil is None:
+            self._contar("miss"); return None
+        if self.validar_versao and conn is not None and not self._ainda_valido(wa_id, perfil, conn):
+            self.invalidar(wa_id); self._contar("obsoleto"); return None
+        self._contar("hit")
+        return dict(perfil)
+
+    def guardar(self, perfil, conn=None):
+        """Guarda o perfil lido do banco (por conn, que já fica dispensada de revalidá-lo)."""
+        if not perfil: return
+        with self._lock:
+            self._itens[perfil["wa_id"]] = dict(perfil); self._itens.move_to_end(perfil["wa_id"])
+            while len(self._itens) > self.max_itens: self._itens.popitem(last=False)
+            estado = self._por_conexao.get(conn) if conn is not None else None
+            if estado is not None: estado[1].add(perfil["wa_id"])
+
+    def invalidar(self, wa_id):
+        with self._lock:
+            self._itens.pop(wa_id, None)
+            # Uma escrita da própria conexão não muda o data_version dela: a validação anterior não vale mais
+            for estado in self._por_conexao.values(): estado[1].discard(wa_id)
+
+    def limpar(self):
+        with self._lock: self._itens.clear()
+
+    def estatisticas(self):
+        with self._lock:
+            c = dict(self.contadores); tamanho = len(self._itens)
+        consultas = c["hit"] + c["miss"] + c["obsoleto"]
+        return {**c, "tamanho": tamanho, "taxa_acerto": c["hit"] / consultas if consultas else 0.0}
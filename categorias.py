@@ -0,0 +1,121 @@
+import functools
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+import config
+from database import buscar_correcoes_categoria, salvar_correcao_categoria
+from texto_utils import normalizar_texto, remover_acentos
+
+logger = logging.getLogger(__name__)
+
+# --- Categorização local de gastos por palavras-chave ---
+# As palavras-chave são compiladas uma única vez numa só regex (alternância com limites de palavra) aplicada
+# ao texto sem acentos: "onibus" casa com "ônibus", "99" não casa dentro de "199" e "bar" não casa em
+# "barbearia". Antes das palavras-chave valem as correções manuais do próprio usuário (alterar categoria de um
+# gasto pendente), lidas da tabela categorias_usuario e mantidas em cache por wa_id.
+
+# A ordem das categorias é a prioridade quando palavras de categorias diferentes aparecem na descrição
+MAPA_CATEGORIAS = {
+    "Alimentação": ["almoço", "jantar", "café", "lanche", "restaurante", "mercado", "comida", "padaria", "ifood", "rappi", "supermercado"],
+    "Transporte": ["uber", "99", "gasolina", "estacionamento", "metrô", "ônibus", "passagem", "combustível", "taxi"],
+    "Moradia": ["aluguel", "condomínio", "água", "luz", "internet", "gás", "iptu", "telefone fixo"],
+    "Lazer": ["cinema", "show", "bar", "festa", "jogo", "livro", "streaming", "netflix", "spotify", "teatro", "viagem"],
+    "Saúde": ["farmácia", "remédio", "consulta", "médico", "hospital", "plano de saúde", "dentista"],
+    "Outros": []
+}
+CATEGORIA_PADRAO = "Outros"
+
+def _padrao_trie(palavras):
+    # Alternância fatorada por prefixo ("ca(?:fe|...)"): o motor de regex descarta a maioria das posições no
+    # primeiro caractere em vez de tentar cada palavra-chave. Prefixos que também são palavras ficam opcionais.
+    trie = {}
+    for palavra in palavras:
+        no = trie
+        for ch in palavra: no = no.setdefault(ch, {})
+        no[""] = True
+    def emitir(no):
+        ramos = [re.escape(ch) + emitir(filho) for ch, filho in sorted(no.items()) if ch]
+        if not ramos: return ""
+        corpo = ramos[0] if len(ramos) == 1 else "(?:" + "|".join(ramos) + ")"
+        return "(?:" + corpo + ")?" if "" in no else corpo
+    return emitir(trie)
+
+def _compilar_palavras(palavras):
+    # Limites de palavra nas duas pontas; plural opcional ("lanches", "bares")
+    return re.compile(r'\b(?:' + _padrao_trie(palavras) + r')(?:e?s)?\b')
+
+def _com_plurais(mapa):
+    # Chave também no plural, para o trecho casado pela regex ser procurado direto no dicionário
+    formas = dict(mapa)
+    for palavra, valor in mapa.items():
+        formas.setdefault(palavra + "s", valor); formas.setdefault(palavra + "es", valor)
+    return formas
+
+PRIORIDADE_PALAVRA = {} # palavra sem acento -> (prioridade da categoria, categoria)
+for _prioridade, (_categoria, _palavras) in enumerate(MAPA_CATEGORIAS.items()):
+    for _palavra in _palavras: PRIORIDADE_PALAVRA.setdefault(normalizar_texto(_palavra), (_prioridade, _categoria))
+RE_PALAVRAS_CHAVE = _compilar_palavras(PRIORIDADE_PALAVRA)
+_PRIORIDADE_FORMA = _com_plurais(PRIORIDADE_PALAVRA)
+CATEGORIAS_CANONICAS = {normalizar_texto(c): c for c in MAPA_CATEGORIAS}
+
+@functools.lru_cache(maxsize=4096) # Descrições se repetem muito (mesmos estabelecimentos, extratos)
+def categoria_por_palavras_chave(descricao):
+    """Categoria pelas palavras-chave (sem as correções do usuário)."""
+    encontradas = RE_PALAVRAS_CHAVE.findall(remover_acentos(descricao or ""))
+    if not encontradas: return CATEGORIA_PADRAO
+    if len(encontradas) == 1: return _PRIORIDADE_FORMA[encontradas[0]][1]
+    return min(map(_PRIORIDADE_FORMA.__getitem__, encontradas))[1]
+
+def nome_canonico(categoria):
+    """'alimentacao' -> 'Alimentação'; categorias fora do mapa ficam como o usuário escreveu."""
+    categoria = (categoria or "").strip()
+    return CATEGORIAS_CANONICAS.get(normalizar_texto(categoria), categoria)
+
+class CacheCorrecoes:
+    """Correções de categoria por wa_id: {descrição normalizada: categoria} + regex com essas descrições."""
+    def __init__(self, max_itens=None, ttl_segundos=None):
+        self.max_itens = max_itens or config.CATEGORIAS_USUARIO_CACHE_MAX
+        self.ttl_segundos = ttl_segundos or config.CATEGORIAS_USUARIO_CACHE_TTL_SEGUNDOS
+        self._itens = OrderedDict() # wa_id -> (correcoes, regex ou None, carregado_em); sai o mais antigo
+        self._lock = threading.Lock()
+
+    def obter(self, wa_id):
+        # Leitura sem lock (dict.get é atômico): é chamada a cada gasto categorizado
+        item = self._itens.get(wa_id)
+        if item is not None and time.monotonic() - item[2] <= self.ttl_segundos: return item
+        correcoes = buscar_correcoes_categoria(wa_id)
+        item = (_com_plurais(correcoes), _compilar_palavras(correcoes) if correcoes else None, time.monotonic())
+        with self._lock:
+            self._itens.pop(wa_id, None); self._itens[wa_id] = item
+            while len(self._itens) > self.max_itens: self._itens.popitem(last=False)
+        return item
+
+    def invalidar(self, wa_id):
+        with self._lock: self._itens.pop(wa_id, None)
+
+cache_correcoes = CacheCorrecoes()
+
+def categoria_aprendida(wa_id, descricao):
+    """Categoria que o usuário já escolheu manualmente para essa descrição (ou uma que a contém), ou None."""
+    if not wa_id or not descricao: return None
+    correcoes, regex, _ = cache_correcoes.obter(wa_id)
+    if not correcoes: return None
+    descricao = normalizar_texto(descricao)
+    if descricao in correcoes: return correcoes[descricao]
+    encontradas = regex.findall(descricao)
+    if not encontradas: return None
+    return correcoes[max(encontradas, key=len)] # A correção mais específica
+
+def categorizar(descricao, wa_id=None):
+    """Correção aprendida do usuário (se houver) ou categoria pelas palavras-chave."""
+    return categoria_aprendida(wa_id, descricao) or categoria_por_palavras_chave(descricao)
+
+def registrar_correcao(wa_id, descricao, categoria):
+    """Guarda a categoria escolhida manualmente para a descrição; os próximos gastos iguais já vêm com ela."""
+    descricao = normalizar_texto(descricao or "")
+    if not wa_id or not descricao or not categoria: return False
+    salvo = salvar_correcao_categoria(wa_id, descricao, categoria)
+    cache_correcoes.invalidar(wa_id)
+    return salvo
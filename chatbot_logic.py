@@ -1,71 +1,159 @@
 import datetime
+import logging
+import config
 from database import (
-    salvar_gasto_no_banco, 
+    confirmar_gasto_e_avaliar_orcamento,
+    confirmar_gastos_e_avaliar_orcamento,
     buscar_gastos_do_banco,
     update_user_onboarding_step,
     update_user_financial_goal,
     update_user_monthly_income,
     complete_onboarding_for_user,
     get_user_profile,
-    calcular_total_gastos_mes_atual,
-    update_ultimo_aviso_orcamento
+    cursor_listagem
 )
-from gemini_handler import extrair_info_gemini
-
-# Dicionário para armazenar gastos pendentes de confirmação
-gastos_pendentes = {} 
-
-def categorizar_gasto(descricao):
-    # Função para categorizar gastos baseada em palavras-chave.
-    descricao_lower = descricao.lower()
-    mapa_categorias = {
-        "Alimentação": ["almoço", "jantar", "café", "lanche", "restaurante", "mercado", "comida", "padaria", "ifood", "rappi", "supermercado"],
-        "Transporte": ["uber", "99", "gasolina", "estacionamento", "metrô", "ônibus", "passagem", "combustível", "taxi"],
-        "Moradia": ["aluguel", "condomínio", "água", "luz", "internet", "gás", "iptu", "telefone fixo"],
-        "Lazer": ["cinema", "show", "bar", "festa", "jogo", "livro", "streaming", "netflix", "spotify", "teatro", "viagem"],
-        "Saúde": ["farmácia", "remédio", "consulta", "médico", "hospital", "plano de saúde", "dentista"],
-        "Outros": [] 
+from gemini_handler import extrair_info_gemini, INTENCAO_INDISPONIVEL
+from analise_gastos import analisar_gastos
+from categorias import categorizar, categoria_aprendida, nome_canonico, registrar_correcao
+from pendencias import criar_armazem_pendencias
+from texto_utils import parsear_periodo
+
+logger = logging.getLogger(__name__)
+
+# Gastos pendentes de confirmação, por wa_id (compartilhado entre processos com o backend SQLite)
+pendencias = criar_armazem_pendencias()
+PENDENCIA_GASTO = "gasto" # Um gasto ou um lote {"lote": [gastos]} vindo de uma só mensagem
+PENDENCIA_LISTAGEM = "listagem" # Cursor da última listagem, para o "ver mais"
+
+def contexto_gemini(numero_usuario_wa):
+    """Estado do usuário que define as ferramentas enviadas ao Gemini (gemini_handler.nomes_ferramentas)."""
+    return {
+        "gasto_pendente": pendencias.obter(numero_usuario_wa, PENDENCIA_GASTO) is not None,
+        "listagem": pendencias.obter(numero_usuario_wa, PENDENCIA_LISTAGEM) is not None,
     }
-    for categoria, palavras_chave in mapa_categorias.items():
-        for palavra in palavras_chave:
-            if palavra in descricao_lower:
-                return categoria
-    return "Outros"
-
-def checar_e_gerar_aviso_orcamento(numero_usuario_wa):
-    """Verifica os gastos do usuário e retorna uma mensagem de aviso se um novo limiar foi atingido."""
-    user_profile = get_user_profile(numero_usuario_wa)
-    if not user_profile or not user_profile.get("renda_mensal"):
-        return None # Não pode checar orçamento sem renda registrada
-
-    renda = user_profile["renda_mensal"]
-    if renda <= 0: return None # Evita divisão por zero
-
-    total_gastos = calcular_total_gastos_mes_atual(numero_usuario_wa)
-    percentual_gasto = (total_gastos / renda) * 100
-    
-    ultimo_aviso = user_profile.get("ultimo_aviso_orcamento", 0)
-    
-    # Limiares de aviso
-    limiares = [100, 90, 80, 75, 70, 60, 50]
-    
-    # Encontra o maior limiar atingido que ainda não foi avisado
-    for limiar in limiares:
-        if percentual_gasto >= limiar and ultimo_aviso < limiar:
-            # Encontramos um novo aviso a ser enviado!
-            update_ultimo_aviso_orcamento(numero_usuario_wa, limiar)
-            aviso = f"\n\n**Atenção!** 🔔\nVocê já comprometeu **{percentual_gasto:.0f}%** da sua renda de R${renda:.2f} este mês (Total gasto: R${total_gastos:.2f})."
-            return aviso
-            
-    return None # Nenhum novo aviso necessário
 
+def categorizar_gasto(descricao, wa_id=None):
+    # Categoriza pelo que o usuário já corrigiu antes (se wa_id for informado) ou pelas palavras-chave (ver categorias.py).
+    return categorizar(descricao, wa_id)
+
+# Limiares de aviso (% da renda mensal comprometida)
+LIMIARES_AVISO_ORCAMENTO = [100, 90, 80, 75, 70, 60, 50]
+
+def gerar_aviso_orcamento(resultado_confirmacao):
+    """Monta a mensagem de aviso se a confirmação do gasto atingiu um novo limiar (senão retorna None)."""
+    if not resultado_confirmacao or not resultado_confirmacao.get("limiar_avisado"):
+        return None # Nenhum novo aviso necessário (ou usuário sem renda registrada)
+    return (f"\n\n**Atenção!** 🔔\nVocê já comprometeu **{resultado_confirmacao['percentual']:.0f}%** da sua renda de "
+            f"R${resultado_confirmacao['renda']:.2f} este mês (Total gasto: R${resultado_confirmacao['total_mes']:.2f}).")
+
+def preparar_gasto(numero_usuario_wa, entidades):
+    """Valida as entidades de registrar_gasto. Retorna (gasto pendente, None) ou (None, mensagem de erro)."""
+    valor_extraido = entidades.get('valor'); descricao_extraida = entidades.get('descricao')
+    categoria_sugerida = entidades.get('categoria', 'Outros'); data_str_gemini = entidades.get('data')
+    if valor_extraido is None: return None, "Não identifiquei o valor do gasto."
+    if not descricao_extraida: return None, "Não identifiquei a descrição do gasto."
+    try: valor_float = float(valor_extraido)
+    except (ValueError, TypeError): return None, f"Descrição '{descricao_extraida}', mas o valor '{valor_extraido}' parece inválido."
+    data_para_salvar = datetime.date.today().strftime("%Y-%m-%d")
+    if data_str_gemini: data_para_salvar = data_str_gemini.split('T')[0] if 'T' in data_str_gemini else data_str_gemini
+    # Uma correção anterior do próprio usuário vale mais que a sugestão do Gemini
+    categoria_final = categoria_aprendida(numero_usuario_wa, descricao_extraida) or (categoria_sugerida if categoria_sugerida != 'Outros' else categorizar_gasto(descricao_extraida))
+    return {"descricao": descricao_extraida, "valor": valor_float, "categoria": categoria_final, "data_para_salvar": data_para_salvar}, None
+
+def _formatar_lote(lote):
+    linhas = [f"{i}. {g['descricao']} - R${g['valor']:.2f} ({g['categoria']}, {g['data_para_salvar']})" for i, g in enumerate(lote, 1)]
+    return "\n".join(linhas) + f"\nTotal: R${sum(g['valor'] for g in lote):.2f}"
+
+def _alterar_campo(numero_usuario_wa, gasto, campo_a_alterar, novo_valor_texto):
+    """Aplica a alteração ao gasto pendente. Retorna None se deu certo ou a mensagem de erro."""
+    if "descri" in campo_a_alterar: gasto['descricao'] = novo_valor_texto; gasto['categoria'] = categorizar_gasto(novo_valor_texto, numero_usuario_wa)
+    elif "valor" in campo_a_alterar:
+        try: gasto['valor'] = float(novo_valor_texto)
+        except (ValueError, TypeError): return f"'{novo_valor_texto}' não é um valor válido. O gasto não foi alterado."
+    elif "categ" in campo_a_alterar: gasto['categoria'] = nome_canonico(novo_valor_texto)
+    elif "data" in campo_a_alterar: gasto['data_para_salvar'] = novo_valor_texto.split('T')[0] if 'T' in novo_valor_texto else novo_valor_texto
+    else: return f"Não entendi qual campo ('{campo_a_alterar}') você quer alterar."
+    return None
+
+def _aprender_correcao(numero_usuario_wa, gasto, campo_a_alterar):
+    # Só depois que a alteração foi gravada na pendência: uma alteração recusada (versão velha) não ensina nada
+    if "categ" in campo_a_alterar: registrar_correcao(numero_usuario_wa, gasto['descricao'], gasto['categoria'])
+
+def _formatar_data_br(data_iso):
+    return datetime.date.fromisoformat(data_iso).strftime("%d/%m/%Y")
+
+def responder_listagem(numero_usuario_wa, consulta):
+    """Monta uma página da listagem de gastos e guarda o cursor da próxima (se houver) para o "ver mais"."""
+    limite = consulta["limite"]
+    # Busca um item a mais só para saber se existe próxima página
+    gastos = buscar_gastos_do_banco(numero_usuario_wa, limite=limite + 1, inicio=consulta.get("inicio"), fim=consulta.get("fim"), apos=consulta.get("cursor"))
+    ha_mais = len(gastos) > limite; gastos = gastos[:limite]
+    if not gastos:
+        pendencias.retirar(numero_usuario_wa, PENDENCIA_LISTAGEM)
+        if consulta.get("cursor"): return "Não há mais gastos para mostrar."
+        return f"Nenhum gasto registrado {consulta['rotulo']}." if consulta.get("rotulo") else "Nenhum gasto registrado."
+
+    titulo = "Mais gastos" if consulta.get("cursor") else "Últimos gastos registrados"
+    linhas = [f"{titulo} {consulta['rotulo']}:" if consulta.get("rotulo") else f"{titulo}:"]
+    for g_item in gastos:
+        cat_info = f" (Cat: {g_item['categoria']})" if g_item['categoria'] else ""
+        dex = g_item['data_despesa'] if g_item['data_despesa'] else str(g_item['data_registro_sistema']).split(" ")[0]
+        vfor = f"{g_item['valor']:.2f}" if isinstance(g_item['valor'],(int,float)) else g_item['valor']
+        linhas.append(f"- R${vfor} em '{g_item['descricao']}'{cat_info} (Data: {dex})")
+    if ha_mais:
+        pendencias.definir(numero_usuario_wa, PENDENCIA_LISTAGEM, {**consulta, "cursor": cursor_listagem(gastos[-1])}, ttl_segundos=config.LISTAGEM_TTL_SEGUNDOS)
+        linhas.append("\nDigite *ver mais* para ver os próximos.")
+    else:
+        pendencias.retirar(numero_usuario_wa, PENDENCIA_LISTAGEM)
+    return "\n".join(linhas)
+
+def _formatar_variacao(atual, anterior):
+    if not anterior: return "sem gastos no período anterior" if atual else "sem gastos nos dois períodos"
+    variacao = (atual - anterior) / anterior * 100
+    return f"{'+' if variacao >= 0 else ''}{variacao:.0f}% (antes: R${anterior:.2f})"
+
+def responder_resumo(numero_usuario_wa, entidades):
+    """Resumo dos gastos de um período (padrão: este mês) com comparação ao período anterior; com 'categoria',
+    só o total daquela categoria ou estabelecimento."""
+    periodo_texto = entidades.get('periodo') or "este mês"
+    periodo = parsear_periodo(periodo_texto)
+    if not periodo:
+        return f"Não entendi o período '{periodo_texto}'. Tente, por exemplo, 'quanto gastei este mês' ou 'resumo de maio'."
+    inicio, fim = periodo
+    rotulo = f"em {_formatar_data_br(inicio)}" if inicio == fim else f"de {_formatar_data_br(inicio)} a {_formatar_data_br(fim)}"
+    resumo = analisar_gastos(numero_usuario_wa, inicio, fim, termo=entidades.get('categoria'))
+    anterior = resumo["anterior"]
+    rotulo_anterior = f"{_formatar_data_br(anterior['inicio'])} a {_formatar_data_br(anterior['fim'])}"
+
+    filtro = resumo.get("filtro")
+    if filtro:
+        nome = filtro["rotulo"] if filtro["tipo"] == "categoria" else f"'{filtro['rotulo']}'"
+        if not filtro["quantidade"] and not filtro["total_anterior"]:
+            return f"Não encontrei gastos com {nome} {rotulo}."
+        return (f"Com {nome} você gastou **R${filtro['total']:.2f}** {rotulo} ({filtro['quantidade']} gasto(s), média de R${filtro['media_diaria']:.2f}/dia).\n"
+                f"Comparado a {rotulo_anterior}: {_formatar_variacao(filtro['total'], filtro['total_anterior'])}.")
+
+    if not resumo["quantidade"]:
+        return f"Nenhum gasto registrado {rotulo}." + (f" No período anterior ({rotulo_anterior}) foram R${anterior['total']:.2f}." if anterior["total"] else "")
+    linhas = [f"Resumo dos seus gastos {rotulo}:",
+              f"Total: **R${resumo['total']:.2f}** em {resumo['quantidade']} gasto(s) (média de R${resumo['media_diaria']:.2f}/dia)",
+              f"Comparado a {rotulo_anterior}: {_formatar_variacao(resumo['total'], anterior['total'])}",
+              "", "Por categoria:"]
+    for c in resumo["categorias"]:
+        tendencia = ""
+        if c["total_anterior"]: tendencia = f", {'+' if c['total'] >= c['total_anterior'] else ''}{(c['total'] - c['total_anterior']) / c['total_anterior'] * 100:.0f}%"
+        linhas.append(f"- {c['categoria']}: R${c['total']:.2f} ({c['percentual']:.0f}%{tendencia})")
+    if resumo["estabelecimentos"]:
+        linhas += ["", "Onde você mais gastou:"]
+        linhas += [f"- {e['descricao']}: R${e['total']:.2f} ({e['quantidade']}x)" for e in resumo["estabelecimentos"]]
+    return "\n".join(linhas)
 
 def gerar_resposta_do_chatbot(intencao, entidades, texto_usuario_original="", numero_usuario_wa=None, user_profile=None):
     """Processa a intenção e entidades para gerar a resposta do chatbot."""
     resposta_final_agente = "Desculpe, não consegui processar seu pedido agora."
 
     if not user_profile:
-        print(f"ERRO LOGIC: User profile não fornecido para {numero_usuario_wa}")
+        logger.error("User profile não fornecido para %s", numero_usuario_wa)
         return "Desculpe, estou com um problema para acessar suas informações. Tente novamente mais tarde."
 
     # --- LÓGICA DE ONBOARDING ---
@@ -82,7 +170,7 @@ def gerar_resposta_do_chatbot(intencao, entidades, texto_usuario_original="", nu
             else:
                 resposta_final_agente = ("Hum, esse valor de renda não parece ser um número. 🤔\nPoderia me informar sua renda mensal aproximada usando apenas números?")
         elif current_step == "awaiting_goal_after_income":
-            intencao_validacao, entidades_validacao = extrair_info_gemini(texto_usuario_original)
+            intencao_validacao, entidades_validacao = extrair_info_gemini(texto_usuario_original, {"onboarding": True})
             if intencao_validacao == 'avaliar_objetivo_financeiro':
                 eh_valido = entidades_validacao.get('eh_valido', False)
                 objetivo_final = entidades_validacao.get('objetivo_reformulado')
@@ -95,6 +183,8 @@ def gerar_resposta_do_chatbot(intencao, entidades, texto_usuario_original="", nu
                     resposta_final_agente = (f"Perfeito! Onboarding concluído. 👍\n\nSeu objetivo: **{objetivo_final}**\nSua renda: **R${renda:.2f}**\n\nAgora você já pode usar todas as funcionalidades. Como posso te ajudar hoje?")
                 else:
                     resposta_final_agente = f"{feedback} Por favor, tente descrever seu objetivo novamente com um foco mais financeiro."
+            elif intencao_validacao == INTENCAO_INDISPONIVEL:
+                resposta_final_agente = "Estou com instabilidade para avaliar seu objetivo agora. 😕 Pode me mandar de novo daqui a alguns minutos?"
             else:
                 resposta_final_agente = "Não entendi bem seu objetivo. Poderia tentar descrevê-lo de forma mais direta? (ex: 'guardar dinheiro para uma viagem')"
         else:
@@ -105,33 +195,50 @@ def gerar_resposta_do_chatbot(intencao, entidades, texto_usuario_original="", nu
     # --- LÓGICA PRINCIPAL DO CHATBOT (APÓS ONBOARDING) ---
     
     if intencao == 'registrar_gasto':
-        # ... (Sua lógica de registrar_gasto e pedir confirmação permanece a mesma)
-        valor_extraido = entidades.get('valor'); descricao_extraida = entidades.get('descricao')
-        categoria_sugerida = entidades.get('categoria', 'Outros'); data_str_gemini = entidades.get('data')
-        if valor_extraido is not None and descricao_extraida:
-            try:
-                valor_float = float(valor_extraido); data_atual_string = datetime.date.today().strftime("%Y-%m-%d")
-                data_para_salvar = data_atual_string; data_exibir = f"hoje ({data_atual_string})"
-                if data_str_gemini:
-                    data_para_salvar = data_str_gemini.split('T')[0] if 'T' in data_str_gemini else data_str_gemini
-                    data_exibir = data_para_salvar
-                categoria_final = categoria_sugerida if categoria_sugerida != 'Outros' else categorizar_gasto(descricao_extraida)
-                gastos_pendentes[numero_usuario_wa] = {"descricao": descricao_extraida, "valor": valor_float, "categoria": categoria_final, "data_para_salvar": data_para_salvar}
-                msg_confirmacao = (f"Registrando:\n- Desc: {descricao_extraida}\n- Valor: R${valor_float:.2f}\n- Cat: {categoria_final}\n- Data: {data_exibir}\n")
-                if not data_str_gemini: msg_confirmacao += f"(Como não especificou a data, usaremos data de hoje: {data_atual_string}).\n"
-                msg_confirmacao += "\nCerto? (sim/não/alterar)"; resposta_final_agente = msg_confirmacao
-            except (ValueError, TypeError): resposta_final_agente = f"Descrição '{descricao_extraida}', mas o valor '{valor_extraido}' parece inválido."
-        elif not valor_extraido: resposta_final_agente = "Não identifiquei o valor do gasto."
-        elif not descricao_extraida: resposta_final_agente = "Não identifiquei a descrição do gasto."
-        else: resposta_final_agente = "Não consegui pegar todos os detalhes do gasto."
+        gasto, erro = preparar_gasto(numero_usuario_wa, entidades)
+        if gasto:
+            pendencias.definir(numero_usuario_wa, PENDENCIA_GASTO, gasto)
+            data_exibir = gasto['data_para_salvar'] if entidades.get('data') else f"hoje ({gasto['data_para_salvar']})"
+            msg_confirmacao = (f"Registrando:\n- Desc: {gasto['descricao']}\n- Valor: R${gasto['valor']:.2f}\n- Cat: {gasto['categoria']}\n- Data: {data_exibir}\n")
+            if not entidades.get('data'): msg_confirmacao += f"(Como não especificou a data, usaremos data de hoje: {gasto['data_para_salvar']}).\n"
+            msg_confirmacao += "\nCerto? (sim/não/alterar)"; resposta_final_agente = msg_confirmacao
+        else: resposta_final_agente = erro
+
+    elif intencao == 'registrar_gastos':
+        # Vários gastos na mesma mensagem ("50 almoço, 20 uber, 12 café"): uma confirmação para o lote inteiro
+        lote = []; erros = []
+        for i, entidades_gasto in enumerate(entidades.get('gastos') or [], 1):
+            gasto, erro = preparar_gasto(numero_usuario_wa, entidades_gasto)
+            if gasto: lote.append(gasto)
+            else: erros.append(f"{i}. {erro}")
+        if erros: resposta_final_agente = "Não consegui entender todos os gastos:\n" + "\n".join(erros) + "\nPode mandar de novo?"
+        elif not lote: resposta_final_agente = "Não identifiquei nenhum gasto na mensagem."
+        else:
+            pendencias.definir(numero_usuario_wa, PENDENCIA_GASTO, lote[0] if len(lote) == 1 else {"lote": lote})
+            resposta_final_agente = f"Registrando {len(lote)} gastos:\n{_formatar_lote(lote)}\n\nCertos? (sim/não/alterar)"
 
     elif intencao == 'confirmar_operacao':
-        if numero_usuario_wa and numero_usuario_wa in gastos_pendentes:
-            gasto_a_salvar = gastos_pendentes.pop(numero_usuario_wa)
-            if salvar_gasto_no_banco(numero_usuario_wa, gasto_a_salvar['descricao'],gasto_a_salvar['valor'],gasto_a_salvar['categoria'],gasto_a_salvar['data_para_salvar']):
+        # retirar é atômico: se o "sim" chegar duas vezes (ou em dois processos), só um deles salva o gasto
+        gasto_a_salvar = pendencias.retirar(numero_usuario_wa, PENDENCIA_GASTO) if numero_usuario_wa else None
+        if gasto_a_salvar and "lote" in gasto_a_salvar:
+            # Todos os gastos do lote com um executemany numa transação, e uma só avaliação do orçamento
+            lote = gasto_a_salvar["lote"]
+            resultado = confirmar_gastos_e_avaliar_orcamento(numero_usuario_wa, [(g['descricao'], g['valor'], g['categoria'], g['data_para_salvar']) for g in lote],
+                                                             limiares=LIMIARES_AVISO_ORCAMENTO)
+            if resultado is not None:
+                resposta_final_agente = f"Confirmado! {len(lote)} gastos salvos com sucesso (total R${sum(g['valor'] for g in lote):.2f})."
+                resposta_final_agente += gerar_aviso_orcamento(resultado) or ""
+            else:
+                resposta_final_agente = "Ok, mas ocorreu um erro ao salvar. Por favor, tente registrar novamente."
+        elif gasto_a_salvar:
+            # Insere o gasto, recalcula o total do mês e avança o aviso de orçamento numa única transação
+            resultado = confirmar_gasto_e_avaliar_orcamento(numero_usuario_wa, gasto_a_salvar['descricao'], gasto_a_salvar['valor'],
+                                                            gasto_a_salvar['categoria'], gasto_a_salvar['data_para_salvar'],
+                                                            limiares=LIMIARES_AVISO_ORCAMENTO)
+            if resultado is not None:
                 resposta_final_agente = (f"Confirmado! Gasto salvo com sucesso.")
                 
-                aviso_orcamento = checar_e_gerar_aviso_orcamento(numero_usuario_wa)
+                aviso_orcamento = gerar_aviso_orcamento(resultado)
                 if aviso_orcamento:
                     resposta_final_agente += aviso_orcamento
             else: 
@@ -140,21 +247,30 @@ def gerar_resposta_do_chatbot(intencao, entidades, texto_usuario_original="", nu
             resposta_final_agente = "Não tenho nenhum gasto pendente para confirmar."
     
     elif intencao == 'listar_gastos':
-        limite_usr = entidades.get('limite', 5); limite_int = 5
+        limite_usr = entidades.get('limite', config.LISTAGEM_ITENS_PADRAO); limite_int = config.LISTAGEM_ITENS_PADRAO
         try: limite_int = int(limite_usr)
         except (ValueError, TypeError): pass
-        gastos_recentes = buscar_gastos_do_banco(numero_usuario_wa, limite=limite_int)
-        if gastos_recentes:
-            rfa = "Últimos gastos registrados:\n"
-            for g_item in gastos_recentes:
-                cat_info = f" (Cat: {g_item['categoria']})" if g_item['categoria'] else ""
-                dex = g_item['data_despesa'] if g_item['data_despesa'] else str(g_item['data_registro_sistema']).split(" ")[0]
-                vfor = f"{g_item['valor']:.2f}" if isinstance(g_item['valor'],(int,float)) else g_item['valor']
-                rfa += f"- R${vfor} em '{g_item['descricao']}'{cat_info} (Data: {dex})\n"
-            resposta_final_agente = rfa.strip()
-        else: 
-            resposta_final_agente = "Nenhum gasto registrado."
+        limite_int = max(1, min(limite_int, config.LISTAGEM_MAX_ITENS_POR_RESPOSTA)) # O restante vem com "ver mais"
+        consulta = {"limite": limite_int}; aviso_periodo = ""
+        periodo_texto = entidades.get('periodo')
+        if periodo_texto:
+            periodo = parsear_periodo(periodo_texto)
+            if periodo:
+                inicio, fim = periodo
+                rotulo = f"em {_formatar_data_br(inicio)}" if inicio == fim else f"de {_formatar_data_br(inicio)} a {_formatar_data_br(fim)}"
+                consulta.update(inicio=inicio, fim=fim, rotulo=rotulo)
+            else:
+                aviso_periodo = f"(Não entendi o período '{periodo_texto}', então mostro os mais recentes.)\n"
+        resposta_final_agente = aviso_periodo + responder_listagem(numero_usuario_wa, consulta)
+
+    elif intencao == 'ver_mais_gastos':
+        pendente = pendencias.obter(numero_usuario_wa, PENDENCIA_LISTAGEM) if numero_usuario_wa else None
+        if pendente: resposta_final_agente = responder_listagem(numero_usuario_wa, pendente[0])
+        else: resposta_final_agente = "Não há uma listagem em andamento. Peça, por exemplo, 'listar gastos do mês passado'."
             
+    elif intencao == 'resumo_gastos':
+        resposta_final_agente = responder_resumo(numero_usuario_wa, entidades)
+
     # <<< BLOCO ADICIONADO PARA ALTERAR A RENDA >>>
     elif intencao == 'alterar_renda_mensal':
         if not user_profile["onboarding_complete"]:
@@ -177,27 +293,36 @@ def gerar_resposta_do_chatbot(intencao, entidades, texto_usuario_original="", nu
     # ... (O restante das suas intenções: cancelar_operacao, solicitar_alteracao_gasto, etc., permanecem as mesmas)
     # Colocando os outros elifs aqui para garantir que a ordem esteja correta
     elif intencao == 'cancelar_operacao':
-        if numero_usuario_wa and numero_usuario_wa in gastos_pendentes:
-            gastos_pendentes.pop(numero_usuario_wa)
+        if numero_usuario_wa and pendencias.retirar(numero_usuario_wa, PENDENCIA_GASTO):
             resposta_final_agente = "Ok, registro cancelado."
         else: resposta_final_agente = "Ok, não havia nada pendente para cancelar."
             
     elif intencao == 'solicitar_alteracao_gasto':
-        if numero_usuario_wa and numero_usuario_wa in gastos_pendentes:
-            gasto_atual = gastos_pendentes[numero_usuario_wa]
+        pendente = pendencias.obter(numero_usuario_wa, PENDENCIA_GASTO) if numero_usuario_wa else None
+        if pendente:
+            gasto_atual, versao_lida = pendente
             campo_a_alterar = entidades.get('campo_a_alterar',"").lower(); novo_valor_texto = entidades.get('novo_valor_texto')
-            if campo_a_alterar and novo_valor_texto:
-                alterado = False
-                if "descri" in campo_a_alterar: gasto_atual['descricao'] = novo_valor_texto; gasto_atual['categoria'] = categorizar_gasto(novo_valor_texto); alterado = True
-                elif "valor" in campo_a_alterar:
-                    try: gasto_atual['valor'] = float(novo_valor_texto); alterado = True
-                    except (ValueError, TypeError): return f"'{novo_valor_texto}' não é um valor válido. O gasto não foi alterado."
-                elif "categ" in campo_a_alterar: gasto_atual['categoria'] = novo_valor_texto; alterado = True
-                elif "data" in campo_a_alterar: gasto_atual['data_para_salvar'] = novo_valor_texto.split('T')[0] if 'T' in novo_valor_texto else novo_valor_texto; alterado = True
-                if alterado:
-                    gastos_pendentes[numero_usuario_wa] = gasto_atual
+            lote = gasto_atual.get("lote")
+            if lote:
+                try: item = int(entidades.get('item') or 0)
+                except (ValueError, TypeError): item = 0
+                if not (campo_a_alterar and novo_valor_texto and 1 <= item <= len(lote)):
+                    return f"Qual gasto você quer alterar?\n{_formatar_lote(lote)}\nDiga, ex: 'alterar valor do 2 para 30'."
+                erro = _alterar_campo(numero_usuario_wa, lote[item - 1], campo_a_alterar, novo_valor_texto)
+                if erro: resposta_final_agente = erro
+                elif not pendencias.substituir(numero_usuario_wa, PENDENCIA_GASTO, versao_lida, gasto_atual):
+                    resposta_final_agente = "Esses gastos pendentes acabaram de ser confirmados, cancelados ou alterados. Confira e tente novamente."
+                else:
+                    _aprender_correcao(numero_usuario_wa, lote[item - 1], campo_a_alterar)
+                    resposta_final_agente = f"Ok, alterado. Gastos atualizados:\n{_formatar_lote(lote)}\n\nCertos agora? (sim/alterar/cancelar)"
+            elif campo_a_alterar and novo_valor_texto:
+                erro = _alterar_campo(numero_usuario_wa, gasto_atual, campo_a_alterar, novo_valor_texto)
+                if erro: resposta_final_agente = erro
+                elif not pendencias.substituir(numero_usuario_wa, PENDENCIA_GASTO, versao_lida, gasto_atual):
+                    resposta_final_agente = "Esse gasto pendente acabou de ser confirmado, cancelado ou alterado. Confira e tente novamente."
+                else:
+                    _aprender_correcao(numero_usuario_wa, gasto_atual, campo_a_alterar)
                     resposta_final_agente = (f"Ok, alterado. Gasto atualizado:\n- Desc: {gasto_atual['descricao']}\n- Valor: R${gasto_atual['valor']:.2f}\n- Cat: {gasto_atual['categoria']}\n- Data: {gasto_atual['data_para_salvar']}\n\nCerto agora? (sim/alterar/cancelar)")
-                else: resposta_final_agente = f"Não entendi qual campo ('{campo_a_alterar}') você quer alterar."
             else:
                 resposta_final_agente = (f"Quer alterar o quê no gasto pendente?\n(Desc: {gasto_atual['descricao']}, Valor: R${gasto_atual['valor']:.2f}, Cat: {gasto_atual['categoria']}, Data: {gasto_atual['data_para_salvar']})\nDiga, ex: 'alterar valor para 30'.")
         else: resposta_final_agente = "Não tenho nenhum gasto pendente para alterar."
@@ -213,6 +338,9 @@ def gerar_resposta_do_chatbot(intencao, entidades, texto_usuario_original="", nu
             resposta_final_agente = "Para que eu possa te informar sua renda, primeiro precisamos concluir sua configuração inicial. Por favor, me diga sua renda mensal para continuarmos."
             update_user_onboarding_step(numero_usuario_wa, "awaiting_income")
 
+    elif intencao == INTENCAO_INDISPONIVEL:
+        resposta_final_agente = ("Estou com instabilidade para entender mensagens mais elaboradas agora. 😕\n"
+                                 "Mensagens simples continuam funcionando, ex: 'gastei 50 no almoço', 'sim', 'cancela', 'listar gastos'.")
     elif intencao == "resposta_textual_gemini" and entidades.get("texto_resposta"):
         resposta_final_agente = entidades["texto_resposta"]
     elif intencao: 
@@ -0,0 +1,167 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import deque
+import config
+
+logger = logging.getLogger(__name__)
+
+# --- Conexões SQLite reaproveitadas entre threads ---
+# Cada thread (worker do executor, thread do servidor Flask, despachante) usa uma conexão por banco, pega de um
+# pool de conexões ociosas na primeira utilização. A conexão volta ao pool quando a thread termina (o servidor
+# de desenvolvimento cria uma thread por requisição) ou quando devolver() é chamado (fim do contexto do Flask),
+# então requisições seguidas reaproveitam a mesma conexão já configurada. Todas usam WAL com synchronous=NORMAL (leitores não bloqueiam o
+# escritor e o commit não faz fsync a cada transação), busy_timeout, cache de páginas e mmap maiores e o
+# cache de statements do sqlite3 para reaproveitar os comandos preparados.
+# Depois de um fork (servidores com vários workers pré-forkados), as conexões herdadas do processo pai são
+# descartadas e cada processo abre as suas.
+
+_gerenciadores = weakref.WeakSet()
+_conexoes_herdadas = [] # Mantidas vivas no processo filho para não serem fechadas pelo coletor de lixo
+
+class _Conexao(sqlite3.Connection):
+    """sqlite3.Connection que aceita weakref (para o gerenciador rastrear as conexões sem mantê-las vivas) e guarda
+    quando foi verificada pela última vez."""
+    verificada_em = 0.0
+
+class GerenciadorConexoes:
+    def __init__(self, caminho_db, inicializar=None, row_factory=None, isolation_level=None, max_ociosas=None):
+        """inicializar(conn) roda uma vez em cada conexão nova (ex.: CREATE TABLE IF NOT EXISTS).
+        isolation_level=None deixa o controle de transação explícito (BEGIN/COMMIT); "" mantém o padrão do sqlite3.
+        max_ociosas limita as conexões guardadas no pool; as devolvidas além disso são fechadas."""
+        self.caminho_db = caminho_db
+        self.inicializar = inicializar
+        self.row_factory = row_factory
+        self.isolation_level = isolation_level
+        self.max_ociosas = config.SQLITE_MAX_CONEXOES_OCIOSAS if max_ociosas is None else max_ociosas
+        self._local = threading.local()
+        self._ociosas = deque() # Conexões sem thread, prontas para a próxima que precisar
+        self._conexoes = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        _gerenciadores.add(self)
+
+    def _abrir(self):
+        conn = sqlite3.connect(self.caminho_db, timeout=config.SQLITE_BUSY_TIMEOUT_MS / 1000, isolation_level=self.isolation_level,
+                               check_same_thread=False, cached_statements=config.SQLITE_CACHED_STATEMENTS, factory=_Conexao)
+        if self.row_factory is not None: conn.row_factory = self.row_factory
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(config.SQLITE_BUSY_TIMEOUT_MS)}")
+        conn.execute(f"PRAGMA cache_size=-{int(config.SQLITE_CACHE_SIZE_KB)}") # Negativo = tamanho em KiB
+        conn.execute(f"PRAGMA mmap_size={int(config.SQLITE_MMAP_SIZE_BYTES)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        if self.inicializar: self.inicializar(conn)
+        with self._lock: self._conexoes.add(conn)
+        logger.debug("Nova conexão SQLite para '%s' na thread %s.", self.caminho_db, threading.current_thread().name)
+        return conn
+
+    def conexao(self):
+        """Conexão da thread atual: a mesma até a thread terminar ou chamar devolver(). Na primeira utilização vem do
+        pool (ou é aberta) e é revalidada de tempos em tempos."""
+        if self._pid != os.getpid(): self._apos_fork()
+        conn = getattr(self._local, 'conn', None)
+        agora = time.monotonic()
+        if conn is not None and agora - conn.verificada_em > config.SQLITE_INTERVALO_VERIFICACAO_SEGUNDOS:
+            if not self._saudavel(conn):
+                logger.warning("Conexão SQLite com '%s' inválida; reabrindo.", self.caminho_db)
+                self._descartar(conn); conn = None
+            else: conn.verificada_em = agora
+        if conn is None:
+            conn = self._emprestar(agora)
+            self._local.conn = conn
+            if getattr(self._local, 'caixa', None) is None:
+                # Uma vez por thread: quando ela terminar, a conexão que estiver na caixa volta ao pool
+                self._local.caixa = caixa = [None]
+                weakref.finalize(threading.current_thread(), self._devolver_caixa, caixa, self._pid)
+            self._local.caixa[0] = conn
+        return conn
+
+    def _emprestar(self, agora):
+        while True:
+            with self._lock: conn = self._ociosas.pop() if self._ociosas else None # A mais recente: páginas ainda em cache
+            if conn is None:
+                conn = self._abrir(); conn.verificada_em = agora; return conn
+            if agora - conn.verificada_em <= config.SQLITE_INTERVALO_VERIFICACAO_SEGUNDOS or self._saudavel(conn):
+                conn.verificada_em = agora; return conn
+            logger.warning("Conexão SQLite ociosa com '%s' inválida; descartando.", self.caminho_db)
+            self._descartar(conn)
+
+    def devolver(self):
+        """Devolve ao pool a conexão da thread atual (ex.: no fim da requisição); a próxima chamada de conexao()
+        pega uma do pool. Uma transação aberta é desfeita."""
+        conn = self.conexao_se_aberta()
+        if conn is None: return
+        self._local.conn = None; self._local.caixa[0] = None
+        self._guardar(conn)
+
+    def _devolver_caixa(self, caixa, pid):
+        # Chamado quando a thread dona da caixa termina (em outra thread, pelo coletor de lixo)
+        conn, caixa[0] = caixa[0], None
+        if conn is not None and pid == self._pid: self._guardar(conn)
+
+    def _guardar(self, conn):
+        try:
+            if conn.in_transaction:
+                logger.warning("Conexão SQLite com '%s' devolvida com transação aberta; desfazendo.", self.caminho_db)
+                conn.rollback()
+        except sqlite3.Error:
+            self._descartar(conn); return
+        with self._lock:
+            if len(self._ociosas) < self.max_ociosas:
+                self._ociosas.append(conn); return
+        self._descartar(conn)
+
+    def conexao_se_aberta(self):
+        """Conexão da thread atual sem pegar uma do pool (None se a thread não está com uma)."""
+        return getattr(self._local, 'conn', None) if self._pid == os.getpid() else None
+
+    @staticmethod
+    def _saudavel(conn):
+        try:
+            conn.execute("SELECT 1").fetchone(); return True
+        except sqlite3.Error:
+            return False
+
+    def verificar_saude(self):
+        """Health check: True se a conexão da thread atual responde (reabrindo-a se necessário)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and not self._saudavel(conn):
+            self._descartar(conn); self._local.conn = self._local.caixa[0] = None
+        return self._saudavel(self.conexao())
+
+    def _descartar(self, conn):
+        with self._lock: self._conexoes.discard(conn)
+        try: conn.close()
+        except sqlite3.Error: pass
+
+    def fechar_conexao_da_thread(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._descartar(conn); self._local.conn = self._local.caixa[0] = None
+
+    def fechar_todas(self):
+        """Fecha as conexões de todas as threads e do pool (usar no encerramento, com os workers parados)."""
+        with self._lock: conexoes = list(self._conexoes); self._conexoes = weakref.WeakSet(); self._ociosas.clear()
+        for conn in conexoes:
+            try: conn.close()
+            except sqlite3.Error: pass
+        self._local = threading.local()
+
+    def _apos_fork(self):
+        # Conexões herdadas do pai não podem ser usadas (nem fechadas) no filho: apenas são esquecidas.
+        _conexoes_herdadas.extend(self._conexoes)
+        self._local = threading.local()
+        self._ociosas = deque()
+        self._conexoes = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+def _reiniciar_apos_fork():
+    for gerenciador in list(_gerenciadores): gerenciador._apos_fork()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reiniciar_apos_fork)
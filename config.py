@@ -10,13 +10,115 @@ GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
 WHATSAPP_ACCESS_TOKEN = os.environ.get("WHATSAPP_ACCESS_TOKEN")
 WHATSAPP_PHONE_NUMBER_ID = os.environ.get("WHATSAPP_PHONE_NUMBER_ID")
 WHATSAPP_GRAPH_API_VERSION = "v19.0" # Use uma versão estável (ex: v19.0, v20.0)
+WHATSAPP_GRAPH_API_BASE_URL = os.environ.get("WHATSAPP_GRAPH_API_BASE_URL", "https://graph.facebook.com") # Aponte para um servidor local em testes
+WHATSAPP_TIMEOUT_SEGUNDOS = 15
+WHATSAPP_MAX_TENTATIVAS = 4 # Para respostas 429/5xx e erros de conexão
+WHATSAPP_BACKOFF_BASE_SEGUNDOS = 0.5
+WHATSAPP_BACKOFF_MAX_SEGUNDOS = 30
+WHATSAPP_MENSAGENS_POR_SEGUNDO = 80 # Limite de vazão por número de telefone da Meta
+WHATSAPP_TAMANHO_POOL = 10 # Conexões keep-alive mantidas com a Graph API
 
 # Configurações do Banco de Dados
 DATABASE_FILENAME = 'meus_gastos.db'
 
-# Debug Prints para verificar se as variáveis de ambiente foram carregadas
-print("--- CONFIG.PY CARREGADO ---")
-print(f"MEU_VERIFY_TOKEN: {MEU_VERIFY_TOKEN}")
-print(f"GOOGLE_API_KEY presente? {'Sim' if GOOGLE_API_KEY else 'NÃO'}")
-print(f"WHATSAPP_ACCESS_TOKEN presente? {'Sim' if WHATSAPP_ACCESS_TOKEN else 'NÃO'}")
-print(f"WHATSAPP_PHONE_NUMBER_ID presente? {'Sim' if WHATSAPP_PHONE_NUMBER_ID else 'NÃO'}")
\ No newline at end of file
+# Conexões SQLite (uma por thread, reaproveitadas; ver conexoes_sqlite.py)
+SQLITE_BUSY_TIMEOUT_MS = 5000 # Espera por um lock antes de SQLITE_BUSY
+SQLITE_CACHE_SIZE_KB = 16384 # Cache de páginas por conexão
+SQLITE_MMAP_SIZE_BYTES = 256 * 1024 * 1024
+SQLITE_CACHED_STATEMENTS = 256 # Statements preparados reaproveitados por conexão
+SQLITE_INTERVALO_VERIFICACAO_SEGUNDOS = 30 # Conexões ociosas há mais tempo são testadas (SELECT 1) antes do uso
+SQLITE_MAX_CONEXOES_OCIOSAS = int(os.getenv("SQLITE_MAX_CONEXOES_OCIOSAS", "8")) # Por banco; as excedentes são fechadas
+
+# Fila durável de mensagens recebidas pelo webhook (arquivo SQLite ao lado do banco principal)
+FILA_DATABASE_FILENAME = 'fila_mensagens.db'
+FILA_MAX_TENTATIVAS = 5 # Após isso o job vai para dead-letter (status 'falhou')
+FILA_BACKOFF_BASE_SEGUNDOS = 2
+FILA_BACKOFF_MAX_SEGUNDOS = 300
+FILA_LEASE_SEGUNDOS = 120 # Tempo máximo que um worker segura um job antes de ele voltar a ficar disponível
+# Coalescência: mensagens de texto do mesmo usuário que se acumulam na fila enquanto a anterior é processada
+# ("gastei 50", "no almoço", "ontem") viram uma só, sem atraso extra. Com FILA_JANELA_COALESCENCIA_SEGUNDOS > 0
+# cada mensagem também espera essa janela por outras (a primeira no máximo FILA_JANELA_COALESCENCIA_MAX_SEGUNDOS),
+# à custa dessa latência em toda mensagem. Confirmações, cancelamentos, respostas com um gasto pendente e o
+# onboarding nunca são unidos. FILA_COALESCER_MAX_MENSAGENS = 1 desliga.
+FILA_JANELA_COALESCENCIA_SEGUNDOS = float(os.getenv("FILA_JANELA_COALESCENCIA_SEGUNDOS", "0"))
+FILA_JANELA_COALESCENCIA_MAX_SEGUNDOS = 5.0
+FILA_COALESCER_MAX_MENSAGENS = 10
+
+# Cache em memória dos perfis de usuário (cache_perfis.py)
+CACHE_PERFIS_MAX = 10000
+# Confere a coluna usuarios.versao quando outra conexão gravou no banco. Necessário com vários processos
+# (ex.: gunicorn com vários workers); com um único processo as invalidações locais já bastam.
+CACHE_PERFIS_VALIDAR_VERSAO = os.getenv("CACHE_PERFIS_VALIDAR_VERSAO", "1") == "1"
+
+# Operações pendentes por usuário, ex.: gasto aguardando confirmação (pendencias.py)
+PENDENCIAS_BACKEND = os.getenv("PENDENCIAS_BACKEND", "sqlite") # "sqlite" (vários processos) ou "memoria"
+PENDENCIAS_DATABASE_FILENAME = 'pendencias.db'
+PENDENCIAS_TTL_SEGUNDOS = 6 * 60 * 60 # Pendências não respondidas expiram
+PENDENCIAS_INTERVALO_VARREDURA_SEGUNDOS = 300
+
+# Importação de extratos (importacao_extratos.py). Sem IMPORTACAO_TOKEN o endpoint /importar_extrato fica desligado.
+IMPORTACAO_TOKEN = os.getenv("IMPORTACAO_TOKEN")
+IMPORTACAO_TAMANHO_LOTE = 500 # Linhas por transação
+
+# Listagem de gastos: itens por resposta (o restante é paginado com "ver mais")
+LISTAGEM_ITENS_PADRAO = 5
+LISTAGEM_MAX_ITENS_POR_RESPOSTA = 15
+LISTAGEM_TTL_SEGUNDOS = 30 * 60 # Validade do cursor do "ver mais"
+
+# Arquivamento (arquivamento.py): gastos anteriores ao horizonte vão para <ARQUIVO_DIRETORIO>/gastos_<ano>.db
+ARQUIVO_HORIZONTE_MESES = 24
+ARQUIVO_DIRETORIO = 'arquivo_gastos'
+
+# Análise de gastos por período (analise_gastos.py)
+ANALISE_CACHE_MAX = 2000 # Análises (wa_id, período) em memória
+ANALISE_CACHE_TTL_SEGUNDOS = 10 * 60 # Limita o atraso de escritas feitas por outros processos
+ANALISE_TOP_ESTABELECIMENTOS = 3
+
+# Correções manuais de categoria por usuário (categorias.py); o TTL limita o atraso de correções feitas em outros processos
+CATEGORIAS_USUARIO_CACHE_MAX = 10000
+CATEGORIAS_USUARIO_CACHE_TTL_SEGUNDOS = 10 * 60
+
+# Chamadas ao Gemini: prazo por requisição e disjuntor (disjuntor.py). Com o disjuntor aberto as mensagens
+# vão direto para o interpretador local degradado (confirmações, cancelamentos e gastos simples).
+GEMINI_TIMEOUT_SEGUNDOS = float(os.getenv("GEMINI_TIMEOUT_SEGUNDOS", "8"))
+GEMINI_LATENCIA_LENTA_SEGUNDOS = 4.0 # Chamadas acima disso contam como lentas
+GEMINI_DISJUNTOR_JANELA_SEGUNDOS = 60
+GEMINI_DISJUNTOR_MIN_CHAMADAS = 10 # Abaixo disso na janela o disjuntor não abre
+GEMINI_DISJUNTOR_LIMIAR_ERROS = 0.5 # Fração de erros (inclui timeouts) que abre o disjuntor
+GEMINI_DISJUNTOR_LIMIAR_LENTAS = 0.5 # Fração de chamadas lentas que abre o disjuntor
+GEMINI_DISJUNTOR_ABERTO_SEGUNDOS = 30 # Tempo aberto antes de deixar passar sondas
+GEMINI_DISJUNTOR_SONDAS = 1 # Chamadas simultâneas permitidas no estado meio-aberto
+# Cliente assíncrono (gemini_async.py): requisições em voo ao mesmo tempo (dimensionar pela cota da API) e hedging
+GEMINI_CONCORRENCIA_MAX = int(os.getenv("GEMINI_CONCORRENCIA_MAX", "8"))
+GEMINI_HEDGING = os.getenv("GEMINI_HEDGING", "1") == "1" # Repete a requisição se ela passar do percentil abaixo
+GEMINI_HEDGE_PERCENTIL = 95
+GEMINI_HEDGE_MIN_SEGUNDOS = 1.0 # Nunca dispara o hedge antes disso
+GEMINI_HEDGE_AMOSTRAS_MIN = 20 # Latências observadas antes de o hedging começar
+# Formato da requisição: "completo" (preâmbulo no prompt + todas as ferramentas, o formato original) ou
+# "otimizado" (instruções no system_instruction + só as ferramentas que fazem sentido no estado do usuário)
+GEMINI_MODO_REQUISICAO = os.getenv("GEMINI_MODO_REQUISICAO", "otimizado")
+USO_TOKENS_MAX_USUARIOS = 10000 # Usuários com uso de tokens acumulado em memória (uso_tokens.py)
+
+# Caminho rápido local de intenções: abaixo desta confiança a mensagem vai para o Gemini
+INTENCAO_LOCAL_CONFIANCA_MINIMA = 0.8
+# Com o Gemini fora (modo degradado) as regras locais valem a partir desta confiança; o gasto ainda é confirmado
+INTENCAO_DEGRADADA_CONFIANCA_MINIMA = 0.7
+
+# Cache dos resultados do Gemini (LRU em memória + SQLite)
+CACHE_DATABASE_FILENAME = 'cache_gemini.db'
+CACHE_INTENCOES_MAX_MEMORIA = 2000
+CACHE_INTENCOES_MAX_DB = 50000
+CACHE_INTENCOES_TTL_SEGUNDOS = 7 * 24 * 60 * 60
+CACHE_INTENCOES_IGNORADAS = {"resposta_textual_gemini"} # Respostas livres dependem do contexto da conversa
+
+# Executor por usuário: mensagens do mesmo wa_id em ordem, usuários diferentes em paralelo
+EXECUTOR_NUM_WORKERS = int(os.environ.get("EXECUTOR_NUM_WORKERS", "4"))
+EXECUTOR_MAX_EM_VOO_POR_WORKER = 2 # Limite de jobs reservados da fila por shard
+
+# Deduplicação das reentregas da Meta (índice de message_id guardado no mesmo arquivo da fila)
+DEDUP_TTL_SEGUNDOS = 2 * 24 * 60 * 60
+DEDUP_MAX_MEMORIA = 50000
+
+# Logging (ver log_config.py)
+LOG_NIVEL = os.environ.get("LOG_NIVEL", "INFO") # DEBUG para ver payloads e detalhes de cada etapa
+LOG_TAXA_AMOSTRAGEM_PAYLOAD = float(os.environ.get("LOG_TAXA_AMOSTRAGEM_PAYLOAD", "0.01")) # Fração dos payloads completos logados em DEBUG
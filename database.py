@@ -1,127 +1,436 @@
+import functools
+import logging
+import math
 import sqlite3
-from flask import g
+from datetime import datetime
 import config
+import metricas
+import arquivamento
+from cache_perfis import CachePerfis
+from conexoes_sqlite import GerenciadorConexoes
+from texto_utils import normalizar_data_iso
+
+logger = logging.getLogger(__name__)
+
+def _medido(func):
+    """Registra a duração da função no histograma agente_db_operacao_segundos."""
+    return metricas.db_operacao_segundos.medir(funcao=func.__name__)(func)
+
+# Perfis de usuário em memória (ver cache_perfis.py); toda função que altera `usuarios` invalida a entrada.
+cache_perfis = CachePerfis()
+
+def _invalida_perfil(func):
+    """Invalida o perfil em cache do wa_id (primeiro argumento) depois da escrita."""
+    @functools.wraps(func)
+    def wrapper(wa_id, *args, **kwargs):
+        try: return func(wa_id, *args, **kwargs)
+        finally: cache_perfis.invalidar(wa_id)
+    return wrapper
+
+# Funções chamadas com o wa_id depois de cada escrita confirmada em gastos (ex.: invalidar o cache de análises).
+ouvintes_alteracao_gastos = []
+
+def notificar_alteracao_gastos(wa_id):
+    for ouvinte in ouvintes_alteracao_gastos:
+        try: ouvinte(wa_id)
+        except Exception as e: logger.exception("Erro ao notificar alteração de gastos de %s: %s", wa_id, e)
 
 # --- Funções de Conexão com o Banco ---
+# Conexões do pool de conexoes_sqlite (WAL, pragmas ajustados), reaproveitadas entre requisições; isolation_level
+# "" mantém o modo padrão do sqlite3, em que as funções abaixo confirmam suas escritas com db.commit().
+conexoes = GerenciadorConexoes(config.DATABASE_FILENAME, row_factory=sqlite3.Row, isolation_level="")
+
 def get_db():
-    db = getattr(g, '_database', None)
-    if db is None:
-        db = g._database = sqlite3.connect(config.DATABASE_FILENAME)
-        db.row_factory = sqlite3.Row
-    return db
+    return conexoes.conexao()
 
 def close_db_connection(exception=None):
-    db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
+    # A conexão volta aberta ao pool para a próxima requisição (de qualquer thread); uma transação esquecida
+    # aberta é desfeita.
+    conexoes.devolver()
+
+# --- Migrações de esquema ---
+# Cada item é a lista de comandos de uma versão (SQL ou função que recebe a conexão); PRAGMA user_version guarda
+# a última aplicada. Só acrescente itens no final (nunca edite uma migração já publicada).
+
+SQL_RESUMO_A_PARTIR_DOS_GASTOS = "SELECT wa_id, mes_ref, COALESCE(categoria, ''), SUM(valor), COUNT(*) FROM gastos GROUP BY 1, 2, 3"
+
+def _normalizar_datas_despesa(db):
+    # Datas gravadas fora do padrão ("2026-10-2", "02/10/2026") viram AAAA-MM-DD; o trigger de UPDATE move o
+    # gasto no resumo mensal. As que não são datas ficam como estão (mes_ref usa a data de registro).
+    linhas = db.execute("SELECT id, data_despesa FROM gastos WHERE data_despesa IS NOT NULL AND data_despesa NOT GLOB "
+                        "'[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'").fetchall()
+    corrigidas = [(normalizar_data_iso(r[1]), r[0]) for r in linhas if normalizar_data_iso(r[1])]
+    db.executemany("UPDATE gastos SET data_despesa = ? WHERE id = ?", corrigidas)
+    if len(corrigidas) < len(linhas): logger.warning("%d gasto(s) com data_despesa inválida mantida(s).", len(linhas) - len(corrigidas))
+
+MIGRACOES = [
+    # 1: data efetiva e mês de referência como colunas geradas (VIRTUAL: o valor é calculado das colunas
+    #    existentes, então as linhas antigas já ficam preenchidas) + índices compostos por usuário.
+    #    Assim o total do mês e a listagem viram buscas por faixa no índice, sem varrer a tabela.
+    [
+        "ALTER TABLE gastos ADD COLUMN data_efetiva TEXT GENERATED ALWAYS AS (COALESCE(data_despesa, date(data_registro_sistema))) VIRTUAL",
+        "ALTER TABLE gastos ADD COLUMN mes_ref TEXT GENERATED ALWAYS AS (substr(COALESCE(data_despesa, date(data_registro_sistema)), 1, 7)) VIRTUAL",
+        "CREATE INDEX IF NOT EXISTS idx_gastos_wa_id_mes_ref ON gastos (wa_id, mes_ref)",
+        "CREATE INDEX IF NOT EXISTS idx_gastos_wa_id_id ON gastos (wa_id, id)",
+    ],
+    # 2: resumo por (wa_id, mes_ref, categoria) mantido por triggers na mesma transação de cada escrita
+    #    em gastos, para o total do mês e o resumo por categoria não precisarem reagregar os gastos.
+    [
+        """CREATE TABLE IF NOT EXISTS gastos_resumo_mensal (
+            wa_id TEXT NOT NULL,
+            mes_ref TEXT NOT NULL,
+            categoria TEXT NOT NULL,
+            total REAL NOT NULL DEFAULT 0,
+            quantidade INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (wa_id, mes_ref, categoria)
+        ) WITHOUT ROWID""",
+        """CREATE TRIGGER IF NOT EXISTS trg_gastos_resumo_insert AFTER INSERT ON gastos BEGIN
+            INSERT INTO gastos_resumo_mensal (wa_id, mes_ref, categoria, total, quantidade)
+            VALUES (NEW.wa_id, NEW.mes_ref, COALESCE(NEW.categoria, ''), NEW.valor, 1)
+            ON CONFLICT (wa_id, mes_ref, categoria) DO UPDATE SET total = total + excluded.total, quantidade = quantidade + 1;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_gastos_resumo_delete AFTER DELETE ON gastos BEGIN
+            UPDATE gastos_resumo_mensal SET total = total - OLD.valor, quantidade = quantidade - 1
+            WHERE wa_id = OLD.wa_id AND mes_ref = OLD.mes_ref AND categoria = COALESCE(OLD.categoria, '');
+            DELETE FROM gastos_resumo_mensal
+            WHERE wa_id = OLD.wa_id AND mes_ref = OLD.mes_ref AND categoria = COALESCE(OLD.categoria, '') AND quantidade <= 0;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_gastos_resumo_update
+        AFTER UPDATE OF wa_id, valor, categoria, data_despesa, data_registro_sistema ON gastos BEGIN
+            UPDATE gastos_resumo_mensal SET total = total - OLD.valor, quantidade = quantidade - 1
+            WHERE wa_id = OLD.wa_id AND mes_ref = OLD.mes_ref AND categoria = COALESCE(OLD.categoria, '');
+            DELETE FROM gastos_resumo_mensal
+            WHERE wa_id = OLD.wa_id AND mes_ref = OLD.mes_ref AND categoria = COALESCE(OLD.categoria, '') AND quantidade <= 0;
+            INSERT INTO gastos_resumo_mensal (wa_id, mes_ref, categoria, total, quantidade)
+            VALUES (NEW.wa_id, NEW.mes_ref, COALESCE(NEW.categoria, ''), NEW.valor, 1)
+            ON CONFLICT (wa_id, mes_ref, categoria) DO UPDATE SET total = total + excluded.total, quantidade = quantidade + 1;
+        END""",
+        """INSERT INTO gastos_resumo_mensal (wa_id, mes_ref, categoria, total, quantidade)
+        SELECT wa_id, mes_ref, COALESCE(categoria, ''), SUM(valor), COUNT(*) FROM gastos GROUP BY 1, 2, 3""",
+    ],
+    # 3: versão do perfil, incrementada a cada UPDATE em usuarios (de qualquer processo), para o cache de
+    #    perfis detectar linhas alteradas por outros workers.
+    [
+        "ALTER TABLE usuarios ADD COLUMN versao INTEGER NOT NULL DEFAULT 0",
+        """CREATE TRIGGER IF NOT EXISTS trg_usuarios_versao AFTER UPDATE ON usuarios WHEN NEW.versao = OLD.versao BEGIN
+            UPDATE usuarios SET versao = OLD.versao + 1 WHERE wa_id = NEW.wa_id;
+        END""",
+    ],
+    # 4: índice para a deduplicação da importação de extratos (mesmo usuário, dia e valor).
+    [
+        "CREATE INDEX IF NOT EXISTS idx_gastos_wa_id_data_efetiva_valor ON gastos (wa_id, data_efetiva, valor)",
+    ],
+    # 5: listagem por período com paginação por chave (data_efetiva, id), em ordem decrescente.
+    [
+        "CREATE INDEX IF NOT EXISTS idx_gastos_wa_id_data_efetiva_id ON gastos (wa_id, data_efetiva, id)",
+    ],
+    # 6: arquivamento dos gastos antigos (arquivamento.py). arquivado_ate = data a partir da qual os gastos
+    #    estão no banco principal; com ativo = 1 (só durante o arquivamento) o DELETE não altera o resumo mensal,
+    #    que continua cobrindo também os meses arquivados.
+    [
+        """CREATE TABLE IF NOT EXISTS arquivamento_controle (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            ativo INTEGER NOT NULL DEFAULT 0,
+            arquivado_ate TEXT
+        )""",
+        "INSERT OR IGNORE INTO arquivamento_controle (id, ativo) VALUES (1, 0)",
+        "DROP TRIGGER IF EXISTS trg_gastos_resumo_delete",
+        """CREATE TRIGGER trg_gastos_resumo_delete AFTER DELETE ON gastos
+        WHEN (SELECT ativo FROM arquivamento_controle WHERE id = 1) = 0 BEGIN
+            UPDATE gastos_resumo_mensal SET total = total - OLD.valor, quantidade = quantidade - 1
+            WHERE wa_id = OLD.wa_id AND mes_ref = OLD.mes_ref AND categoria = COALESCE(OLD.categoria, '');
+            DELETE FROM gastos_resumo_mensal
+            WHERE wa_id = OLD.wa_id AND mes_ref = OLD.mes_ref AND categoria = COALESCE(OLD.categoria, '') AND quantidade <= 0;
+        END""",
+    ],
+    # 7: categoria escolhida manualmente pelo usuário para uma descrição (normalizada), usada por categorias.py.
+    [
+        """CREATE TABLE IF NOT EXISTS categorias_usuario (
+            wa_id TEXT NOT NULL,
+            descricao TEXT NOT NULL,
+            categoria TEXT NOT NULL,
+            atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (wa_id, descricao)
+        ) WITHOUT ROWID""",
+    ],
+    # 8: mes_ref com strftime em vez de substr: uma data fora do padrão não gera mais uma chave de mês inválida
+    #    ("02/10/2" para "02/10/2026"); sem data válida vale o mês do registro. As datas existentes são
+    #    normalizadas antes; a coluna é recriada (coluna gerada não pode ser alterada) com seus triggers e
+    #    índice, e o resumo mensal troca a parte dos gastos do banco principal (os arquivos já têm mes_ref fixo).
+    [
+        _normalizar_datas_despesa,
+        """UPDATE gastos_resumo_mensal SET total = gastos_resumo_mensal.total - g.total, quantidade = gastos_resumo_mensal.quantidade - g.quantidade
+        FROM (SELECT wa_id, mes_ref, COALESCE(categoria, '') AS categoria, SUM(valor) AS total, COUNT(*) AS quantidade FROM gastos GROUP BY 1, 2, 3) AS g
+        WHERE gastos_resumo_mensal.wa_id = g.wa_id AND gastos_resumo_mensal.mes_ref = g.mes_ref AND gastos_resumo_mensal.categoria = g.categoria""",
+        "DELETE FROM gastos_resumo_mensal WHERE quantidade <= 0",
+        "DROP TRIGGER IF EXISTS trg_gastos_resumo_insert",
+        "DROP TRIGGER IF EXISTS trg_gastos_resumo_delete",
+        "DROP TRIGGER IF EXISTS trg_gastos_resumo_update",
+        "DROP INDEX IF EXISTS idx_gastos_wa_id_mes_ref",
+        "ALTER TABLE gastos DROP COLUMN mes_ref",
+        "ALTER TABLE gastos ADD COLUMN mes_ref TEXT GENERATED ALWAYS AS (COALESCE(strftime('%Y-%m', data_despesa), strftime('%Y-%m', data_registro_sistema))) VIRTUAL",
+        "CREATE INDEX IF NOT EXISTS idx_gastos_wa_id_mes_ref ON gastos (wa_id, mes_ref)",
+        """CREATE TRIGGER trg_gastos_resumo_insert AFTER INSERT ON gastos BEGIN
+            INSERT INTO gastos_resumo_mensal (wa_id, mes_ref, categoria, total, quantidade)
+            VALUES (NEW.wa_id, NEW.mes_ref, COALESCE(NEW.categoria, ''), NEW.valor, 1)
+            ON CONFLICT (wa_id, mes_ref, categoria) DO UPDATE SET total = total + excluded.total, quantidade = quantidade + 1;
+        END""",
+        """CREATE TRIGGER trg_gastos_resumo_delete AFTER DELETE ON gastos
+        WHEN (SELECT ativo FROM arquivamento_controle WHERE id = 1) = 0 BEGIN
+            UPDATE gastos_resumo_mensal SET total = total - OLD.valor, quantidade = quantidade - 1
+            WHERE wa_id = OLD.wa_id AND mes_ref = OLD.mes_ref AND categoria = COALESCE(OLD.categoria, '');
+            DELETE FROM gastos_resumo_mensal
+            WHERE wa_id = OLD.wa_id AND mes_ref = OLD.mes_ref AND categoria = COALESCE(OLD.categoria, '') AND quantidade <= 0;
+        END""",
+        """CREATE TRIGGER trg_gastos_resumo_update
+        AFTER UPDATE OF wa_id, valor, categoria, data_despesa, data_registro_sistema ON gastos BEGIN
+            UPDATE gastos_resumo_mensal SET total = total - OLD.valor, quantidade = quantidade - 1
+            WHERE wa_id = OLD.wa_id AND mes_ref = OLD.mes_ref AND categoria = COALESCE(OLD.categoria, '');
+            DELETE FROM gastos_resumo_mensal
+            WHERE wa_id = OLD.wa_id AND mes_ref = OLD.mes_ref AND categoria = COALESCE(OLD.categoria, '') AND quantidade <= 0;
+            INSERT INTO gastos_resumo_mensal (wa_id, mes_ref, categoria, total, quantidade)
+            VALUES (NEW.wa_id, NEW.mes_ref, COALESCE(NEW.categoria, ''), NEW.valor, 1)
+            ON CONFLICT (wa_id, mes_ref, categoria) DO UPDATE SET total = total + excluded.total, quantidade = quantidade + 1;
+        END""",
+        """INSERT INTO gastos_resumo_mensal (wa_id, mes_ref, categoria, total, quantidade) """ + SQL_RESUMO_A_PARTIR_DOS_GASTOS + """
+        ON CONFLICT (wa_id, mes_ref, categoria) DO UPDATE SET total = total + excluded.total, quantidade = quantidade + excluded.quantidade""",
+    ],
+]
+
+def aplicar_migracoes(db):
+    """Aplica, em ordem e cada uma em sua transação, as migrações ainda não aplicadas no banco."""
+    versao = db.execute("PRAGMA user_version").fetchone()[0]
+    for numero, comandos in enumerate(MIGRACOES, start=1):
+        if numero <= versao: continue
+        try:
+            db.execute("BEGIN")
+            for comando in comandos:
+                if callable(comando): comando(db)
+                else: db.execute(comando)
+            db.execute(f"PRAGMA user_version = {numero}")
+            db.commit()
+            logger.info("Migração %d aplicada em '%s'.", numero, config.DATABASE_FILENAME)
+        except Exception:
+            db.rollback(); raise
+
+def mes_referencia(data=None):
+    """Chave 'AAAA-MM' usada na coluna mes_ref (mês atual, no horário local, se data não for informada)."""
+    return (data or datetime.now()).strftime('%Y-%m')
 
 # --- Função de Inicialização do Banco de Dados (ATUALIZADA) ---
 def init_db(app_context):
     with app_context:
-        db = get_db()
-        cursor = db.cursor()
-        
-        # Altera tabela de gastos para incluir o ID do usuário
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS gastos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                wa_id TEXT NOT NULL, 
-                descricao TEXT NOT NULL,
-                valor REAL NOT NULL,
-                data_despesa TEXT, 
-                categoria TEXT, 
-                data_registro_sistema TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Altera tabela de usuários para incluir o rastreamento de avisos
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS usuarios (
-                wa_id TEXT PRIMARY KEY,
-                nome_perfil TEXT,
-                objetivo_financeiro TEXT,
-                renda_mensal REAL,
-                onboarding_step TEXT,
-                onboarding_complete BOOLEAN DEFAULT FALSE,
-                ultimo_aviso_orcamento INTEGER DEFAULT 0,
-                data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        db.commit()
-        print(f"Banco de dados '{config.DATABASE_FILENAME}' inicializado. Tabelas 'gastos' e 'usuarios' atualizadas.")
+        criar_esquema(get_db())
+        logger.info("Banco de dados '%s' inicializado. Tabelas 'gastos' e 'usuarios' atualizadas.", config.DATABASE_FILENAME)
+
+def criar_esquema(db):
+    """Cria as tabelas base (se não existirem) e aplica as migrações pendentes."""
+    cursor = db.cursor()
+    
+    # Altera tabela de gastos para incluir o ID do usuário
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS gastos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            wa_id TEXT NOT NULL, 
+            descricao TEXT NOT NULL,
+            valor REAL NOT NULL,
+            data_despesa TEXT, 
+            categoria TEXT, 
+            data_registro_sistema TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Altera tabela de usuários para incluir o rastreamento de avisos
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS usuarios (
+            wa_id TEXT PRIMARY KEY,
+            nome_perfil TEXT,
+            objetivo_financeiro TEXT,
+            renda_mensal REAL,
+            onboarding_step TEXT,
+            onboarding_complete BOOLEAN DEFAULT FALSE,
+            ultimo_aviso_orcamento INTEGER DEFAULT 0,
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    db.commit()
+    aplicar_migracoes(db)
 
 # --- Funções para a tabela GASTOS (ATUALIZADAS) ---
 
-def salvar_gasto_no_banco(wa_id, descricao, valor_gasto, categoria, data_despesa_str=None):
-    """Salva um novo gasto, agora vinculado a um usuário (wa_id)."""
-    try:
-        vf = float(valor_gasto); db = get_db(); c = db.cursor(); ddf = None
-        if data_despesa_str:
-            try: ddf = data_despesa_str.split('T')[0] if 'T' in data_despesa_str else data_despesa_str
-            except Exception as e: print(f"Erro ao formatar data '{data_despesa_str}': {e}")
-        
-        # Inclui wa_id no INSERT
-        c.execute("INSERT INTO gastos (wa_id, descricao, valor, categoria, data_despesa) VALUES (?, ?, ?, ?, ?)",
-                  (wa_id, descricao, vf, categoria, ddf))
-        db.commit(); print(f"Gasto salvo para {wa_id}: {descricao}, R${vf:.2f}"); return True
-    except (ValueError, TypeError): print(f"Erro ao salvar gasto: Valor '{valor_gasto}' inválido."); return False
-    except Exception as e: print(f"Erro DB save: {e}"); db.rollback(); return False
-
-def buscar_gastos_do_banco(wa_id, limite=5):
-    """Busca os últimos gastos de um usuário específico."""
+@_medido
+def buscar_gastos_do_banco(wa_id, limite=5, inicio=None, fim=None, apos=None):
+    """Busca os últimos gastos de um usuário específico.
+
+    Sem período, em ordem de registro (id decrescente); com inicio/fim ('YYYY-MM-DD', inclusivos), por data
+    efetiva decrescente. apos = cursor_listagem() do último gasto da página anterior (paginação por chave:
+    cada página é uma busca por faixa no índice, sem OFFSET). Períodos anteriores ao arquivamento também
+    consultam os arquivos anuais; a listagem sem período cobre só o banco principal."""
     gastos_recuperados = [];
     try:
         db = get_db(); c = db.cursor()
-        q = "SELECT id, descricao, valor, categoria, data_despesa FROM gastos WHERE wa_id = ? ORDER BY id DESC LIMIT ?"
-        c.execute(q, (wa_id, limite,)); resultados = c.fetchall()
+        colunas = "SELECT id, descricao, valor, categoria, data_despesa, data_efetiva, data_registro_sistema FROM {tabela}"
+        if inicio is None and fim is None:
+            q = colunas + " WHERE wa_id = ?" + (" AND id < ?" if apos else "") + " ORDER BY id DESC LIMIT ?"
+            params = (wa_id,) + ((apos["id"],) if apos else ()) + (limite,)
+            c.execute(q.format(tabela="gastos"), params); resultados = c.fetchall()
+        else:
+            q = colunas + " WHERE wa_id = ? AND data_efetiva BETWEEN ? AND ?" + (" AND (data_efetiva, id) < (?, ?)" if apos else "") + " ORDER BY data_efetiva DESC, id DESC LIMIT ?"
+            # Com cursor, o limite superior da faixa passa a ser a data do cursor: a busca começa onde a página anterior parou
+            params = (wa_id, inicio or "0000-00-00", apos["data"] if apos else (fim or "9999-12-31")) + ((apos["data"], apos["id"]) if apos else ()) + (limite,)
+            c.execute(q.format(tabela="gastos"), params); resultados = c.fetchall()
+            antigos = arquivamento.buscar_nos_arquivos(db, q, params, params[1], params[2], limite)
+            if antigos: resultados = sorted(resultados + antigos, key=lambda r: (r["data_efetiva"], r["id"]), reverse=True)[:limite]
         for r in resultados: gastos_recuperados.append(dict(r))
-        print(f"Buscados {len(gastos_recuperados)} gastos para {wa_id}."); return gastos_recuperados
-    except Exception as e: print(f"Erro DB fetch para {wa_id}: {e}"); return []
+        logger.debug("Buscados %d gastos para %s.", len(gastos_recuperados), wa_id); return gastos_recuperados
+    except Exception as e: logger.exception("Erro DB fetch para %s: %s", wa_id, e); return []
+
+def cursor_listagem(gasto):
+    """Cursor de paginação (para buscar_gastos_do_banco(apos=...)) a partir do último gasto exibido."""
+    return {"data": gasto["data_efetiva"], "id": gasto["id"]}
 
+@_medido
 def calcular_total_gastos_mes_atual(wa_id):
     """Calcula a soma de todos os gastos de um usuário no mês atual."""
     total = 0.0
     try:
         db = get_db(); cursor = db.cursor()
-        # Usa strftime para comparar apenas o ano e o mês ('YYYY-MM')
-        # COALESCE é usado para pegar a data_despesa e, se for nula, usar a data_registro_sistema
-        query = """
-            SELECT SUM(valor)
-            FROM gastos
-            WHERE wa_id = ? AND strftime('%Y-%m', COALESCE(data_despesa, date(data_registro_sistema))) = strftime('%Y-%m', 'now', 'localtime')
-        """
-        cursor.execute(query, (wa_id,))
+        # Lê o resumo mantido pelos triggers (uma linha por categoria), sem reagregar os gastos do mês
+        query = "SELECT SUM(total) FROM gastos_resumo_mensal WHERE wa_id = ? AND mes_ref = ?"
+        cursor.execute(query, (wa_id, mes_referencia()))
         resultado = cursor.fetchone()
         if resultado and resultado[0] is not None:
             total = float(resultado[0])
-        print(f"Total de gastos no mês para {wa_id}: R${total:.2f}")
+        logger.debug("Total de gastos no mês para %s: R$%.2f", wa_id, total)
         return total
-    except Exception as e: print(f"Erro ao calcular total de gastos para {wa_id}: {e}"); return total
+    except Exception as e: logger.exception("Erro ao calcular total de gastos para %s: %s", wa_id, e); return total
 
-# --- Funções para a tabela USUARIOS (ATUALIZADAS) ---
-
-def update_ultimo_aviso_orcamento(wa_id, percentual):
-    """Atualiza o último percentual de aviso de orçamento enviado para o usuário."""
+@_medido
+def resumo_categorias_mes(wa_id, mes_ref=None):
+    """Total e quantidade de gastos por categoria no mês (padrão: mês atual), do maior para o menor."""
     try:
         db = get_db()
-        cursor = db.cursor()
-        cursor.execute("UPDATE usuarios SET ultimo_aviso_orcamento = ? WHERE wa_id = ?", (percentual, wa_id))
+        linhas = db.execute(
+            "SELECT categoria, total, quantidade FROM gastos_resumo_mensal WHERE wa_id = ? AND mes_ref = ? ORDER BY total DESC",
+            (wa_id, mes_ref or mes_referencia())
+        ).fetchall()
+        return [{"categoria": r[0] or "Sem categoria", "total": float(r[1]), "quantidade": r[2]} for r in linhas]
+    except Exception as e: logger.exception("Erro ao buscar resumo por categoria para %s: %s", wa_id, e); return []
+
+# --- Manutenção do resumo mensal ---
+
+def _resumo_esperado(db):
+    # Gastos do banco principal + arquivos anuais (o resumo mensal cobre os dois)
+    esperado = arquivamento.resumo_dos_arquivos(db)
+    for r in db.execute(SQL_RESUMO_A_PARTIR_DOS_GASTOS):
+        anterior = esperado.get(tuple(r[:3]), (0.0, 0))
+        esperado[tuple(r[:3])] = (anterior[0] + float(r[3]), anterior[1] + r[4])
+    return esperado
+
+def verificar_resumo_mensal(db, tolerancia=0.005):
+    """Recalcula o resumo a partir dos gastos e retorna as divergências [(chave, esperado, atual), ...]."""
+    esperado = _resumo_esperado(db)
+    atual = {tuple(r[:3]): (float(r[3]), r[4]) for r in db.execute("SELECT wa_id, mes_ref, categoria, total, quantidade FROM gastos_resumo_mensal")}
+    divergencias = []
+    for chave in sorted(esperado.keys() | atual.keys()):
+        e = esperado.get(chave, (0.0, 0)); a = atual.get(chave, (0.0, 0))
+        if e[1] != a[1] or abs(e[0] - a[0]) > tolerancia: divergencias.append((chave, e, a))
+    return divergencias
+
+def reconstruir_resumo_mensal(db):
+    """Apaga e recalcula todo o resumo mensal numa única transação. Retorna o número de linhas geradas."""
+    arquivados = arquivamento.resumo_dos_arquivos(db) # Lido antes da transação (ATTACH não pode ocorrer dentro dela)
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        db.execute("DELETE FROM gastos_resumo_mensal")
+        db.execute("INSERT INTO gastos_resumo_mensal (wa_id, mes_ref, categoria, total, quantidade) " + SQL_RESUMO_A_PARTIR_DOS_GASTOS)
+        db.executemany("""INSERT INTO gastos_resumo_mensal (wa_id, mes_ref, categoria, total, quantidade) VALUES (?, ?, ?, ?, ?)
+                          ON CONFLICT (wa_id, mes_ref, categoria) DO UPDATE SET total = total + excluded.total, quantidade = quantidade + excluded.quantidade""",
+                       [chave + valores for chave, valores in arquivados.items()])
+        linhas = db.execute("SELECT COUNT(*) FROM gastos_resumo_mensal").fetchone()[0]
         db.commit()
-        print(f"Usuário {wa_id} atualizado para ultimo_aviso_orcamento: {percentual}%")
-        return True
+        logger.info("Resumo mensal reconstruído: %d linhas.", linhas)
+        return linhas
+    except Exception:
+        db.rollback(); raise
+
+def confirmar_gasto_e_avaliar_orcamento(wa_id, descricao, valor_gasto, categoria, data_despesa_str=None, limiares=(100, 90, 80, 75, 70, 60, 50)):
+    """Salva o gasto e avalia o orçamento do mês numa única transação.
+
+    Retorna None se o gasto não foi salvo ou um dict com total_mes, renda, percentual e limiar_avisado
+    (o novo limiar de aviso atingido, ou None). ultimo_aviso_orcamento só avança com um UPDATE condicional,
+    então duas confirmações simultâneas não disparam o mesmo aviso."""
+    return confirmar_gastos_e_avaliar_orcamento(wa_id, [(descricao, valor_gasto, categoria, data_despesa_str)], limiares)
+
+@_medido
+def confirmar_gastos_e_avaliar_orcamento(wa_id, gastos, limiares=(100, 90, 80, 75, 70, 60, 50)):
+    """Como confirmar_gasto_e_avaliar_orcamento, para um lote de (descricao, valor, categoria, data): todos são
+    inseridos com um executemany na mesma transação e o orçamento é avaliado uma vez, com o total do lote."""
+    linhas = []
+    for descricao, valor_gasto, categoria, data_despesa_str in gastos:
+        try: vf = float(valor_gasto)
+        except (ValueError, TypeError): logger.warning("Erro ao salvar gasto: Valor '%s' inválido.", valor_gasto); return None
+        data = normalizar_data_iso(data_despesa_str) if data_despesa_str else None
+        if data_despesa_str and not data: logger.warning("Data '%s' inválida; o gasto fica com a data de registro.", data_despesa_str)
+        linhas.append((wa_id, descricao, vf, categoria, data))
+    if not linhas: return None
+    db = get_db()
+    try:
+        db.execute("BEGIN IMMEDIATE") # Já reserva a escrita: evita upgrade de lock (e SQLITE_BUSY) no meio da transação
+        db.executemany("INSERT INTO gastos (wa_id, descricao, valor, categoria, data_despesa) VALUES (?, ?, ?, ?, ?)", linhas)
+        usuario = db.execute("SELECT renda_mensal, ultimo_aviso_orcamento FROM usuarios WHERE wa_id = ?", (wa_id,)).fetchone()
+        total = db.execute("SELECT SUM(total) FROM gastos_resumo_mensal WHERE wa_id = ? AND mes_ref = ?", (wa_id, mes_referencia())).fetchone()[0] or 0.0
+        resultado = {"total_mes": float(total), "renda": None, "percentual": None, "limiar_avisado": None}
+        if usuario and usuario["renda_mensal"] and usuario["renda_mensal"] > 0:
+            renda = float(usuario["renda_mensal"]); percentual = total / renda * 100
+            resultado.update(renda=renda, percentual=percentual)
+            atingidos = [l for l in limiares if percentual >= l]
+            if atingidos:
+                limiar = max(atingidos)
+                cursor = db.execute("UPDATE usuarios SET ultimo_aviso_orcamento = ? WHERE wa_id = ? AND COALESCE(ultimo_aviso_orcamento, 0) < ?",
+                                    (limiar, wa_id, limiar))
+                if cursor.rowcount: resultado["limiar_avisado"] = limiar
+        db.commit()
+        notificar_alteracao_gastos(wa_id)
+        if resultado["limiar_avisado"]: cache_perfis.invalidar(wa_id)
+        logger.info("%d gasto(s) salvo(s) para %s: %s, R$%.2f (total do mês R$%.2f)", len(linhas), wa_id,
+                    ", ".join(l[1] for l in linhas), math.fsum(l[2] for l in linhas), total)
+        return resultado
     except Exception as e:
-        print(f"Erro ao atualizar ultimo_aviso_orcamento para {wa_id}: {e}")
-        db.rollback()
-        return False
-        
-# ... (o restante das funções de usuário: get_or_create_user, get_user_profile, etc., permanecem as mesmas) ...
+        logger.exception("Erro DB ao confirmar gasto para %s: %s", wa_id, e); db.rollback(); return None
+
+# --- Correções de categoria por usuário ---
+
+@_medido
+def buscar_correcoes_categoria(wa_id):
+    """{descrição normalizada: categoria} das correções manuais de categoria do usuário."""
+    try:
+        return {r[0]: r[1] for r in get_db().execute("SELECT descricao, categoria FROM categorias_usuario WHERE wa_id = ?", (wa_id,))}
+    except Exception as e: logger.exception("Erro ao buscar correções de categoria para %s: %s", wa_id, e); return {}
+
+@_medido
+def salvar_correcao_categoria(wa_id, descricao_normalizada, categoria):
+    try:
+        db = get_db()
+        db.execute("""INSERT INTO categorias_usuario (wa_id, descricao, categoria) VALUES (?, ?, ?)
+                      ON CONFLICT (wa_id, descricao) DO UPDATE SET categoria = excluded.categoria, atualizado_em = CURRENT_TIMESTAMP""",
+                   (wa_id, descricao_normalizada, categoria))
+        db.commit(); logger.info("Correção de categoria de %s: '%s' -> %s", wa_id, descricao_normalizada, categoria); return True
+    except Exception as e: logger.exception("Erro ao salvar correção de categoria para %s: %s", wa_id, e); db.rollback(); return False
+
+# --- Funções para a tabela USUARIOS (ATUALIZADAS) ---
+
+@_medido
 def get_or_create_user(wa_id, nome_perfil=None):
-    db = get_db(); cursor = db.cursor()
+    db = get_db()
+    perfil = cache_perfis.obter(wa_id, db)
+    if perfil is not None: return perfil
+    cursor = db.cursor()
     cursor.execute("SELECT * FROM usuarios WHERE wa_id = ?", (wa_id,))
     user_row = cursor.fetchone()
     if user_row is None:
-        print(f"Criando novo usuário no BD para wa_id: {wa_id}")
+        logger.info("Criando novo usuário no BD para wa_id: %s", wa_id)
         nome_a_salvar = nome_perfil if nome_perfil and nome_perfil.strip() else "Usuário"
         cursor.execute(
             "INSERT INTO usuarios (wa_id, nome_perfil, onboarding_step, onboarding_complete) VALUES (?, ?, ?, ?)",
@@ -130,38 +439,54 @@ def get_or_create_user(wa_id, nome_perfil=None):
         db.commit()
         cursor.execute("SELECT * FROM usuarios WHERE wa_id = ?", (wa_id,))
         user_row = cursor.fetchone()
-    return dict(user_row) if user_row else None
+    if not user_row: return None
+    perfil = dict(user_row); cache_perfis.guardar(perfil, db)
+    return perfil
 
+@_medido
 def get_user_profile(wa_id):
-    db = get_db(); cursor = db.cursor(); cursor.execute("SELECT * FROM usuarios WHERE wa_id = ?", (wa_id,)); user_row = cursor.fetchone()
-    return dict(user_row) if user_row else None
+    db = get_db()
+    perfil = cache_perfis.obter(wa_id, db)
+    if perfil is not None: return perfil
+    cursor = db.cursor(); cursor.execute("SELECT * FROM usuarios WHERE wa_id = ?", (wa_id,)); user_row = cursor.fetchone()
+    if not user_row: return None
+    perfil = dict(user_row); cache_perfis.guardar(perfil, db)
+    return perfil
 
+@_medido
+@_invalida_perfil
 def update_user_onboarding_step(wa_id, step):
     try:
         db = get_db(); cursor = db.cursor()
         cursor.execute("UPDATE usuarios SET onboarding_step = ? WHERE wa_id = ?", (step, wa_id))
-        db.commit(); print(f"Usuário {wa_id} atualizado para onboarding_step: {step}"); return True
-    except Exception as e: print(f"Erro ao atualizar onboarding_step para {wa_id}: {e}"); db.rollback(); return False
+        db.commit(); logger.info("Usuário %s atualizado para onboarding_step: %s", wa_id, step); return True
+    except Exception as e: logger.exception("Erro ao atualizar onboarding_step para %s: %s", wa_id, e); db.rollback(); return False
 
+@_medido
+@_invalida_perfil
 def update_user_financial_goal(wa_id, goal):
     try:
         db = get_db(); cursor = db.cursor()
         cursor.execute("UPDATE usuarios SET objetivo_financeiro = ? WHERE wa_id = ?", (goal, wa_id))
-        db.commit(); print(f"Usuário {wa_id} atualizou objetivo_financeiro para: {goal}"); return True
-    except Exception as e: print(f"Erro ao atualizar objetivo_financeiro para {wa_id}: {e}"); db.rollback(); return False
+        db.commit(); logger.info("Usuário %s atualizou objetivo_financeiro para: %s", wa_id, goal); return True
+    except Exception as e: logger.exception("Erro ao atualizar objetivo_financeiro para %s: %s", wa_id, e); db.rollback(); return False
 
+@_medido
+@_invalida_perfil
 def update_user_monthly_income(wa_id, income_str):
     try:
         income_float = float(income_str) 
         db = get_db(); cursor = db.cursor()
         cursor.execute("UPDATE usuarios SET renda_mensal = ? WHERE wa_id = ?", (income_float, wa_id))
-        db.commit(); print(f"Usuário {wa_id} atualizou renda_mensal para: {income_float}"); return True
-    except (ValueError, TypeError): print(f"Erro: Renda '{income_str}' inválida."); return False
-    except Exception as e: print(f"Erro ao atualizar renda_mensal para {wa_id}: {e}"); db.rollback(); return False
+        db.commit(); logger.info("Usuário %s atualizou renda_mensal para: %s", wa_id, income_float); return True
+    except (ValueError, TypeError): logger.warning("Erro: Renda '%s' inválida.", income_str); return False
+    except Exception as e: logger.exception("Erro ao atualizar renda_mensal para %s: %s", wa_id, e); db.rollback(); return False
 
+@_medido
+@_invalida_perfil
 def complete_onboarding_for_user(wa_id):
     try:
         db = get_db(); cursor = db.cursor()
         cursor.execute("UPDATE usuarios SET onboarding_complete = TRUE, onboarding_step = 'complete' WHERE wa_id = ?", (wa_id,))
-        db.commit(); print(f"Onboarding concluído para usuário {wa_id}"); return True
-    except Exception as e: print(f"Erro ao completar onboarding para {wa_id}: {e}"); db.rollback(); return False
+        db.commit(); logger.info("Onboarding concluído para usuário %s", wa_id); return True
+    except Exception as e: logger.exception("Erro ao completar onboarding para %s: %s", wa_id, e); db.rollback(); return False
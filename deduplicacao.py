@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+import config
+from conexoes_sqlite import GerenciadorConexoes
+
+# --- Índice de deduplicação de mensagens recebidas ---
+# A Meta reentrega o mesmo evento quando acha que o webhook falhou. Cada reentrega custaria outra chamada
+# ao Gemini, outra resposta e possivelmente um gasto duplicado, então o webhook consulta este índice
+# (memória + SQLite, para sobreviver a reinícios) antes de qualquer trabalho. Com a fila no mesmo arquivo,
+# o message_id é marcado na mesma transação que grava o job (FilaMensagens.enfileirar(..., dedup=...)): se o
+# enfileiramento falhar, a reentrega da Meta não é descartada como duplicata.
+
+class IndiceDeduplicacao:
+    def __init__(self, caminho_db, ttl_segundos=None, max_memoria=None):
+        self.caminho_db = caminho_db
+        self.ttl_segundos = ttl_segundos or config.DEDUP_TTL_SEGUNDOS
+        self.max_memoria = max_memoria or config.DEDUP_MAX_MEMORIA
+        self._vistos = OrderedDict() # message_id -> instante em que foi visto (ordem de inserção = ordem de expiração)
+        self._lock = threading.Lock()
+        self._conexoes = GerenciadorConexoes(caminho_db, inicializar=self._criar_tabelas)
+        self._proxima_limpeza_db = 0.0
+        self._tabelas_criadas = False
+        self.duplicatas_suprimidas = 0
+        self.mensagens_novas = 0
+
+    def _conexao(self):
+        return self._conexoes.conexao()
+
+    @staticmethod
+    def _criar_tabelas(conn):
+        conn.execute("CREATE TABLE IF NOT EXISTS mensagens_vistas (message_id TEXT PRIMARY KEY, visto_em REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_mensagens_vistas_visto_em ON mensagens_vistas (visto_em)")
+
+    def _expirar_memoria(self, agora):
+        limite = agora - self.ttl_segundos
+        while self._vistos:
+            message_id, visto_em = next(iter(self._vistos.items()))
+            if visto_em >= limite and len(self._vistos) <= self.max_memoria: break
+            self._vistos.popitem(last=False)
+
+    def _expirar_db(self, conn, agora):
+        # A limpeza do SQLite é feita no máximo uma vez por minuto para não pesar no webhook
+        if agora < self._proxima_limpeza_db: return
+        self._proxima_limpeza_db = agora + 60
+        conn.execute("DELETE FROM mensagens_vistas WHERE visto_em < ?", (agora - self.ttl_segundos,))
+
+    def vista_em_memoria(self, message_id):
+        """True (e conta a duplicata) se o message_id foi visto por este processo dentro do TTL."""
+        with self._lock:
+            self._expirar_memoria(time.time())
+            if message_id not in self._vistos: return False
+            self.duplicatas_suprimidas += 1
+            return True
+
+    def registrar_no_db(self, conn, message_id, agora):
+        """Grava o message_id usando conn (pode estar dentro de uma transação de quem chama, no mesmo arquivo).
+        Retorna True se ele é novo. Depois do commit, chame lembrar() para atualizar a memória."""
+        if not self._tabelas_criadas: # Na própria conn: outra conexão esperaria o lock da transação de quem chama
+            self._criar_tabelas(conn); self._tabelas_criadas = True
+        self._expirar_db(conn, agora)
+        cursor = conn.execute("INSERT OR IGNORE INTO mensagens_vistas (message_id, visto_em) VALUES (?, ?)", (message_id, agora))
+        if cursor.rowcount == 1: return True
+        row = conn.execute("SELECT visto_em FROM mensagens_vistas WHERE message_id = ?", (message_id,)).fetchone()
+        if row and row[0] < agora - self.ttl_segundos: # Registro expirado que a limpeza ainda não removeu
+            conn.execute("UPDATE mensagens_vistas SET visto_em = ? WHERE message_id = ?", (agora, message_id))
+            return True
+        return False
+
+    def lembrar(self, message_id, agora, nova):
+        with self._lock:
+            self._vistos[message_id] = agora
+            if nova: self.mensagens_novas += 1
+            else: self.duplicatas_suprimidas += 1
+
+    def registrar_se_nova(self, message_id):
+        """Registra o message_id e retorna True se ele ainda não tinha sido visto dentro do TTL."""
+        if not message_id: return True # Sem id não há como deduplicar
+        if self.vista_em_memoria(message_id): return False
+        # Não está na memória (ex: após reinício ou visto por outro processo): o SQLite decide de forma atômica
+        agora = time.time()
+        nova = self.registrar_no_db(self._conexao(), message_id, agora)
+        self.lembrar(message_id, agora, nova)
+        return nova
+
+    def estatisticas(self):
+        with self._lock:
+            return {"mensagens_novas": self.mensagens_novas, "duplicatas_suprimidas": self.duplicatas_suprimidas, "ids_em_memoria": len(self._vistos)}
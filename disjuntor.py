@@ -0,0 +1,93 @@
+import logging
+import threading
+import time
+from collections import deque
+import config
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# --- Disjuntor (circuit breaker) para dependências externas ---
+# Cada chamada é registrada com sucesso/erro e duração. Se, na janela recente, a fração de erros ou de
+# chamadas lentas passar do limiar, o disjuntor abre: as chamadas seguintes falham na hora (o chamador usa
+# um caminho degradado) em vez de prender os workers esperando o timeout. Depois de aberto_segundos ele fica
+# meio-aberto e deixa passar poucas sondas; uma sonda bem-sucedida fecha o disjuntor, uma falha reabre.
+
+FECHADO = 'fechado'
+ABERTO = 'aberto'
+MEIO_ABERTO = 'meio_aberto'
+VALOR_ESTADO = {FECHADO: 0, MEIO_ABERTO: 1, ABERTO: 2} # Valor exportado no gauge
+
+transicoes_total = metricas.Contador("agente_disjuntor_transicoes_total", "Mudanças de estado dos disjuntores por estado de destino.", ("disjuntor", "estado"))
+
+class Disjuntor:
+    def __init__(self, nome, janela_segundos=None, min_chamadas=None, limiar_erros=None, limiar_lentas=None,
+                 latencia_lenta_segundos=None, aberto_segundos=None, sondas=None):
+        self.nome = nome
+        self.janela_segundos = janela_segundos or config.GEMINI_DISJUNTOR_JANELA_SEGUNDOS
+        self.min_chamadas = min_chamadas or config.GEMINI_DISJUNTOR_MIN_CHAMADAS
+        self.limiar_erros = limiar_erros or config.GEMINI_DISJUNTOR_LIMIAR_ERROS
+        self.limiar_lentas = limiar_lentas or config.GEMINI_DISJUNTOR_LIMIAR_LENTAS
+        self.latencia_lenta_segundos = latencia_lenta_segundos or config.GEMINI_LATENCIA_LENTA_SEGUNDOS
+        self.aberto_segundos = aberto_segundos or config.GEMINI_DISJUNTOR_ABERTO_SEGUNDOS
+        self.sondas = sondas or config.GEMINI_DISJUNTOR_SONDAS
+        self._estado = FECHADO
+        self._aberto_ate = 0.0
+        self._sondas_em_voo = 0
+        self._chamadas = deque() # (instante, erro, lenta), só da janela recente
+        self._erros = 0; self._lentas = 0
+        self._lock = threading.Lock()
+
+    @property
+    def estado(self):
+        with self._lock:
+            if self._estado == ABERTO and time.monotonic() >= self._aberto_ate: return MEIO_ABERTO
+            return self._estado
+
+    def permitir(self):
+        """True se a chamada pode ser feita agora. Toda chamada permitida deve ser seguida de registrar()."""
+        with self._lock:
+            if self._estado == FECHADO: return True
+            if self._estado == ABERTO:
+                if time.monotonic() < self._aberto_ate: return False
+                self._mudar_estado(MEIO_ABERTO)
+            if self._sondas_em_voo >= self.sondas: return False
+            self._sondas_em_voo += 1
+            return True
+
+    def registrar(self, sucesso, duracao):
+        """Registra o resultado de uma chamada permitida (duracao em segundos)."""
+        lenta = duracao >= self.latencia_lenta_segundos
+        with self._lock:
+            if self._estado == MEIO_ABERTO:
+                self._sondas_em_voo = max(0, self._sondas_em_voo - 1)
+                if sucesso and not lenta:
+                    self._limpar_janela(); self._mudar_estado(FECHADO)
+                else: self._abrir("sonda falhou" if not sucesso else f"sonda lenta ({duracao:.1f}s)")
+                return
+            if self._estado == ABERTO: return # Chamada iniciada antes de abrir
+            agora = time.monotonic()
+            self._chamadas.append((agora, not sucesso, lenta))
+            self._erros += not sucesso; self._lentas += lenta
+            while self._chamadas and self._chamadas[0][0] < agora - self.janela_segundos:
+                _, erro, lenta_antiga = self._chamadas.popleft()
+                self._erros -= erro; self._lentas -= lenta_antiga
+            total = len(self._chamadas)
+            if total < self.min_chamadas: return
+            if self._erros / total >= self.limiar_erros: self._abrir(f"{self._erros}/{total} erros")
+            elif self._lentas / total >= self.limiar_lentas: self._abrir(f"{self._lentas}/{total} chamadas acima de {self.latencia_lenta_segundos}s")
+
+    def _abrir(self, motivo):
+        self._aberto_ate = time.monotonic() + self.aberto_segundos
+        self._limpar_janela(); self._mudar_estado(ABERTO)
+        logger.warning("Disjuntor '%s' aberto por %gs: %s.", self.nome, self.aberto_segundos, motivo)
+
+    def _limpar_janela(self):
+        self._chamadas.clear(); self._erros = 0; self._lentas = 0
+
+    def _mudar_estado(self, novo):
+        if novo == self._estado: return
+        if novo == FECHADO: logger.info("Disjuntor '%s' fechado: modo normal restabelecido.", self.nome)
+        self._estado = novo
+        if novo != MEIO_ABERTO: self._sondas_em_voo = 0
+        transicoes_total.inc(disjuntor=self.nome, estado=novo)
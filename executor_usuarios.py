@@ -0,0 +1,61 @@
+import queue
+import threading
+import zlib
+from concurrent.futures import Future
+import config
+
+# --- Executor particionado por usuário ---
+# Cada wa_id é sempre atendido pelo mesmo shard (thread + fila FIFO), então as mensagens de um mesmo
+# usuário são executadas estritamente em ordem, enquanto usuários diferentes rodam em paralelo.
+
+_PARAR = object() # Sentinela para encerrar um shard
+
+class ExecutorPorUsuario:
+    def __init__(self, num_workers=None, contexto=None):
+        """contexto: fábrica opcional de context manager aberto em volta de cada tarefa (ex: app.app_context)."""
+        self.num_workers = num_workers or config.EXECUTOR_NUM_WORKERS
+        self.contexto = contexto
+        self._filas = [queue.Queue() for _ in range(self.num_workers)]
+        self._ocupados = [0] * self.num_workers # 1 enquanto o shard está executando uma tarefa
+        self._threads = []
+        for i in range(self.num_workers):
+            t = threading.Thread(target=self._loop_shard, args=(i,), name=f"executor-shard-{i}", daemon=True)
+            t.start(); self._threads.append(t)
+
+    def indice_shard(self, chave):
+        # crc32 é estável entre processos/execuções, diferente de hash() com PYTHONHASHSEED aleatório
+        return zlib.crc32(str(chave).encode("utf-8")) % self.num_workers
+
+    def submeter(self, chave, fn, *args, **kwargs):
+        """Agenda fn(*args, **kwargs) no shard da chave (wa_id) e retorna um Future."""
+        future = Future()
+        self._filas[self.indice_shard(chave)].put((future, fn, args, kwargs))
+        return future
+
+    def _executar(self, fn, args, kwargs):
+        if self.contexto is None: return fn(*args, **kwargs)
+        with self.contexto(): return fn(*args, **kwargs)
+
+    def _loop_shard(self, indice):
+        fila = self._filas[indice]
+        while True:
+            item = fila.get()
+            if item is _PARAR: break
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel(): continue
+            self._ocupados[indice] = 1
+            try:
+                future.set_result(self._executar(fn, args, kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                self._ocupados[indice] = 0
+
+    def profundidade_filas(self):
+        """Tarefas aguardando + em execução em cada shard."""
+        return [fila.qsize() + ocupado for fila, ocupado in zip(self._filas, self._ocupados)]
+
+    def desligar(self, esperar=True):
+        for fila in self._filas: fila.put(_PARAR)
+        if esperar:
+            for t in self._threads: t.join()
@@ -0,0 +1,283 @@
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import config
+import metricas
+from conexoes_sqlite import GerenciadorConexoes
+
+logger = logging.getLogger(__name__)
+
+# --- Fila durável de mensagens recebidas ---
+# O webhook apenas grava a mensagem aqui e responde 200 para a Meta; um despachante em segundo plano
+# entrega os jobs ao executor por usuário, que chama Gemini/Graph API com retry, backoff exponencial e dead-letter.
+# Mensagens em rajada do mesmo usuário são coalescidas: quando o worker começa o job mais antigo, os seguintes
+# ainda não iniciados são absorvidos nele, com os textos unidos numa só frase (uma chamada ao Gemini e uma resposta).
+# Opcionalmente cada mensagem nova adia os jobs do usuário por uma janela curta para esperar outras. O
+# pode_coalescer(wa_id, payload) de quem cria a fila é avaliado nesse momento, no worker (nunca no webhook), com o
+# estado da conversa já atualizado pelas mensagens anteriores: as que dependem dele (ex.: "sim" com um gasto
+# pendente) nunca são unidas a outras.
+
+STATUS_PENDENTE = 'pendente'
+STATUS_PROCESSANDO = 'processando'
+STATUS_FALHOU = 'falhou' # Dead-letter: excedeu o número máximo de tentativas
+
+class FalhaPermanente(Exception):
+    """Erro que não se resolve com retry: o job vai direto para dead-letter."""
+
+mensagens_coalescidas_total = metricas.Contador("agente_fila_mensagens_coalescidas_total", "Mensagens absorvidas por outro job do mesmo usuário (rajadas).")
+
+class FilaMensagens:
+    def __init__(self, caminho_db, max_tentativas=None, backoff_base=None, backoff_max=None, lease_segundos=None,
+                 janela_coalescencia=None, janela_coalescencia_max=None, max_coalescer=None, pode_coalescer=None):
+        self.caminho_db = caminho_db
+        self.max_tentativas = max_tentativas or config.FILA_MAX_TENTATIVAS
+        self.backoff_base = backoff_base or config.FILA_BACKOFF_BASE_SEGUNDOS
+        self.backoff_max = backoff_max or config.FILA_BACKOFF_MAX_SEGUNDOS
+        self.lease_segundos = lease_segundos or config.FILA_LEASE_SEGUNDOS
+        self.janela_coalescencia = config.FILA_JANELA_COALESCENCIA_SEGUNDOS if janela_coalescencia is None else janela_coalescencia
+        self.janela_coalescencia_max = janela_coalescencia_max or config.FILA_JANELA_COALESCENCIA_MAX_SEGUNDOS
+        self.max_coalescer = max_coalescer or config.FILA_COALESCER_MAX_MENSAGENS
+        self.pode_coalescer = pode_coalescer
+        self._conexoes = GerenciadorConexoes(caminho_db, inicializar=self._criar_tabelas, row_factory=sqlite3.Row)
+        self._nova_mensagem = threading.Event()
+        self._parar = threading.Event()
+        self._threads = []
+
+    # --- Conexão (uma por thread) ---
+    def _conexao(self):
+        return self._conexoes.conexao()
+
+    def _criar_tabelas(self, conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS fila_mensagens (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_id TEXT,
+                wa_id TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pendente',
+                tentativas INTEGER NOT NULL DEFAULT 0,
+                disponivel_em REAL NOT NULL,
+                resposta TEXT,
+                ultimo_erro TEXT,
+                criado_em REAL NOT NULL
+            )
+        ''')
+        # disponivel_em = próxima tentativa (pendente) ou fim do lease (processando)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_fila_status_disponivel ON fila_mensagens (status, disponivel_em)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_fila_wa_id_status ON fila_mensagens (wa_id, status, id)")
+
+    # --- Produtor ---
+    def enfileirar(self, wa_id, payload, message_id=None, dedup=None):
+        """Grava uma mensagem recebida na fila e acorda o despachante. Retorna o id do job.
+
+        Com dedup (IndiceDeduplicacao no mesmo arquivo), o message_id é marcado como visto na mesma transação
+        do job: retorna None se for reentrega, e se a gravação falhar o id continua livre para a próxima entrega.
+        """
+        if dedup is not None and message_id and dedup.vista_em_memoria(message_id): return None
+        agora = time.time(); conn = self._conexao()
+        esperar = self.max_coalescer > 1 and self.janela_coalescencia > 0
+        liberar_em = agora + self.janela_coalescencia if esperar else agora
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if dedup is not None and message_id and not dedup.registrar_no_db(conn, message_id, agora):
+                conn.execute("COMMIT")
+                dedup.lembrar(message_id, agora, nova=False)
+                return None
+            if esperar:
+                # Adia os jobs do usuário que ainda não começaram (nunca além da janela máxima contada da criação)
+                conn.execute("UPDATE fila_mensagens SET disponivel_em = MIN(?, criado_em + ?) WHERE wa_id = ? AND status = ? AND tentativas = 0",
+                             (liberar_em, self.janela_coalescencia_max, wa_id, STATUS_PENDENTE))
+            cursor = conn.execute(
+                "INSERT INTO fila_mensagens (message_id, wa_id, payload, disponivel_em, criado_em) VALUES (?, ?, ?, ?, ?)",
+                (message_id, wa_id, json.dumps(payload, ensure_ascii=False), liberar_em, agora)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK"); raise
+        if dedup is not None and message_id: dedup.lembrar(message_id, agora, nova=True)
+        self._nova_mensagem.set()
+        return cursor.lastrowid
+
+    # --- Consumidor ---
+    def reservar_proximo(self):
+        """Reserva (com lease) o próximo job disponível, respeitando a ordem de chegada por usuário.
+
+        Só é elegível o job mais antigo ainda não concluído de cada wa_id, assim um "sim" nunca é
+        processado antes do "registrar_gasto" que o antecedeu, mesmo com vários workers.
+        """
+        conn = self._conexao(); agora = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute('''
+                SELECT * FROM fila_mensagens AS j
+                WHERE j.status IN ('pendente', 'processando') AND j.disponivel_em <= ?
+                  AND j.id = (SELECT MIN(k.id) FROM fila_mensagens AS k
+                              WHERE k.wa_id = j.wa_id AND k.status IN ('pendente', 'processando'))
+                ORDER BY j.id LIMIT 1
+            ''', (agora,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT"); return None
+            conn.execute(
+                "UPDATE fila_mensagens SET status = ?, tentativas = tentativas + 1, disponivel_em = ? WHERE id = ?",
+                (STATUS_PROCESSANDO, agora + self.lease_segundos, row['id'])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK"); raise
+        job = dict(row)
+        job['payload'] = json.loads(row['payload'])
+        job['tentativas'] += 1
+        return job
+
+    def _pode_coalescer(self, wa_id, payload):
+        if self.pode_coalescer is None: return True
+        try: return bool(self.pode_coalescer(wa_id, payload))
+        except Exception as e:
+            logger.warning("Erro ao avaliar coalescência para %s; mensagem fica separada: %s", wa_id, e); return False
+
+    def coalescer(self, job):
+        """Junta ao job reservado os seguintes do mesmo usuário ainda não iniciados, parando no primeiro que não pode
+        ser unido (a ordem das mensagens é mantida). Retorna o job, com o payload unido se absorveu alguma mensagem.
+
+        Chamado pelo worker antes de processar: pode_coalescer roda fora de qualquer transação da fila e vê o estado
+        deixado pelas mensagens anteriores do usuário, que já foram concluídas (só o job mais antigo é elegível).
+        """
+        if self.max_coalescer <= 1 or job['tentativas'] != 1 or job.get('resposta') is not None: return job
+        conn = self._conexao()
+        candidatos = conn.execute(
+            "SELECT id, payload FROM fila_mensagens WHERE wa_id = ? AND id > ? AND status = ? AND tentativas = 0 ORDER BY id LIMIT ?",
+            (job['wa_id'], job['id'], STATUS_PENDENTE, self.max_coalescer - 1)
+        ).fetchall()
+        if not candidatos or not self._pode_coalescer(job['wa_id'], job['payload']): return job
+        seguintes = []
+        for s in candidatos:
+            dados = json.loads(s['payload'])
+            if not self._pode_coalescer(job['wa_id'], dados): break
+            seguintes.append((s['id'], dados))
+        if not seguintes: return job
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Só absorve os que continuam pendentes (o job ainda está com o lease deste worker)
+            ainda = {r[0] for r in conn.execute(
+                f"SELECT id FROM fila_mensagens WHERE status = ? AND tentativas = 0 AND id IN ({','.join('?' * len(seguintes))})",
+                (STATUS_PENDENTE, *(id_job for id_job, _ in seguintes))
+            )}
+            prefixo = 0
+            while prefixo < len(seguintes) and seguintes[prefixo][0] in ainda: prefixo += 1
+            seguintes = seguintes[:prefixo]
+            if not seguintes:
+                conn.execute("COMMIT"); return job
+            payload = job['payload']
+            textos = [payload["texto"]] + [dados["texto"] for _, dados in seguintes]
+            payload = {**payload, "texto": " ".join(t.strip() for t in textos),
+                       "message_ids": [payload.get("message_id")] + [dados.get("message_id") for _, dados in seguintes]}
+            # O payload unido é gravado no job junto com a remoção dos outros, então um retry processa a frase inteira
+            conn.execute("UPDATE fila_mensagens SET payload = ? WHERE id = ?", (json.dumps(payload, ensure_ascii=False), job['id']))
+            conn.executemany("DELETE FROM fila_mensagens WHERE id = ?", [(id_job,) for id_job, _ in seguintes])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK"); raise
+        mensagens_coalescidas_total.inc(len(seguintes))
+        logger.info("Job %s de %s absorveu %d mensagem(ns) seguidas: '%s'", job['id'], job['wa_id'], len(seguintes), payload["texto"])
+        return {**job, 'payload': payload}
+
+    def espera_ate_proximo(self, maximo):
+        """Segundos até o próximo job pendente (o primeiro de cada usuário) ficar disponível, limitado a maximo."""
+        proximo = self._conexao().execute('''
+            SELECT MIN(j.disponivel_em) FROM fila_mensagens AS j
+            WHERE j.status = 'pendente'
+              AND j.id = (SELECT MIN(k.id) FROM fila_mensagens AS k
+                          WHERE k.wa_id = j.wa_id AND k.status IN ('pendente', 'processando'))
+        ''').fetchone()[0]
+        if proximo is None: return maximo
+        return min(maximo, max(0.01, proximo - time.time()))
+
+    def registrar_resposta(self, job_id, resposta):
+        """Guarda a resposta já gerada, para que um retry só reenvie a mensagem sem chamar o Gemini de novo."""
+        self._conexao().execute("UPDATE fila_mensagens SET resposta = ? WHERE id = ?", (resposta, job_id))
+
+    def concluir(self, job_id):
+        self._conexao().execute("DELETE FROM fila_mensagens WHERE id = ?", (job_id,))
+
+    def calcular_backoff(self, tentativas):
+        """Backoff exponencial com jitter completo, limitado a backoff_max."""
+        teto = min(self.backoff_max, self.backoff_base * (2 ** max(tentativas - 1, 0)))
+        return random.uniform(teto / 2, teto)
+
+    def falhar(self, job, erro):
+        """Reagenda o job com backoff ou o move para dead-letter após max_tentativas (ou já, se erro for FalhaPermanente)."""
+        conn = self._conexao(); erro_str = str(erro)[:1000]
+        if job['tentativas'] >= self.max_tentativas or isinstance(erro, FalhaPermanente):
+            conn.execute("UPDATE fila_mensagens SET status = ?, ultimo_erro = ? WHERE id = ?", (STATUS_FALHOU, erro_str, job['id']))
+            logger.error("Job %s de %s movido para dead-letter após %d tentativa(s): %s", job['id'], job['wa_id'], job['tentativas'], erro_str)
+            return
+        atraso = self.calcular_backoff(job['tentativas'])
+        conn.execute(
+            "UPDATE fila_mensagens SET status = ?, disponivel_em = ?, ultimo_erro = ? WHERE id = ?",
+            (STATUS_PENDENTE, time.time() + atraso, erro_str, job['id'])
+        )
+        logger.warning("Job %s falhou (tentativa %d), novo retry em %.1fs: %s", job['id'], job['tentativas'], atraso, erro_str)
+
+    # --- Dead-letter e monitoramento ---
+    def reprocessar_falhas(self):
+        """Devolve os jobs em dead-letter para a fila, zerando as tentativas."""
+        cursor = self._conexao().execute(
+            "UPDATE fila_mensagens SET status = ?, tentativas = 0, disponivel_em = ? WHERE status = ?",
+            (STATUS_PENDENTE, time.time(), STATUS_FALHOU)
+        )
+        self._nova_mensagem.set()
+        return cursor.rowcount
+
+    def contar_por_status(self):
+        rows = self._conexao().execute("SELECT status, COUNT(*) FROM fila_mensagens GROUP BY status").fetchall()
+        contagem = {STATUS_PENDENTE: 0, STATUS_PROCESSANDO: 0, STATUS_FALHOU: 0}
+        contagem.update({r[0]: r[1] for r in rows})
+        return contagem
+
+    # --- Despacho para o executor por usuário ---
+    def _processar_job(self, job, processar):
+        try:
+            try: job = self.coalescer(job)
+            except Exception as e: logger.warning("Erro ao coalescer o job %s; segue sozinho: %s", job['id'], e)
+            processar(job)
+            self.concluir(job['id'])
+        except Exception as e:
+            self.falhar(job, e)
+        finally:
+            self._nova_mensagem.set() # O próximo job deste usuário pode ter ficado elegível
+
+    def _loop_despachante(self, processar, executor, max_em_voo, intervalo_ocioso):
+        vagas = threading.BoundedSemaphore(max_em_voo)
+        while not self._parar.is_set():
+            # Só reserva quando há vaga, para que jobs não fiquem parados nos shards com o lease correndo
+            if not vagas.acquire(timeout=intervalo_ocioso): continue
+            self._nova_mensagem.clear() # Limpa antes de consultar para não perder um aviso que chegue no meio
+            try:
+                job = self.reservar_proximo()
+            except Exception as e:
+                logger.exception("Erro ao reservar job: %s", e); job = None
+            if job is None:
+                vagas.release()
+                # Acorda quando a janela de coalescência (ou o backoff) do próximo job terminar
+                try: espera = self.espera_ate_proximo(intervalo_ocioso)
+                except Exception: espera = intervalo_ocioso
+                self._nova_mensagem.wait(espera)
+                continue
+            future = executor.submeter(job['wa_id'], self._processar_job, job, processar)
+            future.add_done_callback(lambda _f: vagas.release())
+
+    def iniciar_despachante(self, processar, executor, max_em_voo=None, intervalo_ocioso=1.0):
+        """Inicia a thread que reserva jobs e os entrega ao executor (shard do wa_id); exceções em processar(job) disparam retry."""
+        max_em_voo = max_em_voo or executor.num_workers * config.EXECUTOR_MAX_EM_VOO_POR_WORKER
+        self._parar.clear()
+        t = threading.Thread(target=self._loop_despachante, args=(processar, executor, max_em_voo, intervalo_ocioso), name="fila-despachante", daemon=True)
+        t.start(); self._threads.append(t)
+        logger.info("Despachante iniciado consumindo '%s' para %d shards (até %d jobs em voo).", self.caminho_db, executor.num_workers, max_em_voo)
+
+    def parar_despachante(self, timeout=5):
+        self._parar.set(); self._nova_mensagem.set()
+        for t in self._threads: t.join(timeout)
+        self._threads = []
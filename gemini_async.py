@@ -0,0 +1,119 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+import config
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# --- Cliente assíncrono para chamadas a APIs externas (usado pelo gemini_handler) ---
+# Um único event loop numa thread de fundo multiplexa todas as requisições em voo; um semáforo limita quantas
+# ficam abertas ao mesmo tempo (a cota da API). Cada requisição tem prazo próprio, contado depois de obter a vaga
+# (a espera na fila do semáforo não estoura o prazo nem conta como falha da API), e com hedging, se a resposta
+# passar do p95 recente, uma segunda requisição igual é disparada e vale a que chegar primeiro. O hedge só sai
+# se houver vaga no semáforo, para não consumir a cota justamente quando a API já está saturada.
+
+hedges_total = metricas.Contador("agente_gemini_hedges_total", "Requisições duplicadas (hedging) por qual delas respondeu primeiro.", ("vencedora",))
+
+class ClienteAsync:
+    def __init__(self, nome, concorrencia=None, hedging=None, hedge_min_segundos=None, hedge_percentil=None, amostras_min=None):
+        self.nome = nome
+        self.concorrencia = concorrencia or config.GEMINI_CONCORRENCIA_MAX
+        self.hedging = config.GEMINI_HEDGING if hedging is None else hedging
+        self.hedge_min_segundos = hedge_min_segundos or config.GEMINI_HEDGE_MIN_SEGUNDOS
+        self.hedge_percentil = hedge_percentil or config.GEMINI_HEDGE_PERCENTIL
+        self.amostras_min = amostras_min or config.GEMINI_HEDGE_AMOSTRAS_MIN
+        self._latencias = deque(maxlen=500) # Durações das requisições bem-sucedidas, para o percentil do hedge
+        self._em_voo = 0
+        self._loop = None; self._semaforo = None; self._pid = None
+        self._lock = threading.Lock()
+
+    # --- Loop em segundo plano ---
+    def _loop_ativo(self):
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid(): # Depois de um fork a thread do loop não existe no filho
+                pronto = threading.Event()
+                def rodar():
+                    asyncio.set_event_loop(loop)
+                    # Threads para clientes só síncronos (asyncio.to_thread): as em voo mais as canceladas por prazo/hedge
+                    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(self.concorrencia * 2, thread_name_prefix=self.nome))
+                    self._semaforo = asyncio.Semaphore(self.concorrencia)
+                    pronto.set(); loop.run_forever()
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=rodar, name=f"{self.nome}-asyncio", daemon=True).start()
+                pronto.wait()
+                self._loop = loop; self._pid = os.getpid()
+            return self._loop
+
+    @staticmethod
+    async def _no_contexto(contexto, coro):
+        # Leva as contextvars de quem chamou (ex.: wa_id dos logs) para a tarefa no loop do cliente
+        for variavel, valor in contexto.items(): variavel.set(valor)
+        return await coro
+
+    def submeter(self, coro):
+        """Agenda a corrotina no loop do cliente a partir de qualquer thread. Retorna um concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(self._no_contexto(contextvars.copy_context(), coro), self._loop_ativo())
+
+    async def aguardar(self, coro):
+        """Executa a corrotina no loop do cliente a partir de qualquer event loop (ou do próprio)."""
+        loop = self._loop_ativo()
+        if asyncio.get_running_loop() is loop: return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._no_contexto(contextvars.copy_context(), coro), loop))
+
+    def fechar(self):
+        with self._lock:
+            if self._loop is not None: self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+
+    # --- Chamadas ---
+    def limiar_hedge(self):
+        """Segundos de espera antes de disparar o hedge (percentil das latências recentes), ou None sem amostras suficientes."""
+        if not self.hedging or len(self._latencias) < self.amostras_min: return None
+        ordenadas = sorted(self._latencias)
+        return max(self.hedge_min_segundos, ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * self.hedge_percentil / 100))])
+
+    @property
+    def em_voo(self):
+        return self._em_voo
+
+    async def _uma_chamada(self, fabrica, prazo_segundos):
+        async with self._semaforo:
+            self._em_voo += 1; inicio = time.perf_counter()
+            try: resposta = await asyncio.wait_for(fabrica(), prazo_segundos)
+            finally: self._em_voo -= 1
+        duracao = time.perf_counter() - inicio
+        self._latencias.append(duracao)
+        return resposta, duracao
+
+    async def executar(self, fabrica, prazo_segundos=None):
+        """Chama fabrica() (que cria a corrotina da requisição) respeitando o semáforo, o prazo por requisição e o
+        hedging. Deve rodar no loop do cliente (use aguardar/submeter). Retorna (resposta, segundos da requisição
+        que respondeu, sem a espera pela vaga no semáforo). Estourar o prazo levanta TimeoutError."""
+        prazo_segundos = prazo_segundos or config.GEMINI_TIMEOUT_SEGUNDOS
+        limiar = self.limiar_hedge()
+        if limiar is None: return await self._uma_chamada(fabrica, prazo_segundos)
+        original = asyncio.ensure_future(self._uma_chamada(fabrica, prazo_segundos)); hedge = None
+        try: # O finally também cobre o cancelamento de quem espera o resultado
+            concluidas, _ = await asyncio.wait({original}, timeout=limiar)
+            if concluidas or self._semaforo.locked(): return await original
+            logger.debug("Chamada a '%s' passou de %.2fs (p%d); disparando hedge.", self.nome, limiar, self.hedge_percentil)
+            hedge = asyncio.ensure_future(self._uma_chamada(fabrica, prazo_segundos))
+            pendentes = {original, hedge}
+            while pendentes:
+                concluidas, pendentes = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+                # Vale a primeira que deu certo; se as duas falharem, o erro da última
+                vencedora = next((t for t in concluidas if t.exception() is None), None)
+                if vencedora is None and not pendentes: vencedora = concluidas.pop()
+                if vencedora is not None:
+                    hedges_total.inc(vencedora="nenhuma" if vencedora.exception() else "hedge" if vencedora is hedge else "original")
+                    return vencedora.result()
+        finally:
+            for tarefa in (original, hedge):
+                if tarefa is not None: tarefa.cancel()
+
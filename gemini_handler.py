@@ -1,11 +1,35 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import time
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold, FunctionDeclaration, Tool
 import config # Importa as configurações para GOOGLE_API_KEY
+import metricas
+from intencao_local import extrair_info_local, interpretar_degradado # Caminho rápido sem custo para mensagens triviais
+from cache_intencoes import CacheIntencoes # Cache de resultados para frases repetidas
+from disjuntor import Disjuntor, VALOR_ESTADO
+from gemini_async import ClienteAsync
+from uso_tokens import uso_tokens, tokens_da_resposta
+import log_config
+
+logger = logging.getLogger(__name__)
+
+MODO_OTIMIZADO = config.GEMINI_MODO_REQUISICAO == "otimizado"
+
+# Instruções do modo otimizado: vão uma vez no system_instruction do modelo em vez de no texto de cada pedido
+INSTRUCOES_SISTEMA = (
+    "Você é um assistente financeiro no WhatsApp. Chame a função (tool) adequada ao pedido do usuário; "
+    "com vários gastos na mensagem (ex: '50 almoço, 20 uber'), chame registrar_gasto uma vez por gasto. "
+    "Se nenhuma função servir ou o pedido for vago, responda em português do Brasil pedindo mais contexto, de forma amigável."
+)
 
 gemini_model = None
 if config.GOOGLE_API_KEY:
     try:
         genai.configure(api_key=config.GOOGLE_API_KEY)
+        opcoes_modelo = {"system_instruction": INSTRUCOES_SISTEMA} if MODO_OTIMIZADO else {}
         gemini_model = genai.GenerativeModel(
             'gemini-1.5-flash-latest',
             safety_settings={
@@ -13,18 +37,41 @@ if config.GOOGLE_API_KEY:
                 HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
                 HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
                 HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-            }
+            },
+            **opcoes_modelo
         )
-        print("Cliente Gemini inicializado com sucesso em gemini_handler.py.")
+        logger.info("Cliente Gemini inicializado com sucesso.")
     except Exception as e:
-        print(f"Erro ao inicializar o cliente Gemini em gemini_handler.py: {e}")
+        logger.exception("Erro ao inicializar o cliente Gemini: %s", e)
         gemini_model = None
 else:
-    print("ERRO CRÍTICO: GOOGLE_API_KEY não configurada em config.py. Cliente Gemini não inicializado em gemini_handler.py.")
+    logger.critical("GOOGLE_API_KEY não configurada em config.py. Cliente Gemini não inicializado.")
+
+cache_intencoes = CacheIntencoes(config.CACHE_DATABASE_FILENAME)
+
+# Com muitos erros ou lentidão o disjuntor abre e as mensagens vão para o interpretador local degradado,
+# em vez de cada worker ficar preso até o timeout de uma chamada que provavelmente vai falhar
+disjuntor_gemini = Disjuntor("gemini")
+INTENCAO_INDISPONIVEL = "gemini_indisponivel" # Gemini não respondeu (disjuntor aberto, timeout, erro ou sem modelo)
+metricas.Gauge("agente_gemini_disjuntor_estado", "Estado do disjuntor do Gemini (0 = fechado, 1 = meio-aberto, 2 = aberto).",
+               lambda: VALOR_ESTADO[disjuntor_gemini.estado])
+
+# Todas as requisições ao Gemini passam por um event loop em segundo plano (gemini_async.py), limitadas a
+# GEMINI_CONCORRENCIA_MAX em voo, com prazo por chamada e hedging acima do p95
+cliente_gemini = ClienteAsync("gemini")
+metricas.Gauge("agente_gemini_em_voo", "Requisições ao Gemini em andamento no cliente assíncrono.", lambda: cliente_gemini.em_voo)
 
 # --- DEFINIÇÃO DAS FERRAMENTAS (FUNÇÕES) PARA O GEMINI ---
 
-avaliar_objetivo_financeiro_tool = FunctionDeclaration(
+ESQUEMAS = {} # nome -> argumentos da declaração (usado para estimar tokens em benchmarks/tokens_gemini.py)
+DECLARACOES = {} # nome -> FunctionDeclaration
+
+def _declarar(**kwargs):
+    ESQUEMAS[kwargs["name"]] = kwargs
+    DECLARACOES[kwargs["name"]] = declaracao = FunctionDeclaration(**kwargs)
+    return declaracao
+
+avaliar_objetivo_financeiro_tool = _declarar(
     name="avaliar_objetivo_financeiro",
     description=("Avalia se o texto do usuário é um objetivo financeiro direto e acionável."),
     parameters={
@@ -38,7 +85,7 @@ avaliar_objetivo_financeiro_tool = FunctionDeclaration(
     }
 )
 
-alterar_renda_mensal_tool = FunctionDeclaration(
+alterar_renda_mensal_tool = _declarar(
     name="alterar_renda_mensal",
     description="Permite que o usuário atualize o valor da sua renda mensal previamente registrada. Frases comuns: 'quero alterar minha renda', 'minha renda mudou para X', 'atualizar renda'.",
     parameters={
@@ -53,7 +100,7 @@ alterar_renda_mensal_tool = FunctionDeclaration(
     }
 )
 
-registrar_gasto_tool = FunctionDeclaration(
+registrar_gasto_tool = _declarar(
     name="registrar_gasto",
     description="Registra uma nova despesa financeira informada pelo usuário. Extrai a descrição, o valor, a categoria e, opcionalmente, a data do gasto.",
     parameters={
@@ -68,43 +115,63 @@ registrar_gasto_tool = FunctionDeclaration(
     }
 )
 
-listar_gastos_tool = FunctionDeclaration(
+listar_gastos_tool = _declarar(
     name="listar_gastos",
     description="Lista os gastos que foram registrados anteriormente pelo usuário.",
     parameters={
         "type": "object",
         "properties": {
             "limite": {"type": "integer", "description": "Opcional. Número máximo de gastos a listar."},
-            "periodo": {"type": "string", "description": "Opcional. O período para listar os gastos."}
+            "periodo": {"type": "string", "description": "Opcional. O período para listar os gastos, como o usuário disse (ex: 'hoje', 'esta semana', 'mês passado', 'maio', 'de 01/05 a 15/05')."}
         }
     }
 )
 
-confirmar_operacao_tool = FunctionDeclaration(
+ver_mais_gastos_tool = _declarar(
+    name="ver_mais_gastos",
+    description="Continua a última listagem de gastos quando o usuário pede para ver mais (ex: 'ver mais', 'mostra mais', 'próximos').",
+    parameters={"type": "object", "properties": {}}
+)
+
+resumo_gastos_tool = _declarar(
+    name="resumo_gastos",
+    description=("Resume os gastos do usuário num período: total, por categoria, comparação com o período anterior, onde mais gastou e média diária. "
+                 "Frases comuns: 'quanto gastei este mês', 'quanto gastei com alimentação', 'resumo de maio', 'compare com o mês passado'."),
+    parameters={
+        "type": "object",
+        "properties": {
+            "periodo": {"type": "string", "description": "Opcional. O período como o usuário disse (ex: 'este mês', 'mês passado', 'maio', 'últimos 30 dias'). Padrão: este mês."},
+            "categoria": {"type": "string", "description": "Opcional. Categoria (ex: Alimentação) ou estabelecimento (ex: ifood) para filtrar o total."}
+        }
+    }
+)
+
+confirmar_operacao_tool = _declarar(
     name="confirmar_operacao",
     description="O usuário confirma uma operação anterior (ex: 'sim', 'ok', 'correto').",
     parameters={"type": "object", "properties": {}}
 )
 
-cancelar_operacao_tool = FunctionDeclaration(
+cancelar_operacao_tool = _declarar(
     name="cancelar_operacao",
     description="O usuário cancela uma operação anterior (ex: 'não', 'cancela', 'errado').",
     parameters={"type": "object", "properties": {}}
 )
 
-solicitar_alteracao_gasto_tool = FunctionDeclaration(
+solicitar_alteracao_gasto_tool = _declarar(
     name="solicitar_alteracao_gasto",
     description=("O usuário indica que quer modificar detalhes de um gasto pendente. Pode dizer apenas 'alterar', 'corrigir', ou especificar o campo e o novo valor como 'alterar valor para 50'."),
     parameters={
         "type": "object",
         "properties": {
             "campo_a_alterar": {"type": "string", "description": "O campo a alterar (descrição, valor, categoria, data)."},
-            "novo_valor_texto": {"type": "string", "description": "O novo valor para o campo."}
+            "novo_valor_texto": {"type": "string", "description": "O novo valor para o campo."},
+            "item": {"type": "integer", "description": "Opcional. Número do gasto a alterar quando vários gastos estão pendentes (ex: 'alterar valor do 2 para 30')."}
         }
     }
 )
 
-consultar_renda_tool = FunctionDeclaration(
+consultar_renda_tool = _declarar(
     name="consultar_renda",
     description="Permite que o usuário consulte o valor da sua renda mensal registrada.",
     parameters={"type": "object", "properties": {}}
@@ -114,6 +181,8 @@ consultar_renda_tool = FunctionDeclaration(
 ferramentas_gemini = Tool(function_declarations=[
     registrar_gasto_tool,
     listar_gastos_tool,
+    ver_mais_gastos_tool,
+    resumo_gastos_tool,
     confirmar_operacao_tool,
     cancelar_operacao_tool,
     solicitar_alteracao_gasto_tool,
@@ -122,44 +191,154 @@ ferramentas_gemini = Tool(function_declarations=[
     consultar_renda_tool
 ])
 
-def extrair_info_gemini(texto_usuario):
-    """Envia o texto para o Gemini e extrai intenção e entidades."""
-    if not gemini_model:
-        print("ERRO em extrair_info_gemini: Modelo Gemini não inicializado.")
-        return None, {}
+# Ferramentas que só fazem sentido com um gasto aguardando confirmação
+FERRAMENTAS_PENDENCIA = ("confirmar_operacao", "cancelar_operacao", "solicitar_alteracao_gasto")
 
-    print(f"Enviando para Gemini: '{texto_usuario}'")
-    try:
-        prompt_com_instrucao = (
-            f"Seu objetivo principal é ajudar o usuário chamando uma das funções (tools) disponíveis. "
-            f"Se você não conseguir encontrar uma função adequada para o pedido do usuário ou se o pedido for muito vago, "
-            f"você DEVE responder diretamente ao usuário em PORTUGUÊS do Brasil, pedindo mais contexto de forma amigável. "
-            f"Exemplo: 'Não entendi. Você está tentando registrar um gasto ou alterar sua renda?'.\n\n"
-            f"Pedido do usuário: '{texto_usuario}'"
-        )
+@functools.lru_cache(maxsize=None)
+def _ferramentas(nomes):
+    return Tool(function_declarations=[DECLARACOES[nome] for nome in nomes])
 
-        response = gemini_model.generate_content(
-            prompt_com_instrucao,
-            tools=[ferramentas_gemini],
-            tool_config={"function_calling_config": "AUTO"},
-        )
-        
-        if response.candidates and response.candidates[0].content.parts:
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, 'function_call') and part.function_call.name:
-                    intent_name = part.function_call.name
-                    entities = dict(part.function_call.args) if part.function_call.args else {}
-                    print(f"Gemini chamou função: {intent_name} com args: {entities}")
-                    return intent_name, entities
-            
-            if hasattr(response.candidates[0].content.parts[-1], 'text') and response.candidates[0].content.parts[-1].text:
-                text_response_from_gemini = response.candidates[0].content.parts[-1].text
-                print(f"Gemini respondeu com texto direto: {text_response_from_gemini}")
-                return "resposta_textual_gemini", {"texto_resposta": text_response_from_gemini}
+def nomes_ferramentas(contexto=None):
+    """Nomes das ferramentas enviadas ao Gemini no estado do usuário. contexto: {"onboarding", "gasto_pendente",
+    "listagem"}; sem contexto (ou no modo completo) vão todas."""
+    if not MODO_OTIMIZADO or contexto is None: return tuple(DECLARACOES)
+    if contexto.get("onboarding"): return ("avaliar_objetivo_financeiro",)
+    excluidas = {"avaliar_objetivo_financeiro"}
+    if not contexto.get("gasto_pendente"): excluidas.update(FERRAMENTAS_PENDENCIA)
+    if not contexto.get("listagem"): excluidas.add("ver_mais_gastos")
+    return tuple(nome for nome in DECLARACOES if nome not in excluidas)
+
+@functools.lru_cache(maxsize=None)
+def _assinatura(modo, nomes):
+    return f"{modo}:{hashlib.blake2s(','.join(nomes).encode(), digest_size=4).hexdigest()}"
+
+def variante_cache(contexto=None):
+    """Variante da chave do cache de intenções: o resultado depende do formato da requisição e das ferramentas
+    oferecidas. O modo completo (todas as ferramentas) usa a chave sem variante."""
+    if not MODO_OTIMIZADO: return ""
+    return _assinatura(config.GEMINI_MODO_REQUISICAO, nomes_ferramentas(contexto))
+
+def ferramentas_para(contexto=None):
+    nomes = nomes_ferramentas(contexto)
+    return ferramentas_gemini if len(nomes) == len(DECLARACOES) else _ferramentas(nomes)
+
+def _juntar_chamadas(chamadas):
+    """Várias chamadas de registrar_gasto numa resposta viram um lote (registrar_gastos); nos demais casos vale a primeira."""
+    gastos = [args for nome, args in chamadas if nome == "registrar_gasto"]
+    if len(gastos) > 1 and len(gastos) == len(chamadas): return "registrar_gastos", {"gastos": gastos}
+    if len(chamadas) > 1: logger.warning("Gemini chamou %d funções; usando só a primeira: %s", len(chamadas), [n for n, _ in chamadas])
+    return chamadas[0]
+
+def _montar_prompt(texto_usuario):
+    if MODO_OTIMIZADO: return f"Pedido do usuário: '{texto_usuario}'"
+    return (
+        f"Seu objetivo principal é ajudar o usuário chamando uma das funções (tools) disponíveis. "
+        f"Se você não conseguir encontrar uma função adequada para o pedido do usuário ou se o pedido for muito vago, "
+        f"você DEVE responder diretamente ao usuário em PORTUGUÊS do Brasil, pedindo mais contexto de forma amigável. "
+        f"Exemplo: 'Não entendi. Você está tentando registrar um gasto ou alterar sua renda?'.\n"
+        f"Se a mensagem tiver vários gastos (ex: '50 almoço, 20 uber'), chame registrar_gasto uma vez para cada gasto.\n\n"
+        f"Pedido do usuário: '{texto_usuario}'"
+    )
+
+async def _gerar_conteudo(prompt, ferramentas):
+    opcoes = {
+        "tools": [ferramentas],
+        "tool_config": {"function_calling_config": "AUTO"},
+        "request_options": {"timeout": config.GEMINI_TIMEOUT_SEGUNDOS}, # Prazo da requisição; estourar conta como erro no disjuntor
+    }
+    if hasattr(gemini_model, "generate_content_async"): return await gemini_model.generate_content_async(prompt, **opcoes)
+    return await asyncio.to_thread(gemini_model.generate_content, prompt, **opcoes) # Modelos só síncronos (ex.: stubs de teste)
+
+def _interpretar_resposta(response):
+    """(intencao, entidades, resultado) a partir da resposta do Gemini."""
+    if response.candidates and response.candidates[0].content.parts:
+        chamadas = [(part.function_call.name, dict(part.function_call.args) if part.function_call.args else {})
+                    for part in response.candidates[0].content.parts
+                    if hasattr(part, 'function_call') and part.function_call.name]
+        if chamadas:
+            intent_name, entities = _juntar_chamadas(chamadas)
+            logger.info("Gemini chamou função: %s com args: %s", intent_name, entities)
+            return intent_name, entities, "funcao"
         
-        print("Gemini não chamou nenhuma função ou retornou texto claro na estrutura esperada.")
-        return None, {}
+        if hasattr(response.candidates[0].content.parts[-1], 'text') and response.candidates[0].content.parts[-1].text:
+            text_response_from_gemini = response.candidates[0].content.parts[-1].text
+            logger.info("Gemini respondeu com texto direto: %s", text_response_from_gemini)
+            return "resposta_textual_gemini", {"texto_resposta": text_response_from_gemini}, "texto"
+    
+    logger.warning("Gemini não chamou nenhuma função ou retornou texto claro na estrutura esperada.")
+    return None, {}, "vazio"
 
+async def _chamar_gemini(texto_usuario, contexto=None):
+    """Envia o texto para o Gemini. Retorna (intencao, entidades, resultado, segundos da requisição) para as
+    métricas e o disjuntor; os segundos não incluem a espera por vaga no cliente assíncrono."""
+    if not gemini_model:
+        logger.error("extrair_info_gemini: Modelo Gemini não inicializado.")
+        return None, {}, "sem_modelo", 0.0
+
+    logger.debug("Enviando para Gemini: '%s'", texto_usuario)
+    try:
+        prompt_com_instrucao = _montar_prompt(texto_usuario)
+        ferramentas = ferramentas_para(contexto)
+        response, segundos = await cliente_gemini.executar(lambda: _gerar_conteudo(prompt_com_instrucao, ferramentas))
+        intencao, entidades, resultado = _interpretar_resposta(response)
+        uso_tokens.registrar(log_config.wa_id_atual(), intencao, config.GEMINI_MODO_REQUISICAO, *tokens_da_resposta(response))
+        return intencao, entidades, resultado, segundos
+    except asyncio.TimeoutError:
+        logger.warning("Gemini não respondeu em %ss.", config.GEMINI_TIMEOUT_SEGUNDOS)
+        return None, {}, "erro", config.GEMINI_TIMEOUT_SEGUNDOS
     except Exception as e:
-        print(f"Erro ao comunicar com Gemini ou processar resposta: {e}")
-        return None, {}
+        logger.exception("Erro ao comunicar com Gemini ou processar resposta: %s", e)
+        return None, {}, "erro", 0.0
+
+async def _extrair_info_gemini_async(texto_usuario, contexto=None):
+    if gemini_model and not disjuntor_gemini.permitir():
+        metricas.gemini_segundos.observar(0.0, intencao=INTENCAO_INDISPONIVEL, resultado="disjuntor_aberto")
+        return INTENCAO_INDISPONIVEL, {}, "disjuntor_aberto"
+    inicio = time.perf_counter()
+    intencao, entidades, resultado, segundos_requisicao = await _chamar_gemini(texto_usuario, contexto)
+    duracao = time.perf_counter() - inicio
+    # O disjuntor avalia só a API: espera por vaga no cliente (fila local) não conta como chamada lenta
+    if resultado != "sem_modelo": disjuntor_gemini.registrar(resultado != "erro", segundos_requisicao)
+    metricas.gemini_segundos.observar(duracao, intencao=intencao or "nenhuma", resultado=resultado)
+    if resultado in ("erro", "sem_modelo"): return INTENCAO_INDISPONIVEL, {}, resultado
+    return intencao, entidades, resultado
+
+def _extrair_info_gemini(texto_usuario, contexto=None):
+    # Chamado das threads (rotas Flask, workers da fila): roda no loop do cliente e espera o resultado
+    return cliente_gemini.submeter(_extrair_info_gemini_async(texto_usuario, contexto)).result()
+
+async def extrair_info_gemini_async(texto_usuario, contexto=None):
+    """Versão assíncrona de extrair_info_gemini; pode ser aguardada de qualquer event loop."""
+    intencao, entidades, _ = await cliente_gemini.aguardar(_extrair_info_gemini_async(texto_usuario, contexto))
+    return intencao, entidades
+
+def extrair_info_gemini(texto_usuario, contexto=None):
+    """Envia o texto para o Gemini e extrai intenção e entidades. Retorna (INTENCAO_INDISPONIVEL, {}) se o
+    Gemini não puder responder (disjuntor aberto, timeout ou erro). contexto (ver nomes_ferramentas) limita as
+    ferramentas enviadas no modo otimizado."""
+    intencao, entidades, _ = _extrair_info_gemini(texto_usuario, contexto)
+    return intencao, entidades
+
+def extrair_intencao(texto_usuario, contexto=None):
+    """Extrai intenção e entidades tentando o extrator local, depois o cache e só então o Gemini. contexto pode
+    ser uma função, chamada só se o extrator local não resolver a mensagem."""
+    intencao, entidades = extrair_info_local(texto_usuario)
+    if intencao:
+        metricas.intencao_origem_total.inc(origem="local")
+        return intencao, entidades
+    if callable(contexto): contexto = contexto()
+    variante = variante_cache(contexto) # O mesmo texto em estados com ferramentas diferentes não compartilha entrada
+    em_cache = cache_intencoes.obter(texto_usuario, variante)
+    if em_cache:
+        metricas.intencao_origem_total.inc(origem="cache")
+        return em_cache
+    intencao, entidades, resultado = _extrair_info_gemini(texto_usuario, contexto)
+    if intencao == INTENCAO_INDISPONIVEL:
+        # Modo degradado: regras locais mais permissivas para confirmações, cancelamentos e gastos simples
+        metricas.intencao_origem_total.inc(origem="degradado")
+        degradada, entidades_degradadas = interpretar_degradado(texto_usuario)
+        logger.warning("Gemini indisponível (%s); interpretação local degradada: %s", resultado, degradada)
+        return (degradada, entidades_degradadas) if degradada else (intencao, entidades)
+    metricas.intencao_origem_total.inc(origem="gemini")
+    cache_intencoes.armazenar(texto_usuario, intencao, entidades, variante)
+    return intencao, entidades
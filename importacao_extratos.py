@@ -0,0 +1,135 @@
+import csv
+import datetime
+import hashlib
+import itertools
+import logging
+import re
+import time
+import config
+from database import notificar_alteracao_gastos
+from texto_utils import normalizar_texto, parsear_valor
+
+logger = logging.getLogger(__name__)
+
+# --- Importação em lote de extratos bancários (CSV e OFX) ---
+# O arquivo é lido como stream, linha a linha, e processado em lotes de tamanho fixo: a memória usada não
+# depende do tamanho do extrato. Cada lote é categorizado localmente (categorizar_gasto, sem Gemini),
+# deduplicado contra os gastos já existentes (data, valor, hash da descrição) por busca pontual no índice
+# (wa_id, data_efetiva, valor) e inserido com executemany numa transação própria. Os triggers de gastos mantêm o
+# resumo mensal.
+
+COLUNAS_DATA = {"data", "date", "data lancamento", "data da transacao", "dt"}
+COLUNAS_VALOR = {"valor", "amount", "value", "valor (r$)", "quantia"}
+COLUNAS_DESCRICAO = {"descricao", "description", "historico", "memo", "lancamento", "estabelecimento", "detalhes"}
+
+RE_DATA_ISO = re.compile(r'^(\d{4})-(\d{2})-(\d{2})')
+RE_DATA_BR = re.compile(r'^(\d{1,2})/(\d{1,2})/(\d{2,4})$')
+RE_TAG_OFX = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<\r\n]*)')
+
+class ErroImportacao(ValueError):
+    pass
+
+def _parsear_data_extrato(texto):
+    texto = (texto or "").strip()
+    try:
+        m = RE_DATA_ISO.match(texto)
+        if m: return datetime.date(int(m.group(1)), int(m.group(2)), int(m.group(3))).isoformat()
+        m = RE_DATA_BR.match(texto)
+        if m:
+            ano = int(m.group(3)); ano += 2000 if ano < 100 else 0
+            return datetime.date(ano, int(m.group(2)), int(m.group(1))).isoformat()
+        if len(texto) >= 8 and texto[:8].isdigit(): # OFX: AAAAMMDD[HHMMSS[.XXX][TZ]]
+            return datetime.date(int(texto[:4]), int(texto[4:6]), int(texto[6:8])).isoformat()
+    except ValueError:
+        pass
+    return None
+
+def _parsear_valor_extrato(texto):
+    """Valor com sinal: aceita '-12,50', '12,50-', '(12,50)' e 'R$ 1.234,56'."""
+    texto = (texto or "").strip().replace(" ", "")
+    negativo = texto.startswith("-") or texto.endswith("-") or (texto.startswith("(") and texto.endswith(")"))
+    valor = parsear_valor(texto.strip("-+()"))
+    if valor is None: return None
+    return -valor if negativo else valor
+
+def ler_csv(arquivo):
+    """Gera {data, valor, descricao} para cada linha de um CSV (separador ',' ou ';', cabeçalho obrigatório)."""
+    primeira = arquivo.readline()
+    if not primeira: return
+    separador = ";" if primeira.count(";") > primeira.count(",") else ","
+    cabecalho = [normalizar_texto(c) for c in next(csv.reader([primeira], delimiter=separador))]
+    def indice(opcoes):
+        return next((i for i, c in enumerate(cabecalho) if c in opcoes), None)
+    i_data, i_valor, i_desc = indice(COLUNAS_DATA), indice(COLUNAS_VALOR), indice(COLUNAS_DESCRICAO)
+    if None in (i_data, i_valor, i_desc):
+        raise ErroImportacao(f"Cabeçalho do CSV precisa ter colunas de data, valor e descrição (encontrado: {cabecalho}).")
+    for linha in csv.reader(arquivo, delimiter=separador):
+        if not linha or len(linha) <= max(i_data, i_valor, i_desc): continue
+        yield {"data": _parsear_data_extrato(linha[i_data]), "valor": _parsear_valor_extrato(linha[i_valor]), "descricao": linha[i_desc].strip()}
+
+def ler_ofx(arquivo):
+    """Gera {data, valor, descricao} para cada <STMTTRN> de um OFX (SGML ou XML), sem carregar o arquivo inteiro."""
+    transacao = None
+    for linha in arquivo:
+        for fechamento, tag, valor in RE_TAG_OFX.findall(linha):
+            tag = tag.upper()
+            if tag == "STMTTRN":
+                if not fechamento: transacao = {}
+                elif transacao is not None:
+                    yield {"data": _parsear_data_extrato(transacao.get("DTPOSTED")), "valor": _parsear_valor_extrato(transacao.get("TRNAMT")),
+                           "descricao": (transacao.get("MEMO") or transacao.get("NAME") or "").strip()}
+                    transacao = None
+            elif transacao is not None and not fechamento and valor.strip():
+                transacao[tag] = valor.strip()
+
+LEITORES = {"csv": ler_csv, "ofx": ler_ofx}
+
+def chave_dedup(data, valor, descricao):
+    """(data, valor em centavos, hash da descrição normalizada) de um gasto."""
+    hash_descricao = hashlib.sha1(normalizar_texto(descricao).encode("utf-8")).hexdigest()[:16]
+    return (data, round(abs(float(valor)) * 100), hash_descricao)
+
+def _ja_existe(db, wa_id, chave, valor):
+    # Busca por faixa no índice (wa_id, data_efetiva, valor): só os gastos do mesmo dia com o mesmo valor
+    linhas = db.execute("SELECT descricao FROM gastos WHERE wa_id = ? AND data_efetiva = ? AND valor BETWEEN ? AND ?",
+                        (wa_id, chave[0], valor - 0.005, valor + 0.005))
+    return any(chave_dedup(chave[0], valor, desc) == chave for (desc,) in linhas)
+
+def importar_extrato(db, wa_id, linhas, categorizar, debitos_negativos=True, tamanho_lote=None):
+    """Importa as linhas (iterável de {data, valor, descricao}) como gastos de wa_id.
+
+    debitos_negativos=True: só valores negativos (saídas) viram gastos, como num extrato de conta;
+    False: todo valor é um gasto (ex.: fatura de cartão). Retorna as estatísticas da importação."""
+    tamanho_lote = tamanho_lote or config.IMPORTACAO_TAMANHO_LOTE
+    stats = {"lidas": 0, "importadas": 0, "duplicadas": 0, "ignoradas": 0}
+    inicio = time.perf_counter()
+    linhas = iter(linhas)
+    while True:
+        lote = list(itertools.islice(linhas, tamanho_lote))
+        if not lote: break
+        stats["lidas"] += len(lote)
+        validas = []
+        for item in lote:
+            valor = item["valor"]
+            if not item["data"] or valor is None or not item["descricao"] or valor == 0 or (debitos_negativos and valor > 0):
+                stats["ignoradas"] += 1; continue
+            validas.append((item["data"], abs(valor), item["descricao"][:200]))
+        if not validas: continue
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            vistas = set(); novas = []
+            for data, valor, descricao in validas:
+                chave = chave_dedup(data, valor, descricao)
+                if chave in vistas or _ja_existe(db, wa_id, chave, valor): stats["duplicadas"] += 1; continue
+                vistas.add(chave) # Repetições dentro do próprio lote (lotes anteriores já estão no banco)
+                novas.append((wa_id, descricao, valor, categorizar(descricao), data))
+            db.executemany("INSERT INTO gastos (wa_id, descricao, valor, categoria, data_despesa) VALUES (?, ?, ?, ?, ?)", novas)
+            db.commit()
+        except Exception:
+            db.rollback(); raise
+        stats["importadas"] += len(novas)
+    if stats["importadas"]: notificar_alteracao_gastos(wa_id)
+    stats["segundos"] = time.perf_counter() - inicio
+    stats["linhas_por_segundo"] = stats["lidas"] / stats["segundos"] if stats["segundos"] else 0.0
+    logger.info("Extrato importado para %s: %s", wa_id, stats)
+    return stats
@@ -0,0 +1,218 @@
+import logging
+import re
+import threading
+import config
+from categorias import CATEGORIA_PADRAO, categoria_por_palavras_chave
+from texto_utils import remover_acentos, parsear_valor, parsear_data, parsear_periodo, PADRAO_VALOR, PADRAO_DATA
+
+logger = logging.getLogger(__name__)
+
+# --- Extrator local de intenções (caminho rápido antes do Gemini) ---
+# Mensagens triviais ("sim", "cancela", "gastei 50 no almoço") são resolvidas aqui com regex compiladas,
+# devolvendo o mesmo contrato (intencao, entidades) de extrair_info_gemini. O Gemini só é chamado quando
+# a confiança fica abaixo de config.INTENCAO_LOCAL_CONFIANCA_MINIMA.
+
+CONFIRMACOES = {
+    "sim", "s", "ss", "ok", "okay", "certo", "correto", "isso", "isso mesmo", "exato", "pode", "pode salvar",
+    "pode ser", "confirma", "confirmo", "confirmar", "confirmado", "beleza", "blz", "perfeito", "ta certo",
+    "esta certo", "sim, pode", "sim pode", "sim, esta certo", "salva", "salvar", "👍",
+}
+CANCELAMENTOS = {
+    "nao", "n", "cancela", "cancelar", "cancele", "cancelado", "errado", "ta errado", "esta errado",
+    "esquece", "esquece isso", "deixa pra la", "nao quero", "nao, cancela", "nao cancela", "cancela isso",
+}
+
+_VERBOS_GASTO = r'(?:gastei|paguei|comprei|anota|anote|anotar|registra|registre|registrar|lanca|lance|lancar|adiciona|adicione)'
+_PREPOSICOES = r'(?:no|na|nos|nas|num|numa|em|com|de|do|da|dos|das|pro|pra|para|para o|para a)'
+_UNIDADES = r'(?:reais|real|conto|contos|pila|pilas)'
+_SUFIXO_DATA = r'(?:\s*,?\s+' + PADRAO_DATA + r')?'
+_DESCRICAO = r'([a-z][a-z0-9 \'\-]{0,60}?)'
+
+# "gastei 50 reais no almoço ontem", "anota 30 na farmácia"
+RE_GASTO_VERBO_VALOR = re.compile(r'^' + _VERBOS_GASTO + r'\s+' + PADRAO_VALOR + r'\s*' + _UNIDADES + r'?\s+' + _PREPOSICOES + r'\s+' + _DESCRICAO + _SUFIXO_DATA + r'$')
+# "paguei o almoço 50", "comprei pão por 10 reais hoje"
+RE_GASTO_VERBO_DESCRICAO = re.compile(r'^' + _VERBOS_GASTO + r'\s+(?:' + _PREPOSICOES + r'\s+|o\s+|a\s+)?' + _DESCRICAO + r'\s+(?:por\s+|de\s+)?' + PADRAO_VALOR + r'\s*' + _UNIDADES + r'?' + _SUFIXO_DATA + r'$')
+# "50 almoço", "30 reais de uber" (sem verbo só passa do limiar se a descrição for um gasto conhecido)
+RE_GASTO_SEM_VERBO = re.compile(r'^' + PADRAO_VALOR + r'\s*' + _UNIDADES + r'?\s+(?:' + _PREPOSICOES + r'\s+)?' + _DESCRICAO + _SUFIXO_DATA + r'$')
+
+# Descrições que indicam que a regex pegou a frase errada ("2 mil no aluguel", "50 e 20 no uber")
+RE_DESCRICAO_SUSPEITA = re.compile(r'^(?:mil|k|e|mais|reais)\b|\b(?!99\b)\d+')
+# Vários gastos numa mensagem: "50 almoço, 20 uber e 12 café" (o "e" só separa se vier antes de um valor)
+RE_SEPARADOR_GASTOS = re.compile(r'\s*[,;]\s*|\s+e\s+(?=\d)')
+
+RE_LISTAR = re.compile(r'^(?:(?:quero\s+)?(?:listar?|liste|mostr[ae]r?|ver|veja|exib[ae]|quais sao)\s+)?(?:os\s+|as\s+)?(?:meus\s+|minhas\s+)?(?:ultim[oa]s\s+)?(?:(\d{1,2})\s+)?(?:ultim[oa]s\s+)?(?:gastos|despesas)(?:\s+registrad[oa]s)?(?:\s+(.+))?$')
+RE_VER_MAIS = re.compile(r'^(?:(?:quero\s+)?(?:ver|veja|mostr[ae]r?|manda|mande|listar?)\s+)?(?:mais|os proximos|proximos|proxima pagina)(?:\s+gastos)?$')
+# "quanto gastei este mês", "quanto gastei com alimentação no mês passado", "resumo dos gastos de maio"
+RE_RESUMO = re.compile(r'^(?:quanto\s+(?:eu\s+)?(?:gastei|paguei|torrei)|(?:(?:me\s+)?(?:mostr[ae]r?|manda|mande|quero)\s+)?(?:o\s+|um\s+)?resumo(?:\s+d[eo]s?\s+(?:meus\s+)?gastos)?)(?:\s+(.+))?$')
+RE_FILTRO_RESUMO = re.compile(r'^(?:com|em|no|na|nos|nas|de|do|da|pro|pra)\s+(?:(?:o|a|os|as)\s+)?(.+)$')
+# "compare com o mês passado": resumo do período atual, que já traz a comparação com o anterior
+RE_COMPARAR = re.compile(r'^(?:compar[ae]r?|comparacao|comparativo)(?:\s+(?:com|ao|a|o))*\s+(?:a\s+|o\s+)?(mes|semana|ano)\s+(?:passad[oa]|anterior)$')
+RE_CONSULTAR_RENDA = re.compile(r'^(?:qual\s+(?:e\s+)?(?:a\s+)?minha\s+renda(?:\s+mensal)?(?:\s+registrada)?|(?:consultar?|ver|mostr[ae]r?)\s+(?:a\s+)?(?:minha\s+)?renda(?:\s+mensal)?|minha\s+renda(?:\s+mensal)?|quanto\s+(?:eu\s+)?ganho(?:\s+por\s+mes)?)$')
+# "alterar valor do 2 para 30": o número escolhe o gasto quando há um lote pendente
+RE_ALTERAR = re.compile(r'^(?:alterar?|altere|mudar?|mude|corrigir|corrige|corrija|trocar?|troque)(?:\s+(?:o|a))?\s+(valor|descricao|categoria|data)(?:\s+d[oa]\s+(?:gasto\s+|item\s+)?(\d{1,2}))?(?:\s+(?:para|pra|por)|\s*:)?\s+(.+)$')
+# Modo degradado: um valor solto no meio da frase ("hoje o almoço deu 45 reais") e palavras que não descrevem o gasto
+RE_VALOR_LIVRE = re.compile(r'(?<![\w/,.])' + PADRAO_VALOR + r'(?![\w/])')
+PALAVRAS_VAZIAS = set(re.findall(r'[a-z]+', _VERBOS_GASTO + _PREPOSICOES + _UNIDADES)) | {
+    "r$", "o", "a", "os", "as", "um", "uma", "e", "foi", "deu", "custou", "hoje", "ontem", "anteontem", "eu", "meu", "minha",
+}
+RE_ALTERAR_SEM_CAMPO = re.compile(r'^(?:alterar?|altere|mudar?|mude|corrigir|corrige|corrija|editar?)$')
+# Marcas de que o número é dinheiro: "r$ 30", "30 reais", "gastei 30"
+RE_MARCA_GASTO = re.compile(r'r\$|\b(?:' + _UNIDADES + '|' + _VERBOS_GASTO + r')\b')
+
+_lock = threading.Lock()
+_estatisticas = {"consultas": 0, "acertos": 0, "por_intencao": {}}
+
+def _sem_pontuacao_final(texto):
+    return texto.strip().rstrip('.!?').strip()
+
+def _descreve_gasto(descricao):
+    return categoria_por_palavras_chave(descricao) != CATEGORIA_PADRAO
+
+def _confianca_sem_verbo(dobrado, descricao):
+    # "10 minutos atrasado" também casa com "valor + descrição": só um gasto conhecido ("50 almoço") fica acima
+    # do limiar; com marca de dinheiro ("30 reais de pizza") serve no modo degradado; sem nenhum dos dois, nem lá
+    if _descreve_gasto(descricao): return 0.85
+    return 0.7 if RE_MARCA_GASTO.search(dobrado) else 0.5
+
+def _extrair_gasto(original, dobrado):
+    for padrao, confianca in ((RE_GASTO_VERBO_VALOR, 0.95), (RE_GASTO_VERBO_DESCRICAO, 0.9), (RE_GASTO_SEM_VERBO, None)):
+        m = padrao.match(dobrado)
+        if not m: continue
+        if padrao is RE_GASTO_VERBO_DESCRICAO: grupo_desc, grupo_valor = 1, 2
+        else: grupo_valor, grupo_desc = 1, 2
+        if RE_DESCRICAO_SUSPEITA.search(m.group(grupo_desc)): continue
+        valor = parsear_valor(m.group(grupo_valor))
+        # A descrição vem do texto original (mesmos índices), preservando acentos: "almoço" e não "almoco"
+        descricao = original[m.start(grupo_desc):m.end(grupo_desc)].strip()
+        if valor is None or valor <= 0 or not descricao: continue
+        if confianca is None: confianca = _confianca_sem_verbo(dobrado, descricao)
+        entidades = {"descricao": descricao, "valor": valor, "categoria": "Outros"} # "Outros" faz o chatbot categorizar localmente
+        if m.group(3):
+            data = parsear_data(m.group(3))
+            if not data: continue
+            entidades["data"] = data
+        return "registrar_gasto", entidades, confianca
+    return None
+
+def _extrair_varios_gastos(original, dobrado):
+    # Os separadores são procurados no texto sem acentos, que tem os mesmos índices do original
+    cortes = [0]
+    for m in RE_SEPARADOR_GASTOS.finditer(dobrado): cortes += [m.start(), m.end()]
+    cortes.append(len(dobrado))
+    if len(cortes) < 4: return None
+    gastos = []; confianca = 1.0
+    for inicio, fim in zip(cortes[::2], cortes[1::2]):
+        resultado = _extrair_gasto(original[inicio:fim], dobrado[inicio:fim])
+        if not resultado: return None # Todas as partes precisam ser gastos completos
+        gastos.append(resultado[1]); confianca = min(confianca, resultado[2])
+    if "data" in gastos[-1]: # "50 almoço, 20 uber ontem": a data no fim vale para todos sem data própria
+        for gasto in gastos: gasto.setdefault("data", gastos[-1]["data"])
+    return "registrar_gastos", {"gastos": gastos}, confianca
+
+def _extrair_alteracao(original, dobrado):
+    m = RE_ALTERAR.match(dobrado)
+    if m:
+        campo = m.group(1); novo_valor = original[m.start(3):m.end(3)].strip()
+        if campo == "valor":
+            valor = parsear_valor(novo_valor)
+            if valor is None: return None
+            novo_valor = str(valor)
+        elif campo == "data":
+            data = parsear_data(novo_valor)
+            if data is None: return None
+            novo_valor = data
+        entidades = {"campo_a_alterar": campo, "novo_valor_texto": novo_valor}
+        if m.group(2): entidades["item"] = int(m.group(2))
+        return "solicitar_alteracao_gasto", entidades, 0.95
+    if RE_ALTERAR_SEM_CAMPO.match(dobrado):
+        return "solicitar_alteracao_gasto", {}, 0.9
+    return None
+
+def _extrair_resumo(resto):
+    if not resto: return "resumo_gastos", {}, 0.9
+    if parsear_periodo(resto): return "resumo_gastos", {"periodo": resto}, 0.9
+    m = RE_FILTRO_RESUMO.match(resto)
+    if not m: return None
+    # "com alimentação no mês passado": a categoria são as primeiras palavras e o restante, se houver, um período
+    palavras = m.group(1).split()
+    for corte in range(1, min(len(palavras), 3) + 1):
+        categoria, periodo = ' '.join(palavras[:corte]), ' '.join(palavras[corte:])
+        if not periodo: return "resumo_gastos", {"categoria": categoria}, 0.85
+        if parsear_periodo(periodo): return "resumo_gastos", {"categoria": categoria, "periodo": periodo}, 0.9
+    return None
+
+def interpretar(texto_usuario):
+    """Retorna (intencao, entidades, confianca). intencao None e confiança 0 quando nenhuma regra casa."""
+    original = _sem_pontuacao_final(texto_usuario or '')
+    dobrado = remover_acentos(original)
+    colapsado = ' '.join(dobrado.split())
+    if colapsado in CONFIRMACOES: return "confirmar_operacao", {}, 1.0
+    if colapsado in CANCELAMENTOS: return "cancelar_operacao", {}, 1.0
+    m = RE_LISTAR.match(colapsado)
+    if m and (not m.group(2) or parsear_periodo(m.group(2))): # Período que não reconhecemos fica para o Gemini
+        entidades = {"limite": int(m.group(1))} if m.group(1) else {}
+        if m.group(2): entidades["periodo"] = m.group(2)
+        return "listar_gastos", entidades, 0.9
+    if RE_VER_MAIS.match(colapsado): return "ver_mais_gastos", {}, 0.95
+    if RE_CONSULTAR_RENDA.match(colapsado): return "consultar_renda", {}, 0.9
+    m = RE_RESUMO.match(colapsado)
+    resultado = _extrair_resumo(m.group(1)) if m else None
+    if resultado: return resultado
+    m = RE_COMPARAR.match(colapsado)
+    if m: return "resumo_gastos", {"periodo": f"este {m.group(1)}" if m.group(1) != "semana" else "esta semana"}, 0.9
+    resultado = _extrair_alteracao(original, dobrado) or _extrair_gasto(original, dobrado) or _extrair_varios_gastos(original, dobrado)
+    if resultado: return resultado
+    return None, {}, 0.0
+
+def interpretar_degradado(texto_usuario):
+    """Interpretação usada quando o Gemini está indisponível (disjuntor aberto, timeout ou erro): aceita regras
+    locais com confiança menor que a normal, "sim"/"não" no começo de frases curtas e frases com um único valor
+    como gasto quando há marca de dinheiro ou um gasto conhecido (o usuário ainda confirma antes de salvar).
+    Retorna (intencao, entidades) ou (None, {})."""
+    intencao, entidades, confianca = interpretar(texto_usuario)
+    if intencao and confianca >= config.INTENCAO_DEGRADADA_CONFIANCA_MINIMA: return intencao, entidades
+    original = _sem_pontuacao_final(texto_usuario or '')
+    palavras_originais = original.split(); palavras = remover_acentos(original).split()
+    if not palavras: return None, {}
+    if len(palavras) <= 5:
+        primeira = palavras[0].strip(',')
+        if primeira in CONFIRMACOES: return "confirmar_operacao", {}
+        if primeira in CANCELAMENTOS and primeira not in ("nao", "n"): return "cancelar_operacao", {} # "não sei..." não cancela
+    valores = RE_VALOR_LIVRE.findall(' '.join(palavras))
+    if len(valores) != 1: return None, {}
+    valor = parsear_valor(valores[0])
+    descricao = ' '.join(o.strip(',') for o, p in zip(palavras_originais, palavras)
+                         if p.strip(',') not in PALAVRAS_VAZIAS and not RE_VALOR_LIVRE.fullmatch(p.strip(',').replace('r$', '')))
+    if not valor or not descricao or RE_DESCRICAO_SUSPEITA.search(remover_acentos(descricao)): return None, {}
+    # "quero 2", "listar 100 gastos", "10 minutos atrasado": um número solto não basta para ser um gasto
+    if not RE_MARCA_GASTO.search(' '.join(palavras)) and not _descreve_gasto(descricao): return None, {}
+    entidades = {"descricao": descricao, "valor": valor, "categoria": "Outros"}
+    data = next((parsear_data(p) for p in palavras if p in ("ontem", "anteontem")), None)
+    if data: entidades["data"] = data
+    logger.info("Intenção resolvida no modo degradado: registrar_gasto com args: %s", entidades)
+    return "registrar_gasto", entidades
+
+def extrair_info_local(texto_usuario):
+    """Tenta resolver a mensagem localmente. Retorna (intencao, entidades) ou (None, {}) se a confiança for baixa."""
+    intencao, entidades, confianca = interpretar(texto_usuario)
+    acertou = intencao is not None and confianca >= config.INTENCAO_LOCAL_CONFIANCA_MINIMA
+    with _lock:
+        _estatisticas["consultas"] += 1
+        if acertou:
+            _estatisticas["acertos"] += 1
+            _estatisticas["por_intencao"][intencao] = _estatisticas["por_intencao"].get(intencao, 0) + 1
+        taxa = _estatisticas["acertos"] / _estatisticas["consultas"]
+    if not acertou: return None, {}
+    logger.info("Intenção resolvida localmente (confiança %.2f, taxa de acerto local %.0f%%): %s com args: %s", confianca, taxa * 100, intencao, entidades)
+    return intencao, entidades
+
+def estatisticas():
+    """Consultas, acertos e taxa de acerto do caminho local (cada acerto é uma chamada paga ao Gemini a menos)."""
+    with _lock:
+        consultas = _estatisticas["consultas"]; acertos = _estatisticas["acertos"]
+        return {
+            "consultas": consultas,
+            "acertos": acertos,
+            "taxa_acerto": (acertos / consultas) if consultas else 0.0,
+            "por_intencao": dict(_estatisticas["por_intencao"]),
+        }
@@ -0,0 +1,75 @@
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import config
+
+# --- Logging com níveis, ids de correlação e escrita fora da thread da requisição ---
+# Os módulos usam logging.getLogger(__name__) com formatação preguiçosa ("%s"), então mensagens de nível
+# desabilitado não custam nada. Os registros vão para uma fila em memória e uma thread (QueueListener)
+# formata e escreve no stdout, tirando o I/O síncrono do caminho do webhook e dos workers.
+
+_wa_id = contextvars.ContextVar("wa_id", default="-")
+_message_id = contextvars.ContextVar("message_id", default="-")
+
+FORMATO = "%(asctime)s %(levelname)s %(name)s [wa_id=%(wa_id)s msg=%(message_id)s] %(message)s"
+
+_listener = None
+
+class FiltroCorrelacao(logging.Filter):
+    """Anexa o wa_id e o message_id da mensagem em processamento a cada registro."""
+    def filter(self, record):
+        record.wa_id = _wa_id.get(); record.message_id = _message_id.get()
+        return True
+
+class QueueHandlerAssincrono(logging.handlers.QueueHandler):
+    # O QueueHandler padrão formata a mensagem na thread que loga (para poder serializar o registro);
+    # como a fila é em memória, a formatação fica para a thread do listener.
+    def prepare(self, record):
+        return record
+
+@contextlib.contextmanager
+def contexto_mensagem(wa_id=None, message_id=None):
+    """Define os ids de correlação para todos os logs emitidos dentro do bloco."""
+    token_wa = _wa_id.set(wa_id or "-"); token_msg = _message_id.set(message_id or "-")
+    try: yield
+    finally:
+        _wa_id.reset(token_wa); _message_id.reset(token_msg)
+
+def wa_id_atual():
+    """wa_id da mensagem em processamento (None fora de contexto_mensagem)."""
+    wa_id = _wa_id.get()
+    return None if wa_id == "-" else wa_id
+
+def log_payload(logger, titulo, dados, taxa=None):
+    """Loga um payload completo em DEBUG, amostrado. O json.dumps só acontece se o registro for de fato emitido."""
+    if not logger.isEnabledFor(logging.DEBUG): return
+    taxa = config.LOG_TAXA_AMOSTRAGEM_PAYLOAD if taxa is None else taxa
+    if taxa < 1 and random.random() >= taxa: return
+    logger.debug("%s: %s", titulo, json.dumps(dados, ensure_ascii=False))
+
+def configurar_logging(nivel=None):
+    """Configura o logger raiz uma única vez por processo (chamadas repetidas são ignoradas)."""
+    global _listener
+    if _listener is not None: return
+    fila_logs = queue.SimpleQueue()
+    saida = logging.StreamHandler()
+    saida.setFormatter(logging.Formatter(FORMATO))
+    _listener = logging.handlers.QueueListener(fila_logs, saida, respect_handler_level=True)
+    handler = QueueHandlerAssincrono(fila_logs)
+    handler.addFilter(FiltroCorrelacao())
+    raiz = logging.getLogger()
+    raiz.handlers = [handler]
+    raiz.setLevel(nivel or config.LOG_NIVEL)
+    _listener.start()
+    atexit.register(encerrar_logging)
+
+def encerrar_logging():
+    """Esvazia a fila de logs (chamar antes de sair do processo)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop(); _listener = None
@@ -0,0 +1,80 @@
+"""Tarefas de manutenção do banco de gastos, executadas pela linha de comando.
+
+Exemplos:
+    python manutencao.py resumos verificar
+    python manutencao.py resumos reconstruir
+    python manutencao.py importar 5511999999999 extrato.ofx
+    python manutencao.py arquivar --meses 24 --vacuum
+"""
+import argparse
+import functools
+import sys
+import config
+from arquivamento import arquivar_gastos
+from categorias import categorizar
+from importacao_extratos import LEITORES, ErroImportacao, importar_extrato
+from database import conexoes, get_db, criar_esquema, verificar_resumo_mensal, reconstruir_resumo_mensal
+
+def conectar(caminho=None):
+    # A mesma conexão das funções de database.py (ex.: correções de categoria usadas na importação)
+    if caminho: conexoes.caminho_db = caminho
+    db = get_db()
+    criar_esquema(db)
+    return db
+
+def comando_resumos(args):
+    db = conectar(args.db)
+    if args.acao == "reconstruir":
+        print(f"Resumo mensal reconstruído ({reconstruir_resumo_mensal(db)} linhas).")
+    divergencias = verificar_resumo_mensal(db)
+    for (wa_id, mes_ref, categoria), (total_esperado, qtd_esperada), (total_atual, qtd_atual) in divergencias:
+        print(f"DIVERGÊNCIA {wa_id} {mes_ref} '{categoria}': esperado R${total_esperado:.2f} ({qtd_esperada}), "
+              f"resumo R${total_atual:.2f} ({qtd_atual})")
+    print(f"{len(divergencias)} divergência(s) encontrada(s).")
+    return 1 if divergencias else 0
+
+def comando_importar(args):
+    formato = args.formato or ("ofx" if args.arquivo.lower().endswith(".ofx") else "csv")
+    db = conectar(args.db)
+    with open(args.arquivo, encoding=args.encoding, errors="replace", newline="") as arquivo:
+        try:
+            stats = importar_extrato(db, args.wa_id, LEITORES[formato](arquivo), functools.partial(categorizar, wa_id=args.wa_id),
+                                     debitos_negativos=not args.todos_sao_gastos, tamanho_lote=args.lote)
+        except ErroImportacao as e:
+            print(f"Erro: {e}"); return 1
+    print(f"{stats['lidas']} linhas lidas: {stats['importadas']} importadas, {stats['duplicadas']} duplicadas, "
+          f"{stats['ignoradas']} ignoradas em {stats['segundos']:.2f}s ({stats['linhas_por_segundo']:.0f} linhas/s).")
+    return 0
+
+def comando_arquivar(args):
+    db = conectar(args.db)
+    movidos = arquivar_gastos(db, horizonte_meses=args.meses, diretorio=args.diretorio, vacuum=args.vacuum)
+    for ano, linhas in sorted(movidos.items()): print(f"{ano}: {linhas} gasto(s) arquivado(s).")
+    print(f"{sum(movidos.values())} gasto(s) movido(s) para {args.diretorio or config.ARQUIVO_DIRETORIO}.")
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manutenção do banco de gastos.")
+    parser.add_argument("--db", help=f"Arquivo do banco (padrão: {config.DATABASE_FILENAME}).")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    resumos = sub.add_parser("resumos", help="Verifica ou reconstrói o resumo mensal por categoria a partir dos gastos.")
+    resumos.add_argument("acao", choices=["verificar", "reconstruir"])
+    resumos.set_defaults(funcao=comando_resumos)
+    importar = sub.add_parser("importar", help="Importa um extrato CSV ou OFX como gastos de um usuário.")
+    importar.add_argument("wa_id")
+    importar.add_argument("arquivo")
+    importar.add_argument("--formato", choices=sorted(LEITORES), help="Padrão: pela extensão do arquivo.")
+    importar.add_argument("--encoding", default="utf-8-sig", help="Ex.: latin-1 para extratos de alguns bancos.")
+    importar.add_argument("--todos-sao-gastos", action="store_true", help="Importa todos os valores (ex.: fatura de cartão), não só os negativos.")
+    importar.add_argument("--lote", type=int, default=None, help=f"Linhas por transação (padrão: {config.IMPORTACAO_TAMANHO_LOTE}).")
+    importar.set_defaults(funcao=comando_importar)
+    arquivar = sub.add_parser("arquivar", help="Move os gastos anteriores ao horizonte para arquivos anuais (gastos_<ano>.db).")
+    arquivar.add_argument("--meses", type=int, default=None, help=f"Horizonte em meses mantido no banco principal (padrão: {config.ARQUIVO_HORIZONTE_MESES}).")
+    arquivar.add_argument("--diretorio", help=f"Diretório dos arquivos (padrão: {config.ARQUIVO_DIRETORIO}).")
+    arquivar.add_argument("--vacuum", action="store_true", help="Compacta o banco principal depois de arquivar.")
+    arquivar.set_defaults(funcao=comando_arquivar)
+    args = parser.parse_args(argv)
+    return args.funcao(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
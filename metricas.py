@@ -0,0 +1,183 @@
+import bisect
+import functools
+import itertools
+import logging
+import threading
+import time
+import weakref
+
+# --- Métricas de latência e vazão no formato texto do Prometheus ---
+# Cada thread grava em seu próprio shard (sem lock no caminho quente); os shards só são somados quando
+# alguém consulta /metrics. Quando a thread termina (ex.: a thread por conexão do servidor Werkzeug), seu
+# shard é somado a um shard base e descartado, para que os shards não cresçam com o número de conexões.
+# Gauges são funções avaliadas apenas no momento da coleta.
+
+BUCKETS_PADRAO = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger(__name__)
+
+_metricas = [] # Ordem de registro = ordem de exibição
+_lock_registro = threading.Lock()
+
+def _formatar_rotulos(nomes, valores, extra=None):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nomes, valores)]
+    if extra: pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _formatar_numero(valor):
+    if valor == float("inf"): return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+class _MetricaComShards:
+    tipo = None
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome; self.ajuda = ajuda; self.rotulos = tuple(rotulos)
+        self._local = threading.local()
+        self._shards = {} # id -> shard de uma thread viva
+        self._base = {} # Totais das threads que já terminaram
+        self._ids = itertools.count()
+        self._lock_shards = threading.Lock()
+        with _lock_registro: _metricas.append(self)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock_shards:
+                id_shard = next(self._ids); self._shards[id_shard] = shard
+            # Só a thread guarda referência ao shard; quando ela é coletada os valores passam para a base
+            weakref.finalize(threading.current_thread(), self._incorporar, id_shard)
+        return shard
+
+    def _incorporar(self, id_shard):
+        # Move o shard para a base sob o lock, para que a coleta nunca o conte duas vezes nem nenhuma
+        with self._lock_shards: self._somar_em(self._base, self._shards.pop(id_shard))
+
+    def _agregar(self):
+        total = {}
+        with self._lock_shards:
+            self._somar_em(total, self._base)
+            for shard in self._shards.values(): self._somar_em(total, shard)
+        return total
+
+    def _somar_em(self, total, shard):
+        raise NotImplementedError
+
+    def _chave(self, rotulos):
+        return tuple(rotulos.get(n, "") for n in self.rotulos)
+
+class Contador(_MetricaComShards):
+    tipo = "counter"
+
+    def inc(self, valor=1, **rotulos):
+        shard = self._shard(); chave = self._chave(rotulos)
+        shard[chave] = shard.get(chave, 0) + valor
+
+    def _somar_em(self, total, shard):
+        for chave, valor in list(shard.items()): total[chave] = total.get(chave, 0) + valor
+
+    def valores(self):
+        return self._agregar()
+
+    def renderizar(self):
+        return [f"{self.nome}{_formatar_rotulos(self.rotulos, chave)} {_formatar_numero(valor)}" for chave, valor in sorted(self.valores().items())]
+
+class Histograma(_MetricaComShards):
+    tipo = "histogram"
+
+    def __init__(self, nome, ajuda, rotulos=(), buckets=BUCKETS_PADRAO):
+        super().__init__(nome, ajuda, rotulos)
+        self.buckets = tuple(sorted(buckets))
+
+    def observar(self, valor, **rotulos):
+        shard = self._shard(); chave = self._chave(rotulos)
+        dados = shard.get(chave)
+        if dados is None: dados = shard[chave] = [[0] * (len(self.buckets) + 1), 0.0, 0] # contagens por bucket, soma, total
+        dados[0][bisect.bisect_left(self.buckets, valor)] += 1
+        dados[1] += valor; dados[2] += 1
+
+    def tempo(self, **rotulos):
+        """Context manager que observa a duração do bloco."""
+        return _Cronometro(self, rotulos)
+
+    def medir(self, **rotulos):
+        """Decorator que observa a duração de cada chamada."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                inicio = time.perf_counter()
+                try: return func(*args, **kwargs)
+                finally: self.observar(time.perf_counter() - inicio, **rotulos)
+            return wrapper
+        return decorator
+
+    def _somar_em(self, total, shard):
+        for chave, (contagens, soma, n) in list(shard.items()):
+            acc = total.setdefault(chave, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            acc[0] = [a + b for a, b in zip(acc[0], contagens)]; acc[1] += soma; acc[2] += n
+
+    def agregado(self):
+        return self._agregar()
+
+    def renderizar(self):
+        linhas = []
+        for chave, (contagens, soma, n) in sorted(self.agregado().items()):
+            acumulado = 0
+            for limite, c in zip(self.buckets + (float("inf"),), contagens):
+                acumulado += c
+                rotulo_le = 'le="' + _formatar_numero(limite) + '"'
+                linhas.append(f"{self.nome}_bucket{_formatar_rotulos(self.rotulos, chave, rotulo_le)} {acumulado}")
+            linhas.append(f"{self.nome}_sum{_formatar_rotulos(self.rotulos, chave)} {_formatar_numero(soma)}")
+            linhas.append(f"{self.nome}_count{_formatar_rotulos(self.rotulos, chave)} {n}")
+        return linhas
+
+class _Cronometro:
+    def __init__(self, histograma, rotulos):
+        self.histograma = histograma; self.rotulos = rotulos
+
+    def __enter__(self):
+        self.inicio = time.perf_counter(); return self
+
+    def __exit__(self, *exc):
+        self.histograma.observar(time.perf_counter() - self.inicio, **self.rotulos)
+        return False
+
+class Gauge:
+    """Valor calculado na hora da coleta. funcao() retorna um número ou um dict {tupla_de_rotulos: valor}."""
+    tipo = "gauge"
+
+    def __init__(self, nome, ajuda, funcao, rotulos=()):
+        self.nome = nome; self.ajuda = ajuda; self.funcao = funcao; self.rotulos = tuple(rotulos)
+        with _lock_registro: _metricas.append(self)
+
+    def renderizar(self):
+        valor = self.funcao()
+        if not isinstance(valor, dict): return [f"{self.nome} {_formatar_numero(valor)}"]
+        return [f"{self.nome}{_formatar_rotulos(self.rotulos, chave if isinstance(chave, tuple) else (chave,))} {_formatar_numero(v)}" for chave, v in sorted(valor.items())]
+
+def renderizar_prometheus():
+    """Gera o texto no formato de exposição do Prometheus (version 0.0.4)."""
+    linhas = []
+    with _lock_registro: metricas = list(_metricas)
+    for metrica in metricas:
+        try: corpo = metrica.renderizar()
+        except Exception as e:
+            logger.exception("Erro ao coletar '%s': %s", metrica.nome, e); continue
+        linhas.append(f"# HELP {metrica.nome} {metrica.ajuda}")
+        linhas.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+        linhas.extend(corpo)
+    return "\n".join(linhas) + "\n"
+
+# --- Métricas compartilhadas pelos módulos ---
+webhook_parse_segundos = Histograma("agente_webhook_parse_segundos", "Tempo para interpretar, deduplicar e enfileirar um POST do webhook.")
+webhook_mensagens_total = Contador("agente_webhook_mensagens_total", "Mensagens recebidas pelo webhook por resultado.", ("resultado",))
+job_processamento_segundos = Histograma("agente_job_processamento_segundos", "Tempo total de processamento de um job da fila.", ("resultado",))
+db_operacao_segundos = Histograma("agente_db_operacao_segundos", "Duração de cada função de database.py.", ("funcao",))
+gemini_segundos = Histograma("agente_gemini_segundos", "Duração de extrair_info_gemini por intenção e resultado.", ("intencao", "resultado"))
+intencao_origem_total = Contador("agente_intencao_origem_total", "Intenções resolvidas por origem (local, cache, gemini, degradado).", ("origem",))
+whatsapp_envio_segundos = Histograma("agente_whatsapp_envio_segundos", "Duração de enviar_mensagem_whatsapp (inclui retries).", ("resultado",))
+whatsapp_tentativas_total = Contador("agente_whatsapp_tentativas_total", "Requisições HTTP feitas à Graph API por status.", ("status",))
@@ -0,0 +1,158 @@
+import copy
+import json
+import logging
+import threading
+import time
+import uuid
+import config
+from conexoes_sqlite import GerenciadorConexoes
+
+logger = logging.getLogger(__name__)
+
+# --- Operações pendentes por usuário (ex.: gasto aguardando "sim/não/alterar") ---
+# Cada pendência é identificada por (wa_id, tipo), expira após um TTL e carrega uma versão (token aleatório)
+# trocada a cada escrita. As transições usam compare-and-swap: substituir/retirar só têm efeito se a versão
+# lida ainda for a atual, então uma confirmação e uma alteração concorrentes não se sobrescrevem.
+# Backends: "memoria" (testes, processo único) e "sqlite" (compartilhado entre processos e reinícios).
+
+class _ArmazemPendencias:
+    def __init__(self, ttl_segundos=None):
+        self.ttl_segundos = ttl_segundos or config.PENDENCIAS_TTL_SEGUNDOS
+        self._parar = threading.Event()
+        self._thread_varredura = None
+
+    @staticmethod
+    def _nova_versao():
+        return uuid.uuid4().hex
+
+    def iniciar_varredura(self, intervalo_segundos=None):
+        """Remove periodicamente as pendências expiradas numa thread em segundo plano."""
+        if self._thread_varredura is not None: return
+        intervalo = intervalo_segundos or config.PENDENCIAS_INTERVALO_VARREDURA_SEGUNDOS
+        def loop():
+            while not self._parar.wait(intervalo):
+                try:
+                    removidas = self.limpar_expiradas()
+                    if removidas: logger.info("%d pendência(s) expirada(s) removida(s).", removidas)
+                except Exception as e: logger.exception("Erro na varredura de pendências: %s", e)
+        self._parar.clear()
+        self._thread_varredura = threading.Thread(target=loop, name="pendencias-varredura", daemon=True)
+        self._thread_varredura.start()
+
+    def parar_varredura(self):
+        self._parar.set()
+        if self._thread_varredura is not None: self._thread_varredura.join(timeout=5)
+        self._thread_varredura = None
+
+class ArmazemPendenciasMemoria(_ArmazemPendencias):
+    def __init__(self, ttl_segundos=None):
+        super().__init__(ttl_segundos)
+        self._itens = {} # (wa_id, tipo) -> (dados, versao, expira_em)
+        self._lock = threading.Lock()
+
+    def obter(self, wa_id, tipo):
+        """Retorna (dados, versao) da pendência ativa ou None."""
+        with self._lock:
+            item = self._itens.get((wa_id, tipo))
+            if item is None or item[2] <= time.time(): return None
+            return copy.deepcopy(item[0]), item[1]
+
+    def definir(self, wa_id, tipo, dados, ttl_segundos=None):
+        """Cria ou substitui incondicionalmente a pendência. Retorna a nova versão."""
+        versao = self._nova_versao()
+        with self._lock: self._itens[(wa_id, tipo)] = (copy.deepcopy(dados), versao, time.time() + (ttl_segundos or self.ttl_segundos))
+        return versao
+
+    def substituir(self, wa_id, tipo, versao_esperada, dados):
+        """Compare-and-swap: grava os dados só se a versão atual for versao_esperada. Retorna a nova versão ou None."""
+        with self._lock:
+            item = self._itens.get((wa_id, tipo))
+            if item is None or item[1] != versao_esperada or item[2] <= time.time(): return None
+            versao = self._nova_versao()
+            self._itens[(wa_id, tipo)] = (copy.deepcopy(dados), versao, time.time() + self.ttl_segundos)
+            return versao
+
+    def retirar(self, wa_id, tipo, versao_esperada=None):
+        """Remove e retorna os dados da pendência ativa (se versao_esperada for dada, só se ainda for a atual)."""
+        with self._lock:
+            item = self._itens.get((wa_id, tipo))
+            if item is None or (versao_esperada is not None and item[1] != versao_esperada): return None
+            del self._itens[(wa_id, tipo)]
+            return item[0] if item[2] > time.time() else None
+
+    def limpar_expiradas(self):
+        agora = time.time()
+        with self._lock:
+            expiradas = [chave for chave, item in self._itens.items() if item[2] <= agora]
+            for chave in expiradas: del self._itens[chave]
+        return len(expiradas)
+
+class ArmazemPendenciasSQLite(_ArmazemPendencias):
+    def __init__(self, caminho_db, ttl_segundos=None):
+        super().__init__(ttl_segundos)
+        self.caminho_db = caminho_db
+        self._conexoes = GerenciadorConexoes(caminho_db, inicializar=self._criar_tabelas)
+
+    @staticmethod
+    def _criar_tabelas(conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS pendencias (
+                wa_id TEXT NOT NULL,
+                tipo TEXT NOT NULL,
+                dados TEXT NOT NULL,
+                versao TEXT NOT NULL,
+                expira_em REAL NOT NULL,
+                PRIMARY KEY (wa_id, tipo)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_pendencias_expira_em ON pendencias (expira_em)")
+
+    def obter(self, wa_id, tipo):
+        """Retorna (dados, versao) da pendência ativa ou None."""
+        row = self._conexoes.conexao().execute(
+            "SELECT dados, versao FROM pendencias WHERE wa_id = ? AND tipo = ? AND expira_em > ?", (wa_id, tipo, time.time())
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def definir(self, wa_id, tipo, dados, ttl_segundos=None):
+        """Cria ou substitui incondicionalmente a pendência. Retorna a nova versão."""
+        versao = self._nova_versao()
+        self._conexoes.conexao().execute(
+            "INSERT OR REPLACE INTO pendencias (wa_id, tipo, dados, versao, expira_em) VALUES (?, ?, ?, ?, ?)",
+            (wa_id, tipo, json.dumps(dados, ensure_ascii=False), versao, time.time() + (ttl_segundos or self.ttl_segundos))
+        )
+        return versao
+
+    def substituir(self, wa_id, tipo, versao_esperada, dados):
+        """Compare-and-swap: grava os dados só se a versão atual for versao_esperada. Retorna a nova versão ou None."""
+        versao = self._nova_versao(); agora = time.time()
+        cursor = self._conexoes.conexao().execute(
+            "UPDATE pendencias SET dados = ?, versao = ?, expira_em = ? WHERE wa_id = ? AND tipo = ? AND versao = ? AND expira_em > ?",
+            (json.dumps(dados, ensure_ascii=False), versao, agora + self.ttl_segundos, wa_id, tipo, versao_esperada, agora)
+        )
+        return versao if cursor.rowcount == 1 else None
+
+    def retirar(self, wa_id, tipo, versao_esperada=None):
+        """Remove e retorna os dados da pendência ativa (se versao_esperada for dada, só se ainda for a atual)."""
+        conn = self._conexoes.conexao()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT dados, versao, expira_em FROM pendencias WHERE wa_id = ? AND tipo = ?", (wa_id, tipo)).fetchone()
+            if row is None or (versao_esperada is not None and row[1] != versao_esperada):
+                conn.execute("COMMIT"); return None
+            conn.execute("DELETE FROM pendencias WHERE wa_id = ? AND tipo = ?", (wa_id, tipo))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction: conn.execute("ROLLBACK")
+            raise
+        return json.loads(row[0]) if row[2] > time.time() else None
+
+    def limpar_expiradas(self):
+        return self._conexoes.conexao().execute("DELETE FROM pendencias WHERE expira_em <= ?", (time.time(),)).rowcount
+
+def criar_armazem_pendencias(backend=None):
+    """Cria o armazém configurado em PENDENCIAS_BACKEND ("sqlite" ou "memoria")."""
+    backend = backend or config.PENDENCIAS_BACKEND
+    if backend == "memoria": return ArmazemPendenciasMemoria()
+    if backend == "sqlite": return ArmazemPendenciasSQLite(config.PENDENCIAS_DATABASE_FILENAME)
+    raise ValueError(f"PENDENCIAS_BACKEND desconhecido: {backend!r}")
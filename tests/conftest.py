@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import config
+
+# Os bancos dos testes ficam num diretório temporário, nunca nos arquivos do projeto
+_DIR_TESTES = tempfile.mkdtemp(prefix="agente_testes_")
+config.DATABASE_FILENAME = os.path.join(_DIR_TESTES, "meus_gastos.db")
+config.FILA_DATABASE_FILENAME = os.path.join(_DIR_TESTES, "fila_mensagens.db")
+config.CACHE_DATABASE_FILENAME = os.path.join(_DIR_TESTES, "cache_gemini.db")
+config.PENDENCIAS_DATABASE_FILENAME = os.path.join(_DIR_TESTES, "pendencias.db")
+config.ARQUIVO_DIRETORIO = os.path.join(_DIR_TESTES, "arquivo_gastos")
+
+def _instalar_google_falso():
+    """google-generativeai não é necessário nos testes (o Gemini nunca é chamado de verdade): sem o pacote,
+    gemini_handler, chatbot_logic e app importam estes tipos mínimos."""
+    import enum
+    import types
+    google = types.ModuleType("google"); genai = types.ModuleType("google.generativeai")
+    tipos = types.ModuleType("google.generativeai.types")
+    class FunctionDeclaration:
+        def __init__(self, name, description, parameters=None): self.name, self.description, self.parameters = name, description, parameters
+    class Tool:
+        def __init__(self, function_declarations): self.function_declarations = function_declarations
+    class GenerativeModel:
+        def __init__(self, *args, **kwargs): pass
+    tipos.HarmCategory = enum.Enum("HarmCategory", "HARM_CATEGORY_HARASSMENT HARM_CATEGORY_HATE_SPEECH HARM_CATEGORY_SEXUALLY_EXPLICIT HARM_CATEGORY_DANGEROUS_CONTENT")
+    tipos.HarmBlockThreshold = enum.Enum("HarmBlockThreshold", "BLOCK_NONE")
+    tipos.FunctionDeclaration, tipos.Tool = FunctionDeclaration, Tool
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel, genai.types = GenerativeModel, tipos
+    google.generativeai = genai
+    sys.modules.update({"google": google, "google.generativeai": genai, "google.generativeai.types": tipos})
+
+try:
+    import google.generativeai # noqa: F401
+except ImportError:
+    _instalar_google_falso()
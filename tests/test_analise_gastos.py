@@ -0,0 +1,28 @@
+import datetime
+import database
+from analise_gastos import ColunasGastos, analisar_gastos
+
+WA_ID = "5571"
+
+def _inserir(*gastos):
+    db = database.get_db(); database.criar_esquema(db)
+    db.executemany("INSERT INTO gastos (wa_id, descricao, valor, categoria, data_despesa) VALUES (?, ?, ?, ?, ?)",
+                   [(WA_ID,) + g for g in gastos])
+    db.commit(); database.notificar_alteracao_gastos(WA_ID)
+
+def test_data_fora_do_padrao_nao_quebra_a_analise():
+    # Gravada antes da normalização das datas: "2026-10-2" fica entre "2026-10-01" e "2026-10-31" na comparação de texto
+    _inserir(("uber", 600.0, "Transporte", "2026-10-2"), ("almoço", 50.0, "Alimentação", "2026-10-05"),
+             ("jantar", 30.0, "Alimentação", "2026-09-10"))
+    resultado = analisar_gastos(WA_ID, "2026-10-01", "2026-10-31", hoje=datetime.date(2026, 10, 31))
+    assert resultado["total"] == 50.0 and resultado["quantidade"] == 1
+    assert resultado["anterior"]["total"] == 30.0
+
+def test_gasto_confirmado_com_data_sem_zero_entra_na_analise():
+    database.confirmar_gasto_e_avaliar_orcamento(WA_ID, "táxi", 25, "Transporte", "2026-11-3") # Normalizada ao gravar
+    resultado = analisar_gastos(WA_ID, "2026-11-01", "2026-11-30", hoje=datetime.date(2026, 11, 30))
+    assert [c["categoria"] for c in resultado["categorias"]] == ["Transporte"] and resultado["total"] == 25.0
+
+def test_colunas_ignoram_datas_invalidas():
+    colunas = ColunasGastos([("2026-10-01", 10.0, "Outros", "a"), ("2026-13-40", 20.0, "Outros", "b"), (None, 5.0, None, "c")])
+    assert list(colunas.valores) == [10.0]
@@ -0,0 +1,14 @@
+import sqlite3
+import arquivamento
+import database
+
+def test_datas_fora_do_padrao_nao_interrompem_o_arquivamento(tmp_path):
+    db = sqlite3.connect(str(tmp_path / "gastos.db"))
+    database.criar_esquema(db)
+    db.executemany("INSERT INTO gastos (wa_id, descricao, valor, data_despesa, categoria) VALUES ('5511', ?, ?, ?, 'Outros')",
+                   [("antigo", 10.0, "2020-03-15"), ("formato do Gemini", 20.0, "15/03/2020"), ("recente", 30.0, "2999-01-01")])
+    db.commit()
+    movidos = arquivamento.arquivar_gastos(db, horizonte_meses=12, diretorio=str(tmp_path / "arquivo"))
+    assert movidos == {2020: 1}
+    restantes = {r[0] for r in db.execute("SELECT descricao FROM gastos")}
+    assert restantes == {"formato do Gemini", "recente"}
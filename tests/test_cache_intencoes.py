@@ -0,0 +1,14 @@
+from cache_intencoes import CacheIntencoes
+
+def test_resultados_com_data_nao_sao_guardados(tmp_path):
+    cache = CacheIntencoes(str(tmp_path / "cache.db"))
+    cache.armazenar("gastei 20 no uber ontem", "registrar_gasto", {"descricao": "uber", "valor": 20, "data": "2024-05-01"})
+    lote = {"gastos": [{"descricao": "uber", "valor": 20, "data": "2024-05-01"}, {"descricao": "mercado", "valor": 30}]}
+    cache.armazenar("gastei 20 no uber ontem e 30 no mercado", "registrar_gastos", lote)
+    assert cache.obter("gastei 20 no uber ontem") is None
+    assert cache.obter("gastei 20 no uber ontem e 30 no mercado") is None
+
+def test_valores_do_texto_preenchem_o_modelo(tmp_path):
+    cache = CacheIntencoes(str(tmp_path / "cache.db"))
+    cache.armazenar("gastei 50 no almoço", "registrar_gasto", {"descricao": "almoço", "valor": 50, "categoria": "Alimentação"})
+    assert cache.obter("gastei 70 no almoço") == ("registrar_gasto", {"descricao": "almoço", "valor": 70, "categoria": "Alimentação"})
@@ -0,0 +1,62 @@
+import sqlite3
+import pytest
+import database
+from cache_perfis import CachePerfis
+from conexoes_sqlite import GerenciadorConexoes
+
+WA_ID = "5541"
+
+@pytest.fixture
+def banco(tmp_path):
+    caminho = str(tmp_path / "gastos.db")
+    conexoes = GerenciadorConexoes(caminho, row_factory=sqlite3.Row, isolation_level="")
+    conn = conexoes.conexao()
+    database.criar_esquema(conn)
+    conn.execute("INSERT INTO usuarios (wa_id, renda_mensal) VALUES (?, 1000)", (WA_ID,)); conn.commit()
+    yield caminho, conexoes
+    conexoes.fechar_todas()
+
+def _ler(conn):
+    return dict(conn.execute("SELECT * FROM usuarios WHERE wa_id = ?", (WA_ID,)).fetchone())
+
+def _gravar_por_outro_processo(caminho, renda):
+    outro = sqlite3.connect(caminho)
+    outro.execute("UPDATE usuarios SET renda_mensal = ? WHERE wa_id = ?", (renda, WA_ID)); outro.commit(); outro.close()
+
+def test_escrita_de_outra_conexao_torna_o_perfil_obsoleto(banco):
+    caminho, conexoes = banco; conn = conexoes.conexao(); cache = CachePerfis(validar_versao=True)
+    cache.guardar(_ler(conn), conn)
+    assert cache.obter(WA_ID, conn)["renda_mensal"] == 1000
+    _gravar_por_outro_processo(caminho, 2000)
+    assert cache.obter(WA_ID, conn) is None # data_version mudou e a versao do perfil também
+    assert cache.contadores["obsoleto"] == 1
+
+def test_escrita_em_outro_usuario_nao_invalida(banco):
+    caminho, conexoes = banco; conn = conexoes.conexao(); cache = CachePerfis(validar_versao=True)
+    cache.guardar(_ler(conn), conn)
+    outro = sqlite3.connect(caminho)
+    outro.execute("INSERT INTO usuarios (wa_id) VALUES ('5542')"); outro.commit(); outro.close()
+    assert cache.obter(WA_ID, conn)["renda_mensal"] == 1000 # data_version mudou, mas a versao confere
+
+def test_versao_e_incrementada_a_cada_update(banco):
+    caminho, conexoes = banco; conn = conexoes.conexao()
+    antes = _ler(conn)["versao"]
+    _gravar_por_outro_processo(caminho, 1500); _gravar_por_outro_processo(caminho, 1600)
+    assert _ler(conn)["versao"] == antes + 2
+
+def test_validacao_e_por_conexao_nao_por_thread(banco, tmp_path):
+    # A mesma thread troca de conexão (pool): o data_version de uma conexão não vale para a outra
+    caminho, conexoes = banco; conn = conexoes.conexao(); cache = CachePerfis(validar_versao=True)
+    cache.guardar(_ler(conn), conn)
+    assert cache.obter(WA_ID, conn) is not None
+    _gravar_por_outro_processo(caminho, 2000)
+    outras = GerenciadorConexoes(caminho, row_factory=sqlite3.Row, isolation_level="")
+    assert cache.obter(WA_ID, outras.conexao()) is None # Conexão nova, com o data_version inicial
+    outras.fechar_todas()
+
+def test_escrita_pela_propria_conexao_invalida_pelo_decorator():
+    database.criar_esquema(database.get_db())
+    database.get_or_create_user(WA_ID, "Teste")
+    assert database.get_user_profile(WA_ID) is not None
+    database.update_user_monthly_income(WA_ID, 4321)
+    assert database.get_user_profile(WA_ID)["renda_mensal"] == 4321
@@ -0,0 +1,55 @@
+import pytest
+import chatbot_logic
+import database
+from categorias import cache_correcoes, categoria_aprendida, categorizar, registrar_correcao
+
+@pytest.mark.parametrize("descricao, categoria", [
+    ("Ônibus", "Transporte"),
+    ("onibus pro centro", "Transporte"),
+    ("CAFÉ da manhã", "Alimentação"),
+    ("Farmacia", "Saúde"),
+    ("lanches", "Alimentação"), # Plural
+    ("bares", "Lazer"),
+    ("barbearia", "Outros"), # "bar" só como palavra inteira
+    ("pedido 199", "Outros"), # "99" não casa dentro de outro número
+    ("99 pro aeroporto", "Transporte"),
+    ("almoço no bar", "Alimentação"), # Palavras de categorias diferentes: vale a ordem do mapa
+    ("", "Outros"),
+])
+def test_categoria_por_palavras_chave(descricao, categoria):
+    assert categorizar(descricao) == categoria
+
+@pytest.fixture
+def wa_id():
+    db = database.get_db(); database.criar_esquema(db)
+    db.execute("DELETE FROM categorias_usuario WHERE wa_id = '5581'"); db.commit()
+    cache_correcoes.invalidar("5581")
+    return "5581"
+
+def test_correcao_do_usuario_vale_antes_das_palavras_chave(wa_id):
+    assert registrar_correcao(wa_id, "Bar do Zé", "Alimentação")
+    assert categorizar("bar do ze", wa_id) == "Alimentação" # Mesma descrição normalizada
+    assert categorizar("cerveja no bar do zé", wa_id) == "Alimentação" # Descrição que contém a corrigida
+    assert categorizar("bar do zé") == "Lazer" # Sem wa_id (ou outro usuário): palavras-chave
+    assert categorizar("bar do zé", "5582") == "Lazer"
+
+def _pedir_alteracao_de_categoria(wa_id):
+    return chatbot_logic.gerar_resposta_do_chatbot(
+        "solicitar_alteracao_gasto", {"campo_a_alterar": "categoria", "novo_valor_texto": "alimentacao"},
+        "alterar categoria para alimentacao", wa_id, {"onboarding_complete": True, "wa_id": wa_id})
+
+def test_correcao_so_e_aprendida_se_a_alteracao_foi_gravada(wa_id, monkeypatch):
+    gasto = {"descricao": "bar do zé", "valor": 30.0, "categoria": "Lazer", "data_para_salvar": "2026-10-18"}
+    chatbot_logic.pendencias.definir(wa_id, chatbot_logic.PENDENCIA_GASTO, gasto)
+    obter = chatbot_logic.pendencias.obter
+    def obter_e_outro_worker_altera(wa, tipo):
+        dados, versao = obter(wa, tipo)
+        chatbot_logic.pendencias.substituir(wa, tipo, versao, dict(dados, valor=35.0))
+        return dados, versao
+    monkeypatch.setattr(chatbot_logic.pendencias, "obter", obter_e_outro_worker_altera)
+    assert "acabou de ser" in _pedir_alteracao_de_categoria(wa_id)
+    assert categoria_aprendida(wa_id, "bar do zé") is None
+    monkeypatch.undo()
+    assert "Ok, alterado" in _pedir_alteracao_de_categoria(wa_id)
+    assert categoria_aprendida(wa_id, "bar do zé") == "Alimentação"
+    chatbot_logic.pendencias.retirar(wa_id, chatbot_logic.PENDENCIA_GASTO)
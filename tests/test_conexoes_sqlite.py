@@ -0,0 +1,56 @@
+import gc
+import threading
+import pytest
+from conexoes_sqlite import GerenciadorConexoes
+
+@pytest.fixture
+def gerenciador(tmp_path):
+    aberturas = []
+    g = GerenciadorConexoes(str(tmp_path / "teste.db"), inicializar=aberturas.append, max_ociosas=2)
+    g.aberturas = aberturas
+    yield g
+    g.fechar_todas()
+
+def _em_thread(funcao):
+    """Roda funcao numa thread nova (como o servidor faz a cada requisição) e devolve o resultado."""
+    resultado = []
+    t = threading.Thread(target=lambda: resultado.append(funcao()))
+    t.start(); t.join()
+    del t; gc.collect() # A thread terminou: a conexão dela volta ao pool
+    return resultado[0]
+
+def test_requisicoes_seguidas_em_threads_novas_reaproveitam_a_conexao(gerenciador):
+    primeira = _em_thread(gerenciador.conexao)
+    segunda = _em_thread(gerenciador.conexao)
+    assert primeira is segunda
+    assert len(gerenciador.aberturas) == 1 # PRAGMAs e inicializar só na primeira abertura
+
+def test_devolver_libera_a_conexao_para_outra_thread(gerenciador):
+    conn = gerenciador.conexao()
+    assert gerenciador.conexao() is conn # Mesma conexão na mesma thread até devolver
+    gerenciador.devolver()
+    assert gerenciador.conexao_se_aberta() is None
+    assert _em_thread(gerenciador.conexao) is conn
+
+def test_transacao_aberta_e_desfeita_ao_devolver(gerenciador):
+    conn = gerenciador.conexao()
+    conn.execute("CREATE TABLE t (x)")
+    conn.execute("BEGIN"); conn.execute("INSERT INTO t VALUES (1)")
+    gerenciador.devolver()
+    assert not conn.in_transaction
+    assert gerenciador.conexao().execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+
+def test_pool_guarda_no_maximo_max_ociosas(gerenciador):
+    pegas = threading.Barrier(4); fim = threading.Event(); conexoes = []
+    def usar():
+        conexoes.append(gerenciador.conexao()); pegas.wait(); fim.wait()
+    threads = [threading.Thread(target=usar) for _ in range(3)]
+    for t in threads: t.start()
+    pegas.wait() # Três threads simultâneas: três conexões
+    assert len({id(c) for c in conexoes}) == 3
+    fim.set()
+    for t in threads: t.join()
+    del threads, t; gc.collect()
+    assert len(gerenciador._ociosas) == 2 # A terceira foi fechada
+    assert _em_thread(gerenciador.conexao) in conexoes
+    assert len(gerenciador.aberturas) == 3
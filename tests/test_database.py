@@ -0,0 +1,109 @@
+import sqlite3
+import threading
+import pytest
+import database
+
+def _inserir(db, *gastos):
+    db.executemany("""INSERT INTO gastos (wa_id, descricao, valor, data_despesa, categoria, data_registro_sistema)
+                      VALUES ('5511', ?, ?, ?, ?, '2026-09-30 10:00:00')""", gastos)
+    db.commit()
+
+def _resumo(db):
+    return {(r[1], r[2]): (r[3], r[4]) for r in db.execute("SELECT * FROM gastos_resumo_mensal WHERE wa_id = '5511'")}
+
+@pytest.fixture
+def db(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "gastos.db"))
+    database.criar_esquema(conn)
+    yield conn
+    conn.close()
+
+def test_migracoes_sao_aplicadas_uma_vez(db):
+    assert db.execute("PRAGMA user_version").fetchone()[0] == len(database.MIGRACOES)
+    database.criar_esquema(db) # Rodar de novo não reaplica nada
+    assert db.execute("PRAGMA user_version").fetchone()[0] == len(database.MIGRACOES)
+
+def test_migracao_de_banco_antigo_normaliza_datas_e_mes_ref(tmp_path, monkeypatch):
+    db = sqlite3.connect(str(tmp_path / "antigo.db"))
+    monkeypatch.setattr(database, "MIGRACOES", database.MIGRACOES[:7]) # Banco criado antes da migração 8
+    database.criar_esquema(db)
+    _inserir(db, ("a", 10.0, "2026-10-2", "Outros"), ("b", 20.0, "02/10/2026", "Outros"), ("c", 30.0, "sem data", "Outros"), ("d", 5.0, None, "Outros"))
+    assert ("02/10/2", "Outros") in _resumo(db) # Chave de mês inválida gerada pelo substr antigo
+    monkeypatch.undo()
+    database.aplicar_migracoes(db)
+    datas = dict(db.execute("SELECT descricao, data_despesa FROM gastos"))
+    assert datas == {"a": "2026-10-02", "b": "2026-10-02", "c": "sem data", "d": None}
+    meses = dict(db.execute("SELECT descricao, mes_ref FROM gastos"))
+    assert meses == {"a": "2026-10", "b": "2026-10", "c": "2026-09", "d": "2026-09"} # Sem data válida: mês do registro
+    assert _resumo(db) == {("2026-10", "Outros"): (30.0, 2), ("2026-09", "Outros"): (35.0, 2)}
+    assert database.verificar_resumo_mensal(db) == []
+
+def test_triggers_mantem_o_resumo_mensal(db):
+    _inserir(db, ("almoço", 50.0, "2026-10-02", "Alimentação"), ("uber", 20.0, "2026-10-03", "Transporte"))
+    assert _resumo(db) == {("2026-10", "Alimentação"): (50.0, 1), ("2026-10", "Transporte"): (20.0, 1)}
+    db.execute("UPDATE gastos SET valor = 25, data_despesa = '2026-11-01' WHERE descricao = 'uber'")
+    db.execute("UPDATE gastos SET categoria = 'Lazer' WHERE descricao = 'almoço'")
+    db.commit()
+    assert _resumo(db) == {("2026-10", "Lazer"): (50.0, 1), ("2026-11", "Transporte"): (25.0, 1)}
+    db.execute("DELETE FROM gastos WHERE descricao = 'almoço'"); db.commit()
+    assert _resumo(db) == {("2026-11", "Transporte"): (25.0, 1)}
+    assert database.verificar_resumo_mensal(db) == []
+
+def test_verificar_aponta_divergencia_e_reconstruir_corrige(db):
+    _inserir(db, ("almoço", 50.0, "2026-10-02", "Alimentação"), ("jantar", 30.0, "2026-10-02", "Alimentação"))
+    db.execute("UPDATE gastos_resumo_mensal SET total = 1, quantidade = 1"); db.commit()
+    db.execute("INSERT INTO gastos_resumo_mensal VALUES ('5511', '2020-01', 'Outros', 9, 1)"); db.commit()
+    divergencias = database.verificar_resumo_mensal(db)
+    assert [d[0] for d in divergencias] == [("5511", "2020-01", "Outros"), ("5511", "2026-10", "Alimentação")]
+    assert divergencias[1][1:] == ((80.0, 2), (1.0, 1))
+    assert database.reconstruir_resumo_mensal(db) == 1
+    assert database.verificar_resumo_mensal(db) == []
+
+def test_data_fora_do_padrao_e_normalizada_ao_confirmar():
+    database.criar_esquema(database.get_db())
+    database.confirmar_gasto_e_avaliar_orcamento("5599", "uber", 60, "Transporte", "2026-10-2")
+    database.confirmar_gasto_e_avaliar_orcamento("5599", "táxi", 40, "Transporte", "ontem à noite")
+    linhas = database.get_db().execute("SELECT data_despesa, mes_ref FROM gastos WHERE wa_id = '5599' ORDER BY id").fetchall()
+    assert tuple(linhas[0]) == ("2026-10-02", "2026-10")
+    mes_registro = database.get_db().execute("SELECT strftime('%Y-%m', 'now')").fetchone()[0]
+    assert linhas[1]["data_despesa"] is None and linhas[1]["mes_ref"] == mes_registro # Data inválida: mês do registro
+
+@pytest.fixture
+def usuario_com_renda():
+    db = database.get_db()
+    database.criar_esquema(db)
+    wa_id = "5577"
+    db.execute("DELETE FROM gastos WHERE wa_id = ?", (wa_id,)); db.execute("DELETE FROM usuarios WHERE wa_id = ?", (wa_id,))
+    db.execute("INSERT INTO usuarios (wa_id, renda_mensal, onboarding_complete) VALUES (?, 1000, TRUE)", (wa_id,)); db.commit()
+    return wa_id
+
+def test_confirmar_insere_e_avanca_o_aviso_de_orcamento(usuario_com_renda):
+    wa_id = usuario_com_renda
+    assert database.confirmar_gasto_e_avaliar_orcamento(wa_id, "aluguel", 600, "Moradia")["limiar_avisado"] == 60
+    assert database.get_user_profile(wa_id)["ultimo_aviso_orcamento"] == 60
+    resultado = database.confirmar_gasto_e_avaliar_orcamento(wa_id, "café", 10, "Alimentação")
+    assert resultado["limiar_avisado"] is None and resultado["total_mes"] == 610 # Mesmo limiar: não avisa de novo
+    assert database.confirmar_gasto_e_avaliar_orcamento(wa_id, "mercado", 400, "Alimentação")["limiar_avisado"] == 100
+
+def test_falha_ao_avancar_o_aviso_desfaz_o_gasto(usuario_com_renda):
+    wa_id = usuario_com_renda; db = database.get_db()
+    db.execute("""CREATE TEMP TRIGGER falha_aviso AFTER UPDATE OF ultimo_aviso_orcamento ON usuarios
+                  BEGIN SELECT RAISE(ABORT, 'falha simulada'); END""")
+    try:
+        assert database.confirmar_gasto_e_avaliar_orcamento(wa_id, "aluguel", 600, "Moradia") is None
+    finally:
+        db.execute("DROP TRIGGER temp.falha_aviso")
+    assert db.execute("SELECT COUNT(*) FROM gastos WHERE wa_id = ?", (wa_id,)).fetchone()[0] == 0
+    assert database.get_user_profile(wa_id)["ultimo_aviso_orcamento"] == 0
+    assert database.calcular_total_gastos_mes_atual(wa_id) == 0
+
+def test_confirmacoes_simultaneas_avisam_uma_vez(usuario_com_renda):
+    wa_id = usuario_com_renda; inicio = threading.Barrier(4); resultados = []
+    def confirmar():
+        inicio.wait()
+        resultados.append(database.confirmar_gasto_e_avaliar_orcamento(wa_id, "compra", 200, "Outros"))
+    threads = [threading.Thread(target=confirmar) for _ in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert sorted(r["total_mes"] for r in resultados) == [200, 400, 600, 800]
+    assert sorted(filter(None, (r["limiar_avisado"] for r in resultados))) == [60, 80] # 20% e 40% não são limiares; 60% e 80% avisam uma vez cada
@@ -0,0 +1,33 @@
+import time
+import pytest
+from disjuntor import Disjuntor, ABERTO, FECHADO, MEIO_ABERTO
+
+@pytest.fixture
+def disjuntor():
+    return Disjuntor("teste", janela_segundos=60, min_chamadas=4, limiar_erros=0.5, limiar_lentas=0.5,
+                     latencia_lenta_segundos=1.0, aberto_segundos=0.1, sondas=1)
+
+def test_abaixo_do_minimo_de_chamadas_nao_abre(disjuntor):
+    for _ in range(3): disjuntor.registrar(False, 0.1)
+    assert disjuntor.estado == FECHADO and disjuntor.permitir()
+
+def test_erros_abrem_e_sonda_bem_sucedida_fecha(disjuntor):
+    for sucesso in (True, False, True, False): disjuntor.registrar(sucesso, 0.1)
+    assert disjuntor.estado == ABERTO and not disjuntor.permitir()
+    time.sleep(0.15)
+    assert disjuntor.estado == MEIO_ABERTO
+    assert disjuntor.permitir()
+    assert not disjuntor.permitir() # Só uma sonda por vez
+    disjuntor.registrar(True, 0.1)
+    assert disjuntor.estado == FECHADO and disjuntor.permitir()
+
+def test_sonda_com_falha_reabre(disjuntor):
+    for _ in range(4): disjuntor.registrar(False, 0.1)
+    time.sleep(0.15)
+    assert disjuntor.permitir()
+    disjuntor.registrar(True, 2.0) # Sonda lenta também conta como falha
+    assert disjuntor.estado == ABERTO
+
+def test_chamadas_lentas_abrem(disjuntor):
+    for _ in range(4): disjuntor.registrar(True, 1.5)
+    assert disjuntor.estado == ABERTO
@@ -0,0 +1,35 @@
+import random
+import threading
+import time
+import pytest
+from executor_usuarios import ExecutorPorUsuario
+
+@pytest.fixture
+def executor():
+    executor = ExecutorPorUsuario(4)
+    yield executor
+    executor.desligar()
+
+def test_tarefas_do_mesmo_usuario_rodam_em_ordem(executor):
+    ordem = {}; lock = threading.Lock()
+    def tarefa(wa_id, i):
+        time.sleep(random.uniform(0, 0.002))
+        with lock: ordem.setdefault(wa_id, []).append(i)
+    futuros = [executor.submeter(f"55119{u}", tarefa, f"55119{u}", i) for i in range(50) for u in range(8)]
+    for f in futuros: f.result(timeout=10)
+    assert all(sequencia == list(range(50)) for sequencia in ordem.values())
+    assert len(ordem) == 8
+
+def test_usuarios_em_shards_diferentes_rodam_em_paralelo(executor):
+    a = "5511900000000"
+    b = next(f"55119{i:08d}" for i in range(1000) if executor.indice_shard(f"55119{i:08d}") != executor.indice_shard(a))
+    inicio = time.monotonic()
+    futuros = [executor.submeter(chave, time.sleep, 0.2) for chave in (a, b)]
+    for f in futuros: f.result(timeout=5)
+    assert time.monotonic() - inicio < 0.35
+
+def test_excecao_vai_para_o_future_e_o_shard_continua(executor):
+    def falhar(): raise RuntimeError("erro da tarefa")
+    with pytest.raises(RuntimeError):
+        executor.submeter("5511", falhar).result(timeout=5)
+    assert executor.submeter("5511", lambda: "ok").result(timeout=5) == "ok"
@@ -0,0 +1,102 @@
+import time
+import pytest
+from fila_mensagens import FalhaPermanente, FilaMensagens, STATUS_FALHOU, STATUS_PENDENTE
+
+@pytest.fixture
+def fila(tmp_path):
+    return FilaMensagens(str(tmp_path / "fila.db"), max_tentativas=3, backoff_base=0.05, backoff_max=0.1, lease_segundos=0.2,
+                         janela_coalescencia=0, max_coalescer=1)
+
+def test_so_o_job_mais_antigo_de_cada_usuario_e_elegivel(fila):
+    primeiro = fila.enfileirar("5511", {"texto": "gastei 50 no almoço"})
+    fila.enfileirar("5511", {"texto": "sim"})
+    outro = fila.enfileirar("5521", {"texto": "oi"})
+    assert fila.reservar_proximo()["id"] == primeiro
+    assert fila.reservar_proximo()["id"] == outro # O "sim" espera o job anterior do mesmo usuário
+    assert fila.reservar_proximo() is None
+    fila.concluir(primeiro)
+    assert fila.reservar_proximo()["payload"]["texto"] == "sim"
+
+def test_lease_expirado_devolve_o_job(fila):
+    fila.enfileirar("5511", {"texto": "oi"})
+    job = fila.reservar_proximo()
+    assert fila.reservar_proximo() is None
+    time.sleep(0.25) # O worker "morreu" sem concluir nem falhar
+    retomado = fila.reservar_proximo()
+    assert retomado["id"] == job["id"] and retomado["tentativas"] == 2
+
+def test_falha_reagenda_com_backoff_e_depois_vai_para_dead_letter(fila):
+    fila.enfileirar("5511", {"texto": "oi"})
+    for tentativa in range(1, 4):
+        job = fila.reservar_proximo()
+        while job is None: # Esperando o backoff da falha anterior
+            time.sleep(0.01); job = fila.reservar_proximo()
+        assert job["tentativas"] == tentativa
+        fila.falhar(job, RuntimeError("Graph API fora"))
+        if tentativa < 3:
+            assert fila.contar_por_status()[STATUS_PENDENTE] == 1
+            assert fila.reservar_proximo() is None # Ainda no backoff
+    assert fila.contar_por_status()[STATUS_FALHOU] == 1
+    assert fila.reprocessar_falhas() == 1
+    assert fila.reservar_proximo()["tentativas"] == 1
+
+def test_falha_permanente_vai_direto_para_dead_letter(fila):
+    fila.enfileirar("5511", {"texto": "oi"})
+    job = fila.reservar_proximo()
+    fila.falhar(job, FalhaPermanente("Meta recusou"))
+    assert fila.contar_por_status()[STATUS_FALHOU] == 1
+    assert fila.reservar_proximo() is None
+
+def test_mensagem_isolada_fica_disponivel_sem_espera(fila):
+    fila.enfileirar("5511", {"texto": "gastei 50 no almoço"})
+    assert fila.reservar_proximo()["payload"]["texto"] == "gastei 50 no almoço"
+
+def test_mensagens_acumuladas_sao_unidas_ate_a_primeira_que_nao_pode(tmp_path):
+    separadas = {"sim"}
+    fila = FilaMensagens(str(tmp_path / "fila.db"), janela_coalescencia=0,
+                         pode_coalescer=lambda wa_id, payload: payload["texto"] not in separadas)
+    for texto in ("gastei 50", "no almoço", "sim", "20 uber"):
+        fila.enfileirar("5511", {"texto": texto})
+    job = fila.coalescer(fila.reservar_proximo())
+    assert job["payload"]["texto"] == "gastei 50 no almoço"
+    fila.concluir(job["id"])
+    job = fila.coalescer(fila.reservar_proximo())
+    assert job["payload"]["texto"] == "sim" # Não absorve nem é absorvida
+    fila.concluir(job["id"])
+    assert fila.coalescer(fila.reservar_proximo())["payload"]["texto"] == "20 uber"
+
+def test_decisao_usa_o_estado_de_quando_o_job_comeca(tmp_path):
+    estado = {"gasto_pendente": False}
+    fila = FilaMensagens(str(tmp_path / "fila.db"), janela_coalescencia=0,
+                         pode_coalescer=lambda wa_id, payload: not estado["gasto_pendente"])
+    for texto in ("gastei 50 no almoço", "sim", "obrigado"):
+        fila.enfileirar("5511", {"texto": texto})
+    estado["gasto_pendente"] = True # O primeiro job deixou um gasto aguardando confirmação
+    job = fila.coalescer(fila.reservar_proximo())
+    assert job["payload"]["texto"] == "gastei 50 no almoço"
+    fila.concluir(job["id"])
+    assert fila.coalescer(fila.reservar_proximo())["payload"]["texto"] == "sim"
+
+def test_webhook_nao_avalia_coalescencia(tmp_path):
+    chamadas = []
+    def pode_coalescer(wa_id, payload):
+        chamadas.append(payload["texto"]); return True
+    ligada = FilaMensagens(str(tmp_path / "ligada.db"), janela_coalescencia=0, pode_coalescer=pode_coalescer)
+    desligada = FilaMensagens(str(tmp_path / "desligada.db"), janela_coalescencia=0, max_coalescer=1, pode_coalescer=pode_coalescer)
+    for fila in (ligada, desligada):
+        fila.enfileirar("5511", {"texto": "gastei 50"}); fila.enfileirar("5511", {"texto": "no almoço"})
+    assert chamadas == [] # Nada é consultado ao enfileirar
+    assert desligada.coalescer(desligada.reservar_proximo())["payload"]["texto"] == "gastei 50"
+    assert chamadas == [] # Nem no worker, com a coalescência desligada
+    assert ligada.coalescer(ligada.reservar_proximo())["payload"]["texto"] == "gastei 50 no almoço"
+    assert chamadas == ["gastei 50", "no almoço"]
+
+def test_job_unido_e_reprocessado_inteiro_no_retry(tmp_path):
+    fila = FilaMensagens(str(tmp_path / "fila.db"), janela_coalescencia=0, backoff_base=0.01, backoff_max=0.01)
+    fila.enfileirar("5511", {"texto": "gastei 50"}); fila.enfileirar("5511", {"texto": "no almoço"})
+    job = fila.coalescer(fila.reservar_proximo())
+    fila.falhar(job, RuntimeError("Gemini fora"))
+    time.sleep(0.02)
+    retry = fila.reservar_proximo()
+    assert fila.coalescer(retry)["payload"]["texto"] == "gastei 50 no almoço"
+    assert sum(fila.contar_por_status().values()) == 1
@@ -0,0 +1,15 @@
+import asyncio
+from gemini_async import ClienteAsync
+
+def test_duracao_nao_inclui_espera_pela_vaga():
+    cliente = ClienteAsync("teste", concorrencia=1, hedging=False)
+    async def requisicao():
+        await asyncio.sleep(0.1); return "ok"
+    try:
+        futuros = [cliente.submeter(cliente.executar(requisicao)) for _ in range(4)]
+        resultados = [f.result(timeout=5) for f in futuros]
+    finally:
+        cliente.fechar()
+    assert [r for r, _ in resultados] == ["ok"] * 4
+    # A última esperou ~0,3s na fila do semáforo, mas a requisição em si levou ~0,1s
+    assert all(0.09 <= segundos < 0.2 for _, segundos in resultados)
@@ -0,0 +1,77 @@
+import pytest
+import chatbot_logic
+import gemini_handler
+from cache_intencoes import CacheIntencoes
+
+TEXTO = "quero juntar dinheiro para uma viagem" # Não resolvido pelo extrator local: vai ao cache/Gemini
+
+@pytest.fixture
+def gemini_falso(tmp_path, monkeypatch):
+    """Troca o cache por um vazio e o Gemini por uma função que conta as chamadas."""
+    chamadas = []
+    def extrair(texto_usuario, contexto=None):
+        chamadas.append(gemini_handler.nomes_ferramentas(contexto))
+        return "avaliar_objetivo_financeiro", {"objetivo": "viagem"}, "funcao"
+    monkeypatch.setattr(gemini_handler, "cache_intencoes", CacheIntencoes(str(tmp_path / "cache.db")))
+    monkeypatch.setattr(gemini_handler, "_extrair_info_gemini", extrair)
+    monkeypatch.setattr(gemini_handler, "MODO_OTIMIZADO", True)
+    return chamadas
+
+def test_variante_depende_do_conjunto_de_ferramentas(monkeypatch):
+    monkeypatch.setattr(gemini_handler, "MODO_OTIMIZADO", True)
+    variante = gemini_handler.variante_cache
+    assert variante({}) == variante({"listagem": False}) # Mesmas ferramentas, mesma chave
+    assert len({variante({}), variante({"gasto_pendente": True}), variante({"onboarding": True}), variante(None)}) == 4
+    monkeypatch.setattr(gemini_handler, "MODO_OTIMIZADO", False)
+    assert variante({"gasto_pendente": True}) == "" # Modo completo: sempre todas as ferramentas
+
+def test_cache_reaproveita_so_no_mesmo_conjunto_de_ferramentas(gemini_falso):
+    assert gemini_handler.extrair_intencao(TEXTO, {})[0] == "avaliar_objetivo_financeiro"
+    gemini_handler.extrair_intencao(TEXTO, {})
+    assert len(gemini_falso) == 1 # A segunda veio do cache
+    gemini_handler.extrair_intencao(TEXTO, {"gasto_pendente": True})
+    gemini_handler.extrair_intencao(TEXTO, {"onboarding": True})
+    assert len(gemini_falso) == 3 # Ferramentas diferentes não reaproveitam a entrada
+    assert len(set(gemini_falso)) == 3
+
+def test_contexto_so_e_calculado_quando_o_extrator_local_nao_resolve(gemini_falso):
+    calculados = []
+    def contexto():
+        calculados.append(1); return {}
+    assert gemini_handler.extrair_intencao("sim", contexto)[0] == "confirmar_operacao"
+    assert calculados == []
+    gemini_handler.extrair_intencao(TEXTO, contexto)
+    assert calculados == [1]
+
+@pytest.fixture
+def otimizado(monkeypatch):
+    monkeypatch.setattr(gemini_handler, "MODO_OTIMIZADO", True)
+    return gemini_handler.nomes_ferramentas
+
+def test_onboarding_so_oferece_o_objetivo(otimizado):
+    assert otimizado({"onboarding": True, "gasto_pendente": True}) == ("avaliar_objetivo_financeiro",)
+
+@pytest.mark.parametrize("contexto, incluidas, excluidas", [
+    ({}, {"registrar_gasto"}, {*gemini_handler.FERRAMENTAS_PENDENCIA, "ver_mais_gastos", "avaliar_objetivo_financeiro"}),
+    ({"gasto_pendente": True}, set(gemini_handler.FERRAMENTAS_PENDENCIA), {"ver_mais_gastos", "avaliar_objetivo_financeiro"}),
+    ({"listagem": True}, {"ver_mais_gastos"}, set(gemini_handler.FERRAMENTAS_PENDENCIA)),
+    ({"gasto_pendente": True, "listagem": True}, {*gemini_handler.FERRAMENTAS_PENDENCIA, "ver_mais_gastos"}, {"avaliar_objetivo_financeiro"}),
+])
+def test_ferramentas_por_estado_da_conversa(otimizado, contexto, incluidas, excluidas):
+    nomes = set(otimizado(contexto))
+    assert incluidas <= nomes and not nomes & excluidas
+    assert nomes <= set(gemini_handler.DECLARACOES)
+
+def test_sem_contexto_ou_no_modo_completo_vao_todas(otimizado, monkeypatch):
+    assert otimizado(None) == tuple(gemini_handler.DECLARACOES)
+    assert gemini_handler.ferramentas_para(None) is gemini_handler.ferramentas_gemini
+    assert gemini_handler.ferramentas_para({}) is not gemini_handler.ferramentas_gemini
+    monkeypatch.setattr(gemini_handler, "MODO_OTIMIZADO", False)
+    assert otimizado({"onboarding": True}) == tuple(gemini_handler.DECLARACOES)
+
+def test_contexto_gemini_reflete_as_pendencias():
+    wa_id = "5591"
+    assert chatbot_logic.contexto_gemini(wa_id) == {"gasto_pendente": False, "listagem": False}
+    chatbot_logic.pendencias.definir(wa_id, chatbot_logic.PENDENCIA_GASTO, {"descricao": "almoço", "valor": 30.0})
+    assert chatbot_logic.contexto_gemini(wa_id) == {"gasto_pendente": True, "listagem": False}
+    chatbot_logic.pendencias.retirar(wa_id, chatbot_logic.PENDENCIA_GASTO)
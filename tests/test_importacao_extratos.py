@@ -0,0 +1,33 @@
+import io
+import sqlite3
+import pytest
+import database
+from importacao_extratos import ler_csv, importar_extrato
+
+CSV = """data;descricao;valor
+01/03/2024;Padaria Pão Quente;-12,50
+01/03/2024;Padaria Pão Quente;-12,50
+02/03/2024;Salário;3000,00
+03/03/2024;Posto Shell;-150,00
+"""
+
+@pytest.fixture
+def db(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "gastos.db"))
+    database.criar_esquema(conn)
+    yield conn
+    conn.close()
+
+def _importar(db, texto):
+    return importar_extrato(db, "5511", ler_csv(io.StringIO(texto)), categorizar=lambda descricao: "Outros")
+
+def test_repeticoes_no_arquivo_e_reimportacao_sao_deduplicadas(db):
+    primeira = _importar(db, CSV)
+    assert (primeira["importadas"], primeira["duplicadas"], primeira["ignoradas"]) == (2, 1, 1) # Crédito ignorado
+    segunda = _importar(db, CSV)
+    assert (segunda["importadas"], segunda["duplicadas"]) == (0, 3)
+    assert db.execute("SELECT COUNT(*) FROM gastos").fetchone()[0] == 2
+
+def test_descricao_com_acentos_e_caixa_diferentes_conta_como_duplicata(db):
+    _importar(db, CSV)
+    assert _importar(db, "data;descricao;valor\n2024-03-01;PADARIA PAO QUENTE;-12,50\n")["duplicadas"] == 1
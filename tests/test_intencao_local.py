@@ -0,0 +1,43 @@
+import pytest
+from intencao_local import extrair_info_local, interpretar_degradado
+
+@pytest.mark.parametrize("texto, intencao, entidades", [
+    ("sim", "confirmar_operacao", {}),
+    ("Cancela!", "cancelar_operacao", {}),
+    ("gastei 50 reais no almoço ontem", "registrar_gasto", {"descricao": "almoço", "valor": 50.0}),
+    ("paguei o almoço 50", "registrar_gasto", {"descricao": "almoço", "valor": 50.0}),
+    ("50 almoço", "registrar_gasto", {"descricao": "almoço", "valor": 50.0}),
+    ("30 reais de uber", "registrar_gasto", {"descricao": "uber", "valor": 30.0}),
+    ("listar 5 gastos", "listar_gastos", {"limite": 5}),
+    ("quanto gastei este mês", "resumo_gastos", {"periodo": "este mes"}),
+])
+def test_caminho_rapido_resolve(texto, intencao, entidades):
+    obtida, args = extrair_info_local(texto)
+    assert obtida == intencao
+    assert {chave: args.get(chave) for chave in entidades} == entidades
+
+@pytest.mark.parametrize("texto", [
+    "10 minutos atrasado", # Número seguido de palavras não é gasto
+    "30 reais de pizza", # Dinheiro, mas descrição desconhecida: o Gemini decide
+    "2 mil no aluguel",
+    "listar 100 gastos",
+    "quero 2",
+    "não sei quanto foi",
+])
+def test_caminho_rapido_deixa_para_o_gemini(texto):
+    assert extrair_info_local(texto) == (None, {})
+
+@pytest.mark.parametrize("texto, intencao, valor", [
+    ("30 reais de pizza", "registrar_gasto", 30.0),
+    ("r$ 20 pizza", "registrar_gasto", 20.0),
+    ("hoje o almoço deu 45 reais", "registrar_gasto", 45.0),
+    ("gastei 45 naquele lugar", "registrar_gasto", 45.0),
+    ("sim, pode mandar", "confirmar_operacao", None),
+])
+def test_modo_degradado_aceita(texto, intencao, valor):
+    obtida, args = interpretar_degradado(texto)
+    assert obtida == intencao and args.get("valor") == valor
+
+@pytest.mark.parametrize("texto", ["10 minutos atrasado", "listar 100 gastos", "quero 2", "não sei, 3 talvez", "50 e 20 no uber"])
+def test_modo_degradado_recusa_numero_solto(texto):
+    assert interpretar_degradado(texto) == (None, {})
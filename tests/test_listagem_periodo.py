@@ -0,0 +1,68 @@
+import datetime
+import pytest
+import database
+from texto_utils import parsear_periodo
+
+HOJE = datetime.date(2026, 10, 18) # Domingo
+WA_ID = "5561"
+
+@pytest.mark.parametrize("texto, periodo", [
+    ("hoje", ("2026-10-18", "2026-10-18")),
+    ("ontem", ("2026-10-17", "2026-10-17")),
+    ("esta semana", ("2026-10-12", "2026-10-18")),
+    ("semana passada", ("2026-10-05", "2026-10-11")),
+    ("este mês", ("2026-10-01", "2026-10-18")),
+    ("no mês passado", ("2026-09-01", "2026-09-30")),
+    ("último ano", ("2025-01-01", "2025-12-31")),
+    ("últimos 7 dias", ("2026-10-12", "2026-10-18")),
+    ("maio", ("2026-05-01", "2026-05-31")),
+    ("dezembro", ("2025-12-01", "2025-12-31")), # Mês que ainda não chegou: o do ano passado
+    ("fevereiro de 2024", ("2024-02-01", "2024-02-29")),
+    ("de 01/05 a 15/05", ("2026-05-01", "2026-05-15")),
+    ("entre 10/06/2024 e 01/05/2024", ("2024-05-01", "2024-06-10")), # Invertido: fica em ordem
+    ("10/05", ("2026-05-10", "2026-05-10")),
+])
+def test_parsear_periodo(texto, periodo):
+    assert parsear_periodo(texto, HOJE) == periodo
+
+@pytest.mark.parametrize("texto", ["", "semana que vem", "31/02", "de 01/05 a 31/02", "amanhã"])
+def test_periodo_nao_reconhecido(texto):
+    assert parsear_periodo(texto, HOJE) is None
+
+@pytest.fixture
+def gastos():
+    db = database.get_db(); database.criar_esquema(db)
+    db.execute("DELETE FROM gastos WHERE wa_id = ?", (WA_ID,))
+    datas = ["2026-10-01", "2026-10-05", "2026-10-05", "2026-10-05", "2026-10-09", "2026-10-12", "2026-11-01"]
+    db.executemany("INSERT INTO gastos (wa_id, descricao, valor, categoria, data_despesa) VALUES (?, ?, 10, 'Outros', ?)",
+                   [(WA_ID, f"gasto {i}", data) for i, data in enumerate(datas)])
+    db.commit()
+    return datas
+
+def _paginas(limite, **periodo):
+    paginas = []; apos = None
+    while True:
+        pagina = database.buscar_gastos_do_banco(WA_ID, limite, apos=apos, **periodo)
+        paginas.append(pagina)
+        if not pagina: return paginas
+        apos = database.cursor_listagem(pagina[-1])
+
+def test_paginas_do_periodo_cobrem_tudo_sem_repetir_nos_empates(gastos):
+    paginas = _paginas(2, inicio="2026-10-01", fim="2026-10-31")
+    assert [len(p) for p in paginas] == [2, 2, 2, 0] # A última página vazia encerra a listagem
+    itens = [g for p in paginas for g in p]
+    chaves = [(g["data_efetiva"], g["id"]) for g in itens]
+    assert chaves == sorted(chaves, reverse=True) and len(set(chaves)) == 6 # Empates em 05/10 desempatados pelo id
+    assert sum(g["data_efetiva"] == "2026-10-05" for g in itens) == 3
+
+def test_ultima_pagina_incompleta(gastos):
+    assert [len(p) for p in _paginas(4, inicio="2026-10-01", fim="2026-10-31")] == [4, 2, 0]
+
+def test_periodo_sem_gastos(gastos):
+    assert database.buscar_gastos_do_banco(WA_ID, 5, inicio="2026-01-01", fim="2026-01-31") == []
+
+def test_listagem_sem_periodo_pagina_por_id(gastos):
+    paginas = _paginas(3)
+    ids = [g["id"] for p in paginas for g in p]
+    assert [len(p) for p in paginas] == [3, 3, 1, 0]
+    assert ids == sorted(ids, reverse=True) and len(ids) == len(gastos)
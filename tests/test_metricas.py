@@ -0,0 +1,17 @@
+import gc
+import threading
+import metricas
+
+def test_shards_de_threads_encerradas_sao_incorporados():
+    contador = metricas.Contador("teste_threads_total", "Teste.", ("rotulo",))
+    histograma = metricas.Histograma("teste_threads_segundos", "Teste.")
+    def trabalhar():
+        contador.inc(rotulo="a"); histograma.observar(0.01)
+    for _ in range(200):
+        t = threading.Thread(target=trabalhar); t.start(); t.join()
+    del t; gc.collect()
+    assert len(contador._shards) <= 1 and len(histograma._shards) <= 1
+    assert contador.valores() == {("a",): 200}
+    assert histograma.agregado()[()][2] == 200
+    contador.inc(rotulo="a") # Shard da thread atual, que continua viva
+    assert contador.valores() == {("a",): 201}
@@ -0,0 +1,30 @@
+import time
+import pytest
+from pendencias import ArmazemPendenciasMemoria, ArmazemPendenciasSQLite
+
+@pytest.fixture(params=["memoria", "sqlite"])
+def armazem(request, tmp_path):
+    if request.param == "memoria": return ArmazemPendenciasMemoria(ttl_segundos=60)
+    return ArmazemPendenciasSQLite(str(tmp_path / "pendencias.db"), ttl_segundos=60)
+
+def test_substituir_so_com_a_versao_atual(armazem):
+    versao = armazem.definir("5511", "gasto", {"valor": 50})
+    nova = armazem.substituir("5511", "gasto", versao, {"valor": 60})
+    assert nova is not None and nova != versao
+    assert armazem.substituir("5511", "gasto", versao, {"valor": 70}) is None # Outro worker já alterou
+    assert armazem.obter("5511", "gasto") == ({"valor": 60}, nova)
+
+def test_retirar_com_versao_antiga_nao_remove(armazem):
+    versao = armazem.definir("5511", "gasto", {"valor": 50})
+    atual = armazem.substituir("5511", "gasto", versao, {"valor": 60})
+    assert armazem.retirar("5511", "gasto", versao) is None
+    assert armazem.retirar("5511", "gasto", atual) == {"valor": 60}
+    assert armazem.obter("5511", "gasto") is None
+    assert armazem.retirar("5511", "gasto") is None # Confirmação repetida não acha mais nada
+
+def test_pendencia_expirada_nao_vale(armazem):
+    versao = armazem.definir("5511", "gasto", {"valor": 50}, ttl_segundos=0.05)
+    time.sleep(0.1)
+    assert armazem.obter("5511", "gasto") is None
+    assert armazem.substituir("5511", "gasto", versao, {"valor": 60}) is None
+    assert armazem.limpar_expiradas() == 1
@@ -0,0 +1,42 @@
+import sqlite3
+import arquivamento
+import config
+import database
+import manutencao
+
+WA_ID = "5531"
+
+def test_total_do_mes_e_resumo_por_categoria_vem_do_resumo_mensal():
+    database.criar_esquema(database.get_db())
+    hoje = database.mes_referencia() + "-01"
+    for descricao, valor, categoria, data in [("almoço", 50, "Alimentação", hoje), ("uber", 20, "Transporte", hoje),
+                                              ("jantar", 35.5, "Alimentação", hoje), ("cinema", 99, "Lazer", "2020-01-10")]:
+        database.confirmar_gasto_e_avaliar_orcamento(WA_ID, descricao, valor, categoria, data)
+    assert database.calcular_total_gastos_mes_atual(WA_ID) == 105.5 # O cinema é de outro mês
+    assert database.resumo_categorias_mes(WA_ID) == [{"categoria": "Alimentação", "total": 85.5, "quantidade": 2},
+                                                     {"categoria": "Transporte", "total": 20.0, "quantidade": 1}]
+    assert database.resumo_categorias_mes(WA_ID, "2020-01") == [{"categoria": "Lazer", "total": 99.0, "quantidade": 1}]
+
+def test_comando_resumos_verifica_e_reconstroi(capsys):
+    database.criar_esquema(database.get_db())
+    database.confirmar_gasto_e_avaliar_orcamento(WA_ID, "mercado", 80, "Alimentação", "2026-03-02")
+    assert manutencao.main(["resumos", "verificar"]) == 0
+    db = database.get_db()
+    db.execute("UPDATE gastos_resumo_mensal SET total = total + 1 WHERE wa_id = ? AND mes_ref = '2026-03'", (WA_ID,)); db.commit()
+    assert manutencao.main(["resumos", "verificar"]) == 1
+    assert f"DIVERGÊNCIA {WA_ID} 2026-03 'Alimentação'" in capsys.readouterr().out
+    assert manutencao.main(["resumos", "reconstruir"]) == 0
+    assert database.resumo_categorias_mes(WA_ID, "2026-03") == [{"categoria": "Alimentação", "total": 80.0, "quantidade": 1}]
+
+def test_meses_arquivados_continuam_no_resumo(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "ARQUIVO_DIRETORIO", str(tmp_path / "arquivo"))
+    db = sqlite3.connect(str(tmp_path / "gastos.db"))
+    database.criar_esquema(db)
+    db.executemany("INSERT INTO gastos (wa_id, descricao, valor, data_despesa, categoria) VALUES (?, ?, ?, ?, 'Outros')",
+                   [(WA_ID, "antigo", 10.0, "2020-03-15"), (WA_ID, "recente", 30.0, "2999-01-01")])
+    db.commit()
+    assert arquivamento.arquivar_gastos(db, horizonte_meses=12) == {2020: 1}
+    resumo = {r[0]: r[1] for r in db.execute("SELECT mes_ref, total FROM gastos_resumo_mensal WHERE wa_id = ?", (WA_ID,))}
+    assert resumo == {"2020-03": 10.0, "2999-01": 30.0}
+    assert database.verificar_resumo_mensal(db) == [] # Conta os gastos dos arquivos anuais
+    assert database.reconstruir_resumo_mensal(db) == 2
@@ -0,0 +1,72 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import config
+from whatsapp_utils import EnvioRecusado, WhatsAppSender
+
+class StubGraphAPI:
+    """Servidor local no lugar da Graph API: responde com a lista de (status, cabeçalhos) e depois 200."""
+    def __init__(self, respostas=()):
+        self.respostas = list(respostas); self.recebidas = []
+        stub = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                corpo = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.recebidas.append((self.path, self.headers.get("Authorization"), corpo))
+                status, cabecalhos = stub.respostas.pop(0) if stub.respostas else (200, {})
+                dados = {"messages": [{"id": "wamid.teste"}]} if status == 200 else {"error": {"code": status}}
+                self.send_response(status)
+                for nome, valor in cabecalhos.items(): self.send_header(nome, valor)
+                self.send_header("Content-Type", "application/json"); self.end_headers()
+                self.wfile.write(json.dumps(dados).encode())
+            def log_message(self, *args): pass
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.servidor.server_address[1]}"
+
+    def fechar(self):
+        self.servidor.shutdown(); self.servidor.server_close()
+
+@pytest.fixture
+def graph(monkeypatch):
+    stub = StubGraphAPI()
+    monkeypatch.setattr(config, "WHATSAPP_GRAPH_API_BASE_URL", stub.url)
+    monkeypatch.setattr(config, "WHATSAPP_BACKOFF_BASE_SEGUNDOS", 0.01)
+    monkeypatch.setattr(config, "WHATSAPP_BACKOFF_MAX_SEGUNDOS", 1)
+    yield stub
+    stub.fechar()
+
+def _enviador():
+    return WhatsAppSender(access_token="token-teste", phone_number_id="123", max_tentativas=3, timeout=2)
+
+def test_envio_bem_sucedido(graph):
+    assert _enviador().send("5511999999999", "olá") is True
+    caminho, autorizacao, corpo = graph.recebidas[0]
+    assert caminho == f"/{config.WHATSAPP_GRAPH_API_VERSION}/123/messages"
+    assert autorizacao == "Bearer token-teste"
+    assert corpo["to"] == "5511999999999" and corpo["text"]["body"] == "olá"
+
+def test_429_e_5xx_sao_repetidos(graph):
+    graph.respostas = [(429, {"Retry-After": "0"}), (503, {})]
+    assert _enviador().send("5511999999999", "olá") is True
+    assert len(graph.recebidas) == 3
+
+def test_retry_after_acima_do_teto_desiste_sem_esperar(graph):
+    graph.respostas = [(429, {"Retry-After": "3600"})]
+    inicio = time.monotonic()
+    assert _enviador().send("5511999999999", "olá") is False
+    assert time.monotonic() - inicio < 1
+    assert len(graph.recebidas) == 1
+
+def test_4xx_permanente_levanta_envio_recusado(graph):
+    graph.respostas = [(400, {})]
+    with pytest.raises(EnvioRecusado):
+        _enviador().send("5511999999999", "olá")
+    assert len(graph.recebidas) == 1
+
+def test_esgota_tentativas(graph):
+    graph.respostas = [(500, {})] * 3
+    assert _enviador().send("5511999999999", "olá") is False
+    assert len(graph.recebidas) == 3
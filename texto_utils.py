@@ -0,0 +1,140 @@
+import datetime
+import re
+import unicodedata
+
+# --- Utilitários de texto em português (acentos, valores e datas) ---
+
+def _dobrar_caractere(ch):
+    base = unicodedata.normalize('NFKD', ch.lower())[:1]
+    return base if base else ch
+
+class _TabelaDobra(dict):
+    # Tabela para str.translate preenchida sob demanda: cada caractere é decomposto uma única vez
+    def __missing__(self, codigo):
+        self[codigo] = base = _dobrar_caractere(chr(codigo))
+        return base
+
+_TABELA_DOBRA = _TabelaDobra()
+
+def remover_acentos(texto):
+    """Minúsculas sem acentos, preservando o comprimento (o índice i do resultado corresponde ao caractere i do original)."""
+    if texto.isascii(): return texto.lower() # Caso mais comum, sem passar pela tabela
+    return texto.translate(_TABELA_DOBRA)
+
+def normalizar_texto(texto):
+    """Minúsculas, sem acentos e com espaços colapsados. Usado como chave de comparação."""
+    return ' '.join(remover_acentos(texto).split())
+
+# Valor monetário: "50", "50,90", "1.234,56", "R$ 12.5"
+PADRAO_VALOR = r'(?:r\$\s*)?(\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?|\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?|\d+(?:[.,]\d{1,2})?)'
+RE_VALOR = re.compile(r'^\s*' + PADRAO_VALOR + r'\s*(?:reais|real|conto|contos|pila|pilas)?\s*$')
+
+def parsear_valor(texto):
+    """Converte um valor em formato brasileiro ou americano para float. Retorna None se não for um valor."""
+    if texto is None: return None
+    m = RE_VALOR.match(remover_acentos(str(texto)))
+    if not m: return None
+    numero = m.group(1)
+    if ',' in numero and '.' in numero:
+        # O último separador é o decimal
+        if numero.rfind(',') > numero.rfind('.'): numero = numero.replace('.', '').replace(',', '.')
+        else: numero = numero.replace(',', '')
+    elif ',' in numero:
+        inteiro, _, fracao = numero.rpartition(',')
+        numero = numero.replace(',', '.') if len(fracao) <= 2 and ',' not in inteiro else numero.replace(',', '')
+    elif numero.count('.') > 1 or re.fullmatch(r'\d{1,3}\.\d{3}', numero):
+        numero = numero.replace('.', '') # "1.234" é milhar no Brasil
+    try: return float(numero)
+    except ValueError: return None
+
+# Data gravada em gastos.data_despesa: "2026-10-02", "2026-10-2", "2026-10-02T13:00:00" ou "02/10/2026"
+RE_DATA_GRAVADA = re.compile(r'^\s*(?:(\d{4})-(\d{1,2})-(\d{1,2})(?:[T ].*)?|(\d{1,2})/(\d{1,2})/(\d{4}))\s*$')
+
+def normalizar_data_iso(texto):
+    """Data absoluta em 'YYYY-MM-DD' (o formato das colunas de data e dos filtros por período). Retorna None se
+    não for uma data válida."""
+    m = RE_DATA_GRAVADA.match(texto or '')
+    if not m: return None
+    ano, mes, dia = m.group(1, 2, 3) if m.group(1) else (m.group(6), m.group(5), m.group(4))
+    try: return datetime.date(int(ano), int(mes), int(dia)).isoformat()
+    except ValueError: return None
+
+# Datas: "hoje", "ontem", "anteontem", "dia 10", "10/05", "10/05/2024"
+PADRAO_DATA = r'(hoje|ontem|anteontem|(?:(?:no\s+)?dia\s+)?\d{1,2}/\d{1,2}(?:/\d{2,4})?|(?:no\s+)?dia\s+\d{1,2})'
+RE_DATA = re.compile(r'^\s*' + PADRAO_DATA + r'\s*$')
+
+def parsear_data(texto, hoje=None):
+    """Converte expressões de data comuns em 'YYYY-MM-DD'. Retorna None se não reconhecer."""
+    hoje = hoje or datetime.date.today()
+    m = RE_DATA.match(remover_acentos(texto or ''))
+    if not m: return None
+    expr = m.group(1)
+    if expr == 'hoje': return hoje.isoformat()
+    if expr == 'ontem': return (hoje - datetime.timedelta(days=1)).isoformat()
+    if expr == 'anteontem': return (hoje - datetime.timedelta(days=2)).isoformat()
+    partes = [int(p) for p in re.findall(r'\d+', expr)]
+    try:
+        if len(partes) == 1: # "dia 10": mês atual, ou o anterior se o dia ainda não chegou
+            data = hoje.replace(day=partes[0])
+            if data > hoje:
+                mes_anterior = hoje.replace(day=1) - datetime.timedelta(days=1)
+                data = mes_anterior.replace(day=partes[0])
+            return data.isoformat()
+        dia, mes = partes[0], partes[1]
+        ano = partes[2] if len(partes) == 3 else hoje.year
+        if ano < 100: ano += 2000
+        data = datetime.date(ano, mes, dia)
+        if len(partes) == 2 and data > hoje: data = data.replace(year=ano - 1) # "25/12" dito em janeiro
+        return data.isoformat()
+    except ValueError:
+        return None
+
+# Períodos: "hoje", "esta semana", "semana passada", "este mês", "mês passado", "este ano", "últimos 7 dias",
+# "maio", "maio de 2024", "10/05", "de 01/05 a 15/05", "entre 01/05/2024 e 10/06/2024"
+MESES = {"janeiro": 1, "fevereiro": 2, "marco": 3, "abril": 4, "maio": 5, "junho": 6, "julho": 7,
+         "agosto": 8, "setembro": 9, "outubro": 10, "novembro": 11, "dezembro": 12}
+_PREFIXO_PERIODO = r'^(?:(?:de|do|da|dos|das|desta|deste|dessa|desse|nesta|neste|nessa|nesse|no|na|nos|nas|em|durante)\s+)?'
+RE_PERIODO_INTERVALO = re.compile(_PREFIXO_PERIODO + r'(?:entre\s+)?' + PADRAO_DATA + r'\s+(?:a|ate|e|-)\s+' + PADRAO_DATA + r'$')
+RE_PERIODO_ULTIMOS_DIAS = re.compile(_PREFIXO_PERIODO + r'(?:os\s+)?ultimos\s+(\d{1,3})\s+dias$')
+RE_PERIODO_MES_NOME = re.compile(_PREFIXO_PERIODO + r'(' + '|'.join(MESES) + r')(?:\s+(?:de\s+)?(\d{4}))?$')
+RE_PERIODO_RELATIVO = re.compile(_PREFIXO_PERIODO + r'(?:(?:a|o|esta|este|essa|esse)\s+)?'
+                                 r'(semana|mes|ano)(?:\s+(atual|passad[oa]))?$|^(?:(?:na|no|da|do)\s+)?ultim[oa]\s+(semana|mes|ano)$')
+
+def _fim_do_mes(data):
+    return (data.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)
+
+def parsear_periodo(texto, hoje=None):
+    """Converte um período em (inicio, fim) no formato 'YYYY-MM-DD', ambos inclusivos. Retorna None se não reconhecer."""
+    hoje = hoje or datetime.date.today()
+    expr = ' '.join(remover_acentos(texto or '').split())
+    if not expr: return None
+    m = RE_PERIODO_INTERVALO.match(expr)
+    if m:
+        inicio, fim = parsear_data(m.group(1), hoje), parsear_data(m.group(2), hoje)
+        if not inicio or not fim: return None
+        return (inicio, fim) if inicio <= fim else (fim, inicio)
+    m = RE_PERIODO_ULTIMOS_DIAS.match(expr)
+    if m: return (hoje - datetime.timedelta(days=max(1, int(m.group(1))) - 1)).isoformat(), hoje.isoformat()
+    m = RE_PERIODO_MES_NOME.match(expr)
+    if m:
+        mes = MESES[m.group(1)]
+        ano = int(m.group(2)) if m.group(2) else (hoje.year if mes <= hoje.month else hoje.year - 1)
+        inicio = datetime.date(ano, mes, 1)
+        return inicio.isoformat(), _fim_do_mes(inicio).isoformat()
+    m = RE_PERIODO_RELATIVO.match(expr)
+    if m:
+        unidade = m.group(1) or m.group(3)
+        passado = bool(m.group(3)) or (m.group(2) or '').startswith('passad')
+        if unidade == 'semana':
+            inicio = hoje - datetime.timedelta(days=hoje.weekday()) # Segunda-feira
+            if passado: return (inicio - datetime.timedelta(days=7)).isoformat(), (inicio - datetime.timedelta(days=1)).isoformat()
+            return inicio.isoformat(), hoje.isoformat()
+        if unidade == 'mes':
+            if passado:
+                fim = hoje.replace(day=1) - datetime.timedelta(days=1)
+                return fim.replace(day=1).isoformat(), fim.isoformat()
+            return hoje.replace(day=1).isoformat(), hoje.isoformat()
+        if passado: return datetime.date(hoje.year - 1, 1, 1).isoformat(), datetime.date(hoje.year - 1, 12, 31).isoformat()
+        return datetime.date(hoje.year, 1, 1).isoformat(), hoje.isoformat()
+    data = parsear_data(re.sub(_PREFIXO_PERIODO, '', expr), hoje) # "hoje", "ontem", "10/05"
+    return (data, data) if data else None
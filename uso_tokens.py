@@ -0,0 +1,67 @@
+import logging
+import threading
+from collections import OrderedDict
+import config
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# --- Contabilidade de tokens do Gemini ---
+# Cada resposta traz usage_metadata (tokens do prompt, que incluem instruções e declarações das ferramentas,
+# e tokens gerados). Os totais por intenção e modo de requisição vão para /metrics; por usuário ficam em
+# memória (só os mais recentes, para limitar a memória). A média de tokens de prompt por chamada em cada modo
+# ("completo" = preâmbulo + todas as ferramentas, "otimizado" = system_instruction + ferramentas do estado)
+# mostra a economia quando os dois modos foram usados (ex.: alternando GEMINI_MODO_REQUISICAO).
+
+tokens_total = metricas.Contador("agente_gemini_tokens_total", "Tokens das chamadas ao Gemini por tipo (prompt, resposta), intenção e modo da requisição.", ("tipo", "intencao", "modo"))
+
+def tokens_da_resposta(response):
+    """(tokens do prompt, tokens gerados) do usage_metadata da resposta, ou (0, 0) se ela não trouxer."""
+    uso = getattr(response, "usage_metadata", None)
+    if uso is None: return 0, 0
+    return int(getattr(uso, "prompt_token_count", 0) or 0), int(getattr(uso, "candidates_token_count", 0) or 0)
+
+class UsoTokens:
+    def __init__(self, max_usuarios=None):
+        self.max_usuarios = max_usuarios or config.USO_TOKENS_MAX_USUARIOS
+        self._por_usuario = OrderedDict() # wa_id -> [chamadas, tokens_prompt, tokens_resposta]; sai o menos recente
+        self._por_modo = {} # modo -> [chamadas, tokens_prompt, tokens_resposta]
+        self._lock = threading.Lock()
+
+    def registrar(self, wa_id, intencao, modo, tokens_prompt, tokens_resposta):
+        intencao = intencao or "nenhuma"
+        tokens_total.inc(tokens_prompt, tipo="prompt", intencao=intencao, modo=modo)
+        tokens_total.inc(tokens_resposta, tipo="resposta", intencao=intencao, modo=modo)
+        with self._lock:
+            for acumulado in (self._por_modo.setdefault(modo, [0, 0, 0]), self._usuario(wa_id or "-")):
+                acumulado[0] += 1; acumulado[1] += tokens_prompt; acumulado[2] += tokens_resposta
+        logger.debug("Tokens Gemini (%s, %s): prompt=%d resposta=%d", modo, intencao, tokens_prompt, tokens_resposta)
+
+    def _usuario(self, wa_id):
+        acumulado = self._por_usuario.pop(wa_id, None) or [0, 0, 0]
+        self._por_usuario[wa_id] = acumulado
+        while len(self._por_usuario) > self.max_usuarios: self._por_usuario.popitem(last=False)
+        return acumulado
+
+    def prompt_medio(self):
+        """{modo: tokens de prompt por chamada}."""
+        with self._lock: return {modo: p / n for modo, (n, p, _) in self._por_modo.items() if n}
+
+    def estatisticas(self, top_usuarios=10):
+        with self._lock:
+            por_modo = {modo: {"chamadas": n, "tokens_prompt": p, "tokens_resposta": r, "prompt_medio": p / n if n else 0.0}
+                        for modo, (n, p, r) in self._por_modo.items()}
+            usuarios = sorted(self._por_usuario.items(), key=lambda item: -(item[1][1] + item[1][2]))[:top_usuarios]
+        por_intencao = {}
+        for (tipo, intencao, _), valor in tokens_total.valores().items():
+            por_intencao.setdefault(intencao, {"prompt": 0, "resposta": 0})[tipo] += valor
+        completo = por_modo.get("completo", {}).get("prompt_medio"); otimizado = por_modo.get("otimizado", {}).get("prompt_medio")
+        return {
+            "por_modo": por_modo,
+            "por_intencao": por_intencao,
+            "maiores_usuarios": [{"wa_id": w, "chamadas": n, "tokens_prompt": p, "tokens_resposta": r} for w, (n, p, r) in usuarios],
+            "economia_prompt_percentual": (1 - otimizado / completo) * 100 if completo and otimizado is not None else None,
+        }
+
+uso_tokens = UsoTokens()
+metricas.Gauge("agente_gemini_tokens_prompt_medio", "Tokens de prompt por chamada ao Gemini em cada modo de requisição.", uso_tokens.prompt_medio, ("modo",))
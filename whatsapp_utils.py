@@ -1,31 +1,171 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
-import json
+from requests.adapters import HTTPAdapter
 import config # Importa as configurações
+import metricas
+from log_config import log_payload
 
-def enviar_mensagem_whatsapp(numero_destino, mensagem_texto):
-    print(f"DEBUG WA_UTILS: Entrou em enviar_mensagem_whatsapp para {numero_destino}")
-    if not config.WHATSAPP_ACCESS_TOKEN or not config.WHATSAPP_PHONE_NUMBER_ID:
-        print(f"ERRO WA_UTILS: WHATSAPP_TOKEN ou WHATSAPP_PHONE_NUMBER_ID não configurados.")
-        print(f"DEBUG WA_UTILS: Token='{config.WHATSAPP_ACCESS_TOKEN}', PhoneID='{config.WHATSAPP_PHONE_NUMBER_ID}'")
+logger = logging.getLogger(__name__)
+
+# --- Envio de mensagens pela WhatsApp Cloud API ---
+# Uma única sessão HTTP com keep-alive é compartilhada (sem handshake TLS por resposta), respostas 429/5xx
+# são repetidas com backoff exponencial + jitter respeitando Retry-After, e um token bucket por
+# WHATSAPP_PHONE_NUMBER_ID segura o ritmo abaixo do limite de vazão da Meta. Um Retry-After maior que
+# WHATSAPP_BACKOFF_MAX_SEGUNDOS encerra as tentativas (o job volta para a fila com o backoff dela) em vez de
+# segurar o worker além do lease do job.
+
+STATUS_REPETIVEIS = {429, 500, 502, 503, 504}
+
+class EnvioRecusado(Exception):
+    """A Graph API recusou a mensagem de forma definitiva (4xx não repetível): tentar de novo não adianta."""
+
+class TokenBucket:
+    """Limitador de taxa: até `capacidade` envios em rajada, reabastecido a `taxa` tokens por segundo."""
+    def __init__(self, taxa, capacidade=None):
+        self.taxa = float(taxa)
+        self.capacidade = float(capacidade or taxa)
+        self._tokens = self.capacidade
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def adquirir(self, timeout=None):
+        """Bloqueia até haver um token. Retorna False se o timeout estourar antes."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa)
+                self._ultimo = agora
+                if self._tokens >= 1:
+                    self._tokens -= 1; return True
+                espera = (1 - self._tokens) / self.taxa
+            if limite is not None and time.monotonic() + espera > limite: return False
+            time.sleep(espera)
+
+def _segundos_retry_after(valor):
+    """Interpreta o cabeçalho Retry-After (segundos ou data HTTP)."""
+    if not valor: return None
+    try: return max(0.0, float(valor))
+    except ValueError: pass
+    try: return max(0.0, email.utils.parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError): return None
+
+class WhatsAppSender:
+    def __init__(self, access_token=None, phone_number_id=None, base_url=None, api_version=None,
+                 max_tentativas=None, timeout=None, taxa_por_segundo=None, tamanho_pool=None, workers_async=None):
+        self.access_token = access_token or config.WHATSAPP_ACCESS_TOKEN
+        self.phone_number_id = phone_number_id or config.WHATSAPP_PHONE_NUMBER_ID
+        self.base_url = (base_url or config.WHATSAPP_GRAPH_API_BASE_URL).rstrip('/')
+        self.api_version = api_version or config.WHATSAPP_GRAPH_API_VERSION
+        self.max_tentativas = max_tentativas or config.WHATSAPP_MAX_TENTATIVAS
+        self.timeout = timeout or config.WHATSAPP_TIMEOUT_SEGUNDOS
+        self.taxa_por_segundo = taxa_por_segundo or config.WHATSAPP_MENSAGENS_POR_SEGUNDO
+        tamanho_pool = tamanho_pool or config.WHATSAPP_TAMANHO_POOL
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=tamanho_pool, max_retries=0) # Retry é feito aqui, com backoff próprio
+        self.session.mount("https://", adapter); self.session.mount("http://", adapter)
+        self.session.headers.update({"Authorization": f"Bearer {self.access_token}", "Content-Type": "application/json"})
+
+        self._limitadores = {} # phone_number_id -> TokenBucket
+        self._lock_limitadores = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers_async or tamanho_pool, thread_name_prefix="whatsapp-envio")
+
+    def _limitador(self, phone_number_id):
+        with self._lock_limitadores:
+            bucket = self._limitadores.get(phone_number_id)
+            if bucket is None:
+                bucket = self._limitadores[phone_number_id] = TokenBucket(self.taxa_por_segundo)
+            return bucket
+
+    def _backoff(self, tentativa, retry_after=None):
+        """Segundos até a próxima tentativa, ou None se o Retry-After pedir mais que WHATSAPP_BACKOFF_MAX_SEGUNDOS."""
+        if retry_after is not None: return retry_after if retry_after <= config.WHATSAPP_BACKOFF_MAX_SEGUNDOS else None
+        teto = min(config.WHATSAPP_BACKOFF_MAX_SEGUNDOS, config.WHATSAPP_BACKOFF_BASE_SEGUNDOS * (2 ** (tentativa - 1)))
+        return random.uniform(0, teto) # Jitter completo
+
+    def send(self, numero_destino, mensagem_texto):
+        """Envia uma mensagem de texto. Retorna True se a Meta devolveu o id da mensagem e False em falhas
+        temporárias (vale tentar mais tarde); levanta EnvioRecusado se a Meta recusar a mensagem (4xx)."""
+        if not self.access_token or not self.phone_number_id:
+            logger.error("WHATSAPP_TOKEN ou WHATSAPP_PHONE_NUMBER_ID não configurados.")
+            return False
+
+        url = f"{self.base_url}/{self.api_version}/{self.phone_number_id}/messages"
+        payload = {"messaging_product": "whatsapp", "to": numero_destino, "type": "text", "text": {"body": mensagem_texto}}
+        logger.debug("Enviando para URL: %s", url)
+        log_payload(logger, "Payload enviado à Graph API", payload)
+
+        for tentativa in range(1, self.max_tentativas + 1):
+            self._limitador(self.phone_number_id).adquirir()
+            retry_after = None
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout)
+                metricas.whatsapp_tentativas_total.inc(status=str(response.status_code))
+                logger.debug("Status Code da Meta: %s (tentativa %d)", response.status_code, tentativa)
+                if response.status_code in STATUS_REPETIVEIS:
+                    retry_after = _segundos_retry_after(response.headers.get("Retry-After"))
+                    erro = f"HTTP {response.status_code}: {response.text[:300]}"
+                else:
+                    response.raise_for_status()
+                    response_data = response.json()
+                    if response_data.get("messages") and response_data["messages"][0].get("id"):
+                        logger.info("Mensagem enviada OK para %s. ID: %s", numero_destino, response_data['messages'][0]['id'])
+                        log_payload(logger, "Resposta API WhatsApp", response_data)
+                        return True
+                    logger.error("Resposta inesperada API WhatsApp: %s", response_data); return False
+            except requests.exceptions.HTTPError as http_err: # 4xx não repetível (token inválido, número inválido...)
+                detalhes = http_err.response.text[:300] if http_err.response is not None else 'Sem detalhes'
+                logger.error("Erro HTTP enviando para %s: %s. Detalhes erro API: %s", numero_destino, http_err, detalhes)
+                raise EnvioRecusado(f"{http_err}: {detalhes}") from http_err
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                metricas.whatsapp_tentativas_total.inc(status=type(e).__name__)
+                erro = f"{type(e).__name__}: {e}"
+            except Exception as e:
+                logger.exception("Outro erro em enviar_mensagem_whatsapp: %s", e); return False
+
+            if tentativa < self.max_tentativas:
+                espera = self._backoff(tentativa, retry_after)
+                if espera is None:
+                    logger.error("Erro enviando para %s: Retry-After de %.0fs passa de %ss; desistindo por ora (%s).",
+                                 numero_destino, retry_after, config.WHATSAPP_BACKOFF_MAX_SEGUNDOS, erro)
+                    return False
+                logger.warning("Falha temporária enviando para %s (%s). Nova tentativa em %.2fs.", numero_destino, erro, espera)
+                time.sleep(espera)
+            else:
+                logger.error("Erro enviando para %s após %d tentativas: %s", numero_destino, tentativa, erro)
         return False
 
-    url = f"https://graph.facebook.com/{config.WHATSAPP_GRAPH_API_VERSION}/{config.WHATSAPP_PHONE_NUMBER_ID}/messages"
-    headers = {"Authorization": f"Bearer {config.WHATSAPP_ACCESS_TOKEN}", "Content-Type": "application/json"}
-    payload = {"messaging_product": "whatsapp", "to": numero_destino, "type": "text", "text": {"body": mensagem_texto}}
-    
-    print(f"DEBUG WA_UTILS: Enviando para URL: {url}, Payload: {json.dumps(payload)}")
+    def send_async(self, numero_destino, mensagem_texto):
+        """Versão não bloqueante de send: retorna um Future com o resultado (True/False)."""
+        return self._executor.submit(self.send, numero_destino, mensagem_texto)
+
+    def fechar(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+_enviador_padrao = None
+_lock_enviador = threading.Lock()
+
+def obter_enviador():
+    """Enviador compartilhado pelo processo (criado na primeira utilização)."""
+    global _enviador_padrao
+    if _enviador_padrao is None:
+        with _lock_enviador:
+            if _enviador_padrao is None: _enviador_padrao = WhatsAppSender()
+    return _enviador_padrao
+
+def enviar_mensagem_whatsapp(numero_destino, mensagem_texto):
+    inicio = time.perf_counter()
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=15)
-        print(f"DEBUG WA_UTILS: Status Code da Meta: {response.status_code}")
-        response.raise_for_status()
-        response_data = response.json()
-        print(f"Resposta API WhatsApp (WA_UTILS): {json.dumps(response_data, indent=2)}")
-        if response_data.get("messages") and response_data["messages"][0].get("id"):
-            print(f"Mensagem enviada OK para {numero_destino}. ID: {response_data['messages'][0]['id']}")
-            return True
-        else: print(f"Resposta inesperada API WhatsApp (WA_UTILS): {response_data}"); return False
-    except requests.exceptions.HTTPError as http_err:
-        print(f"Erro HTTP enviando para {numero_destino} (WA_UTILS): {http_err}")
-        print(f"Detalhes erro API (WA_UTILS): {http_err.response.text if http_err.response else 'Sem detalhes'}")
-        return False
-    except Exception as e: print(f"Outro erro em enviar_mensagem_whatsapp (WA_UTILS): {e}"); return False
\ No newline at end of file
+        sucesso = obter_enviador().send(numero_destino, mensagem_texto)
+    except EnvioRecusado:
+        metricas.whatsapp_envio_segundos.observar(time.perf_counter() - inicio, resultado="recusada")
+        raise
+    metricas.whatsapp_envio_segundos.observar(time.perf_counter() - inicio, resultado="ok" if sucesso else "falha")
+    return sucesso